@@ -0,0 +1,387 @@
+#!/usr/bin/env python3
+"""
+FastTracker II Clone - ASYNCIFY call-graph analysis
+Builds a call graph of the C sources and works out which functions can be on the
+stack when the program sleeps (SDL_Delay(), SDL_RenderPresent(), ...). Asyncify
+only has to instrument those. Builds made with asyncify=remove (or only) link with
+the resulting ASYNCIFY_REMOVE (or ASYNCIFY_ONLY) list, so the mixer, libflac and
+the replayer tick run without the unwind/rewind checks a blanket -sASYNCIFY=1 puts
+into every function.
+"""
+
+import os
+import re
+import json
+import time
+import hashlib
+import argparse
+from pathlib import Path
+
+# Bump when the layout of the analysis file changes
+ANALYSIS_VERSION = 1
+
+SOURCE_PATTERNS = ["src/*.c", "src/*/*.c"]
+HEADER_PATTERNS = ["src/*.h", "src/*/*.h", "src/*/*/*.h"]
+
+# Calls that can unwind the stack under Asyncify. SDL2's Emscripten backend yields
+# to the browser in SDL_Delay(), the wait functions and when presenting a frame.
+BLOCKING_FUNCTIONS = {
+    "SDL_Delay", "SDL_WaitEvent", "SDL_WaitEventTimeout", "SDL_RenderPresent", "SDL_GL_SwapWindow",
+    "emscripten_sleep", "emscripten_sleep_with_yield", "emscripten_wget", "emscripten_wget_data",
+    "emscripten_idb_load", "emscripten_idb_store", "emscripten_idb_delete", "emscripten_idb_exists",
+    "usleep", "nanosleep", "sleep",
+}
+
+# Hot code that should run uninstrumented (ASYNCIFY_REMOVE), as long as the analysis
+# shows it can't reach a blocking call: mixer, FLAC decoder, replayer tick and the
+# audio callback that drives them
+HOT_MODULES = ["src/mixer/*.c", "src/libflac/*.c", "src/ft2_replayer.c", "src/ft2_audio.c"]
+
+# ASYNCIFY_ONLY also has to name everything outside our sources that is on the stack
+# while sleeping: the entry points and the SDL/Emscripten code between us and the sleep
+ONLY_EXTRA = ["main", "__main_argc_argv", "__original_main", "SDL_*", "Emscripten_*", "GLES2_*",
+              "emscripten_*", "_emscripten_*"] + sorted(BLOCKING_FUNCTIONS)
+
+C_KEYWORDS = {
+    "if", "else", "while", "for", "do", "switch", "case", "return", "sizeof", "typedef", "struct",
+    "union", "enum", "static", "const", "volatile", "inline", "extern", "goto", "break", "continue",
+    "default", "defined", "_Alignof", "alignof", "__attribute__", "__declspec", "__asm__", "asm",
+}
+
+STRIP_RE = re.compile(r'//[^\n]*|/\*.*?\*/|"(?:\\.|[^"\\\n])*"|\'(?:\\.|[^\'\\\n])*\'', re.S)
+DIRECTIVE_RE = re.compile(r'^[ \t]*#(?:[^\n\\]|\\.)*', re.M | re.S)
+DEFINE_RE = re.compile(r'^[ \t]*#[ \t]*define[ \t]+(\w+)((?:[^\n\\]|\\.)*)', re.M | re.S)
+CALL_RE = re.compile(r'(->|\.)?\s*\b([A-Za-z_]\w*)\s*\(')
+TABLE_CALL_RE = re.compile(r'\b([A-Za-z_]\w*)\s*\[[^\[\]]*\]\s*\(')
+DEREF_CALL_RE = re.compile(r'\(\s*\*\s*([A-Za-z_]\w*)\s*\)\s*\(')
+PARAMS = r'\(((?:[^()]|\((?:[^()]|\([^()]*\))*\))*)\)'
+FUNC_POINTER_DECL_RE = re.compile(r'(\btypedef\b[^;{}]*?)?\(\s*\*\s*([A-Za-z_]\w*)\s*\)\s*' + PARAMS)
+POINTER_TYPEDEF_RE = re.compile(r'\btypedef\b[^;{}()]*\*\s*([A-Za-z_]\w*)\s*;')
+IDENT_RE = re.compile(r'\b[A-Za-z_]\w*\b')
+FUNC_HEADER_RE = re.compile(r'\b([A-Za-z_]\w*)\s*' + PARAMS + r'\s*$')
+INITIALIZER_RE = re.compile(r'\b([A-Za-z_]\w*)\s*(?:\[[^\]]*\]\s*)*=\s*$')
+
+def strip_source(text):
+    """Blank out comments and string/char literals, keeping preprocessor lines"""
+    return STRIP_RE.sub(lambda m: ' ' if m.group(0).startswith('/') else '""', text)
+
+def split_top_level(text):
+    """Yield (header, body) for every top-level brace block: functions, initializers, structs"""
+    depth = 0
+    start = 0
+    header_start = 0
+    for index, char in enumerate(text):
+        if char == '{':
+            if depth == 0:
+                start = index
+            depth += 1
+        elif char == '}' and depth:
+            depth -= 1
+            if depth == 0:
+                yield text[header_start:start], text[start + 1:index]
+                header_start = index + 1
+        elif char == ';' and depth == 0:
+            header_start = index + 1
+
+def split_params(params):
+    """Split a parameter or argument list at its top-level commas"""
+    parts, depth, current = [], 0, ''
+    for char in params:
+        if char in '([{':
+            depth += 1
+        elif char in ')]}':
+            depth -= 1
+        elif char == ',' and depth == 0:
+            parts.append(current.strip())
+            current = ''
+            continue
+        current += char
+    if current.strip():
+        parts.append(current.strip())
+    return parts
+
+def call_arity(body, open_index):
+    """Number of arguments of the call whose '(' is at open_index"""
+    depth = 0
+    for index in range(open_index, len(body)):
+        if body[index] == '(':
+            depth += 1
+        elif body[index] == ')':
+            depth -= 1
+            if depth == 0:
+                return len(split_params(body[open_index + 1:index]))
+    return None
+
+class CallGraph:
+    """Call graph of the C sources, with function pointers handled conservatively.
+
+    Calls through a known table (`tab[i](...)`) can reach every function in the table's
+    initializer. Any other indirect call can reach every function whose address is taken
+    and whose signature is compatible: same number of parameters, and each one the same
+    kind (pointer, floating point or integer). Both #if branches are followed, so the
+    graph over-approximates the real one.
+    """
+
+    def __init__(self):
+        self.functions = {}         # name -> {"files", "calls", "params"}
+        self.tables = {}            # initialized global name -> identifiers in its initializer
+        self.macros = {}            # macro name -> identifiers used in its body
+        self.pointer_params = {}    # function pointer variable/member/typedef -> parameter lists
+        self.pointer_typedefs = set()
+        self.declarations = []
+        self.address_taken = set()
+        self.bodies = []
+
+    def add_headers(self, texts):
+        for text in texts:
+            self.scan_declarations(strip_source(text))
+
+    def scan_declarations(self, text):
+        for name, body in DEFINE_RE.findall(text):
+            self.macros[name] = set(IDENT_RE.findall(body))
+        for typedef, name, params in FUNC_POINTER_DECL_RE.findall(text):
+            self.pointer_params.setdefault(name, []).append(params)
+            if typedef:
+                self.pointer_typedefs.add(name)
+        self.pointer_typedefs.update(POINTER_TYPEDEF_RE.findall(text))
+        self.declarations.append(text)
+
+    def add_source(self, rel, text):
+        text = strip_source(text)
+        self.scan_declarations(text)
+        code = DIRECTIVE_RE.sub(' ', text)
+        for header, body in split_top_level(code):
+            function = FUNC_HEADER_RE.search(header)
+            if function and '=' not in header and function.group(1) not in C_KEYWORDS:
+                self.bodies.append((function.group(1), rel, function.group(2), body))
+                continue
+            initializer = INITIALIZER_RE.search(header)
+            if initializer:
+                self.tables.setdefault(initializer.group(1), set()).update(IDENT_RE.findall(body))
+
+    def expand_macros(self, names, seen=None):
+        """Identifiers used through macros, transitively"""
+        seen = set() if seen is None else seen
+        expanded = set()
+        for name in names:
+            if name in self.macros and name not in seen:
+                seen.add(name)
+                expanded |= self.macros[name]
+                expanded |= self.expand_macros(self.macros[name], seen)
+        return expanded
+
+    def param_kinds(self, params):
+        """Coarse signature: one of p/f/i per parameter, or None for variadic or unprototyped"""
+        params = split_params(params)
+        if params in ([], ['void']):
+            return ()
+        if '...' in params:
+            return None
+        kinds = []
+        for param in params:
+            words = set(IDENT_RE.findall(param))
+            if '*' in param or '[' in param or words & self.pointer_typedefs:
+                kinds.append('p')
+            elif words & {'float', 'double'}:
+                kinds.append('f')
+            else:
+                kinds.append('i')
+        return tuple(kinds)
+
+    def resolve_pointer_types(self):
+        """Give variables and members declared with a function pointer typedef its parameters"""
+        typedefs = {name: self.pointer_params[name] for name in self.pointer_typedefs if name in self.pointer_params}
+        if not typedefs:
+            return
+        declared_re = re.compile(r'\b(' + '|'.join(map(re.escape, typedefs)) + r')\b\s*\*?\s*(?:const\s+)?([A-Za-z_]\w*)')
+        for text in self.declarations:
+            for type_name, name in declared_re.findall(text):
+                if name not in typedefs:
+                    self.pointer_params.setdefault(name, []).extend(typedefs[type_name])
+
+    def indirect_targets(self, signatures, arity):
+        """Address-taken functions an indirect call with these signatures (or this arity) can reach"""
+        targets = set()
+        for name in self.address_taken:
+            kinds = self.functions[name]["params"]
+            if kinds is None:
+                targets.add(name)
+            elif signatures:
+                if any(signature is None or signature == kinds for signature in signatures):
+                    targets.add(name)
+            elif arity is None or len(kinds) == arity:
+                targets.add(name)
+        return targets
+
+    def finish(self):
+        """Resolve direct and indirect calls once every definition is known"""
+        self.resolve_pointer_types()
+        defined = {name for name, rel, params, body in self.bodies}
+        for name, rel, params, body in self.bodies:
+            entry = self.functions.setdefault(name, {"files": set(), "calls": set(), "params": ()})
+            entry["files"].add(rel)
+            entry["params"] = self.param_kinds(params)
+        for name in self.tables:
+            self.tables[name] &= defined
+            self.address_taken |= self.tables[name]
+        for name, rel, params, body in self.bodies:
+            # Function names used as values: passed as callbacks, stored in structs, ...
+            self.address_taken |= {ident for ident in set(IDENT_RE.findall(body)) & defined
+                                   if re.search(r'\b' + ident + r'\b(?!\s*\()', body)}
+
+        for name, rel, params, body in self.bodies:
+            entry = self.functions[name]
+            identifiers = set(IDENT_RE.findall(body))
+            indirect = []
+            for match in CALL_RE.finditer(body):
+                member, callee = match.groups()
+                if callee in C_KEYWORDS:
+                    continue
+                if member or (callee not in defined and callee in self.pointer_params):
+                    indirect.append((callee, match.end() - 1))
+                elif callee in defined or callee in BLOCKING_FUNCTIONS:
+                    entry["calls"].add(callee)
+            for match in DEREF_CALL_RE.finditer(body):
+                indirect.append((match.group(1), match.end() - 1))
+            for match in TABLE_CALL_RE.finditer(body):
+                if match.group(1) in self.tables:
+                    entry["calls"] |= self.tables[match.group(1)]
+                else:
+                    indirect.append((match.group(1), match.end() - 1))
+            for callee, open_index in indirect:
+                signatures = [self.param_kinds(p) for p in self.pointer_params.get(callee, [])]
+                entry["calls"] |= self.indirect_targets(signatures, call_arity(body, open_index))
+            entry["calls"] |= self.expand_macros(identifiers) & (defined | BLOCKING_FUNCTIONS)
+
+    def may_sleep(self):
+        """Map every function that can reach a blocking call to the callee that leads there"""
+        callers = {}
+        for name, entry in self.functions.items():
+            for callee in entry["calls"]:
+                callers.setdefault(callee, []).append(name)
+        # Breadth-first from the blocking calls, so each reason is a shortest chain
+        reasons = {name: None for name in BLOCKING_FUNCTIONS}
+        queue = sorted(BLOCKING_FUNCTIONS)
+        while queue:
+            callee = queue.pop(0)
+            for caller in sorted(callers.get(callee, [])):
+                if caller not in reasons:
+                    reasons[caller] = callee
+                    queue.append(caller)
+        return reasons
+
+def chain(reasons, name):
+    """The call chain from a function down to the blocking call it reaches"""
+    path = [name]
+    while reasons.get(path[-1]) is not None and len(path) < 32:
+        path.append(reasons[path[-1]])
+    return path
+
+def source_files(script_dir, patterns):
+    return sorted({p for pattern in patterns for p in Path(script_dir).glob(pattern)})
+
+def fingerprint(script_dir):
+    """Hash of the names, sizes and mtimes of every analyzed file"""
+    digest = hashlib.sha256()
+    for path in source_files(script_dir, SOURCE_PATTERNS + HEADER_PATTERNS):
+        st = path.stat()
+        digest.update(f"{path.relative_to(script_dir).as_posix()}:{st.st_size}:{st.st_mtime_ns}\n".encode())
+    return digest.hexdigest()
+
+def analyze(script_dir, excluded=()):
+    """Analyze the sources; returns the lists and the numbers behind them"""
+    script_dir = Path(script_dir)
+    excluded = {Path(p) for p in excluded}
+    graph = CallGraph()
+    graph.add_headers(p.read_text(errors='replace') for p in source_files(script_dir, HEADER_PATTERNS))
+    for path in source_files(script_dir, SOURCE_PATTERNS):
+        if path not in excluded:
+            graph.add_source(path.relative_to(script_dir).as_posix(), path.read_text(errors='replace'))
+    graph.finish()
+    reasons = graph.may_sleep()
+
+    hot_files = {p.relative_to(script_dir).as_posix() for p in source_files(script_dir, HOT_MODULES)}
+    hot = {name for name, entry in graph.functions.items() if entry["files"] & hot_files}
+    sleeping = sorted(name for name in graph.functions if name in reasons)
+    return {
+        "version": ANALYSIS_VERSION,
+        "functions": len(graph.functions),
+        "may_sleep": {name: chain(reasons, name)[1:] for name in sleeping},
+        "remove": sorted(hot - set(reasons)),
+        "hot_kept": sorted(hot & set(reasons)),
+        "only": sorted(set(sleeping) | set(ONLY_EXTRA)),
+    }
+
+def load_or_analyze(script_dir, analysis_file, excluded=()):
+    """Reuse the analysis in analysis_file while the sources are unchanged"""
+    key = fingerprint(script_dir) + ":" + ",".join(sorted(str(p) for p in excluded))
+    try:
+        analysis = json.loads(Path(analysis_file).read_text())
+        if analysis.get("version") == ANALYSIS_VERSION and analysis.get("key") == key:
+            return analysis
+    except (OSError, ValueError):
+        pass
+    analysis = analyze(script_dir, excluded)
+    analysis["key"] = key
+    Path(analysis_file).parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = Path(str(analysis_file) + ".tmp")
+    tmp_file.write_text(json.dumps(analysis, indent=1, sort_keys=True))
+    os.replace(tmp_file, analysis_file)
+    return analysis
+
+def write_list(analysis, mode, list_file):
+    """Write the ASYNCIFY_REMOVE or ASYNCIFY_ONLY list as JSON for -sASYNCIFY_<MODE>=@file"""
+    names = analysis[mode]
+    text = json.dumps(names)
+    try:
+        if Path(list_file).read_text() == text:
+            return names
+    except OSError:
+        pass
+    Path(list_file).write_text(text)
+    return names
+
+def print_report(analysis, verbose=False):
+    """Summarize which functions stay instrumented and why"""
+    print(f"{analysis['functions']} functions, {len(analysis['may_sleep'])} can reach a blocking call")
+    print(f"ASYNCIFY_REMOVE: {len(analysis['remove'])} hot functions left uninstrumented")
+    print(f"ASYNCIFY_ONLY: {len(analysis['only'])} names")
+    if analysis["hot_kept"]:
+        print(f"{len(analysis['hot_kept'])} hot functions stay instrumented because they can sleep:")
+        for name in analysis["hot_kept"]:
+            print(f"  {' -> '.join([name] + analysis['may_sleep'][name])}")
+    if verbose:
+        print("Functions that can reach a blocking call:")
+        for name, path in sorted(analysis["may_sleep"].items()):
+            print(f"  {' -> '.join([name] + path)}")
+
+def parse_arguments():
+    """Parse command line arguments"""
+    script_dir = Path(__file__).parent
+    parser = argparse.ArgumentParser(description="Work out which functions Asyncify has to instrument")
+    parser.add_argument('-o', '--output', default=None,
+                        help="write the full analysis as JSON (default: build_emscripten/asyncify-analysis.json)")
+    parser.add_argument('--remove-list', default=None, metavar='FILE',
+                        help="also write the ASYNCIFY_REMOVE list to FILE")
+    parser.add_argument('--only-list', default=None, metavar='FILE',
+                        help="also write the ASYNCIFY_ONLY list to FILE")
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help="print the call chain of every function that can sleep")
+    parser.add_argument('--source-dir', default=str(script_dir), help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+def main():
+    """Main entry point"""
+    args = parse_arguments()
+    output = args.output or str(Path(args.source_dir) / "build_emscripten" / "asyncify-analysis.json")
+    start = time.perf_counter()
+    analysis = load_or_analyze(args.source_dir, output)
+    print_report(analysis, args.verbose)
+    if args.remove_list:
+        write_list(analysis, "remove", args.remove_list)
+    if args.only_list:
+        write_list(analysis, "only", args.only_list)
+    print(f"Analysis: {output} ({time.perf_counter() - start:.2f}s)")
+
+if __name__ == "__main__":
+    main()
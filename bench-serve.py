@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+"""
+FastTracker II Clone - Load benchmark for the WebAssembly delivery servers
+Starts serve.py, serve-web.py (or any server command) on a loopback port, replays
+page loads (HTML, JS, wasm, data and module fetches) at a given concurrency and
+reports throughput, latency percentiles, bytes/s and errors as JSON.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import socket
+import argparse
+import threading
+import subprocess
+import http.client
+import urllib.parse
+from pathlib import Path
+
+# Metrics compared against a baseline: (key path, label, True if higher is better)
+COMPARED_METRICS = [
+    (("throughput_rps",), "throughput (req/s)", True),
+    (("bytes_per_s",), "bytes/s", True),
+    (("latency_ms", "p50"), "p50 latency (ms)", False),
+    (("latency_ms", "p95"), "p95 latency (ms)", False),
+    (("latency_ms", "p99"), "p99 latency (ms)", False),
+]
+
+def percentile(sorted_values, percent):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(percent / 100.0 * len(sorted_values))))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+def summarize(latencies):
+    """Latency summary in milliseconds"""
+    values = sorted(latencies)
+    return {
+        "p50": round(percentile(values, 50) * 1000, 3),
+        "p95": round(percentile(values, 95) * 1000, 3),
+        "p99": round(percentile(values, 99) * 1000, 3),
+        "max": round(values[-1] * 1000, 3) if values else 0.0,
+        "mean": round(sum(values) / len(values) * 1000, 3) if values else 0.0,
+    }
+
+def find_free_port():
+    """Ask the OS for an unused loopback port"""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def wait_for_port(port, process, timeout):
+    """Wait until the server accepts connections; False if it exited or timed out"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            return False
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.2):
+                return True
+        except OSError:
+            time.sleep(0.05)
+    return False
+
+def get_page_load_mix(build_dir):
+    """URLs fetched by one page load, in browser order, as (kind, path) pairs"""
+    web_dir = build_dir / "web"
+    names = {name: name for name in ["ft2-clone.js", "ft2-clone.wasm", "ft2-clone.data"]}
+    try:
+        names.update(json.loads((web_dir / "asset-manifest.json").read_text()))
+    except (OSError, ValueError):
+        pass
+
+    mix = [("html", "/web/ft2-clone.html")]
+    for kind, name in [("js", "ft2-clone.js"), ("wasm", "ft2-clone.wasm"), ("data", "ft2-clone.data")]:
+        if (web_dir / names[name]).exists():
+            mix.append((kind, f"/web/{names[name]}"))
+
+    module_paths = []
+    modules_dir = web_dir / "web_user" / "modules"
+    if modules_dir.is_dir():
+        module_paths = sorted(p.relative_to(web_dir).as_posix() for p in modules_dir.rglob('*') if p.is_file())
+    return mix, ["/web/" + urllib.parse.quote(p) for p in module_paths]
+
+class LoadGenerator:
+    """Runs page loads on keep-alive connections from a pool of worker threads"""
+
+    def __init__(self, port, mix, module_urls, modules_per_visit, headers, revisit):
+        self.port = port
+        self.mix = mix
+        self.module_urls = module_urls
+        self.modules_per_visit = modules_per_visit
+        self.headers = headers
+        self.revisit = revisit
+        self.lock = threading.Lock()
+        self.samples = []
+        self.statuses = {}
+        self.errors = 0
+        self.bytes = 0
+        self.visits = 0
+        self.etags = {}
+
+    def fetch(self, conn, kind, path, conditional):
+        headers = dict(self.headers)
+        if conditional and path in self.etags:
+            headers["If-None-Match"] = self.etags[path]
+        start = time.perf_counter()
+        conn.request("GET", path, headers=headers)
+        response = conn.getresponse()
+        body = response.read()
+        elapsed = time.perf_counter() - start
+        etag = response.getheader("ETag")
+        with self.lock:
+            self.samples.append((kind, elapsed))
+            self.statuses[response.status] = self.statuses.get(response.status, 0) + 1
+            self.bytes += len(body)
+            if response.status >= 400:
+                self.errors += 1
+            if etag:
+                self.etags[path] = etag
+        return response
+
+    def worker(self, stop, remaining, rng):
+        conn = None
+        while not stop.is_set():
+            with self.lock:
+                if remaining is not None:
+                    if remaining[0] <= 0:
+                        return
+                    remaining[0] -= 1
+            conditional = rng.random() < self.revisit
+            urls = list(self.mix)
+            if self.module_urls:
+                urls += [("module", rng.choice(self.module_urls)) for _ in range(self.modules_per_visit)]
+            for kind, path in urls:
+                if stop.is_set():
+                    break
+                try:
+                    if conn is None:
+                        conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=30)
+                    response = self.fetch(conn, kind, path, conditional)
+                    if response.will_close:
+                        conn.close()
+                        conn = None
+                except (OSError, http.client.HTTPException):
+                    with self.lock:
+                        self.errors += 1
+                    if conn:
+                        conn.close()
+                    conn = None
+            with self.lock:
+                self.visits += 1
+        if conn:
+            conn.close()
+
+    def run(self, concurrency, duration, visits, seed):
+        stop = threading.Event()
+        remaining = [visits] if visits else None
+        threads = [threading.Thread(target=self.worker, args=(stop, remaining, random.Random(seed + i)), daemon=True)
+                   for i in range(concurrency)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        if visits:
+            for thread in threads:
+                thread.join()
+        else:
+            time.sleep(duration)
+            stop.set()
+            for thread in threads:
+                thread.join()
+        return time.perf_counter() - start
+
+    def report(self, elapsed):
+        latencies = [elapsed_s for _, elapsed_s in self.samples]
+        per_kind = {}
+        for kind in sorted({kind for kind, _ in self.samples}):
+            values = [elapsed_s for k, elapsed_s in self.samples if k == kind]
+            per_kind[kind] = {"requests": len(values), "latency_ms": summarize(values)}
+        return {
+            "duration_s": round(elapsed, 3),
+            "visits": self.visits,
+            "requests": len(self.samples),
+            "throughput_rps": round(len(self.samples) / elapsed, 2) if elapsed else 0.0,
+            "bytes": self.bytes,
+            "bytes_per_s": round(self.bytes / elapsed, 1) if elapsed else 0.0,
+            "errors": self.errors,
+            "status": {str(status): count for status, count in sorted(self.statuses.items())},
+            "latency_ms": summarize(latencies),
+            "per_kind": per_kind,
+        }
+
+def compare_to_baseline(result, baseline, threshold_percent):
+    """Print a before/after table to stderr and return the regressed metrics"""
+    regressions = []
+    print(f"  {'metric':<22} {'baseline':>14} {'current':>14} {'change':>9}", file=sys.stderr)
+    for keys, label, higher_is_better in COMPARED_METRICS:
+        before, after = baseline, result
+        for key in keys:
+            before = before.get(key, {}) if isinstance(before, dict) else None
+            after = after.get(key, {}) if isinstance(after, dict) else None
+        if not isinstance(before, (int, float)) or not isinstance(after, (int, float)):
+            continue
+        change = 100.0 * (after - before) / before if before else 0.0
+        worse = -change if higher_is_better else change
+        regressed = worse >= threshold_percent
+        if regressed:
+            regressions.append(label)
+        print(f"  {label:<22} {before:>14.2f} {after:>14.2f} {change:>+8.1f}%" + ("  REGRESSION" if regressed else ""),
+              file=sys.stderr)
+    if result.get("errors", 0) > baseline.get("errors", 0):
+        regressions.append("errors")
+        print(f"  {'errors':<22} {baseline.get('errors', 0):>14} {result['errors']:>14}  REGRESSION", file=sys.stderr)
+    return regressions
+
+def start_server(args, script_dir, build_dir, port):
+    """Start the server under test; returns the process"""
+    if args.command:
+        cmd = args.command.format(port=port, python=sys.executable)
+        return subprocess.Popen(cmd, shell=True, cwd=build_dir,
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    script = script_dir / args.server
+    cmd = [sys.executable, str(script), str(port)] + args.server_args
+    return subprocess.Popen(cmd, cwd=build_dir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+def parse_arguments():
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(description="Benchmark the FT2 Clone delivery servers on loopback")
+    parser.add_argument('--server', default='serve.py', choices=['serve.py', 'serve-web.py'],
+                        help="server script to benchmark (default: serve.py)")
+    parser.add_argument('--command', default=None,
+                        help="benchmark another server instead: shell command run in build_emscripten, "
+                             "with {port} and {python} substituted")
+    parser.add_argument('--server-args', nargs=argparse.REMAINDER, default=[],
+                        help="extra arguments passed to the server script (must come last)")
+    parser.add_argument('--port', type=int, default=0, help="port to use (default: a free one)")
+    parser.add_argument('-c', '--concurrency', type=int, default=16,
+                        help="concurrent simulated clients (default: 16)")
+    parser.add_argument('-d', '--duration', type=float, default=10.0,
+                        help="seconds to run (default: 10)")
+    parser.add_argument('-n', '--visits', type=int, default=0,
+                        help="run a fixed number of page loads instead of a fixed duration")
+    parser.add_argument('--modules', type=int, default=2,
+                        help="module fetches per page load (default: 2)")
+    parser.add_argument('--accept-encoding', default='gzip, br',
+                        help="Accept-Encoding sent with every request ('' for none; default: 'gzip, br')")
+    parser.add_argument('--revisit', type=float, default=0.0,
+                        help="fraction of page loads that revalidate with If-None-Match (default: 0)")
+    parser.add_argument('--warmup', type=int, default=1,
+                        help="page loads per client before measuring (default: 1)")
+    parser.add_argument('--seed', type=int, default=1, help="random seed for the module picks")
+    parser.add_argument('-o', '--output', default=None, help="write the JSON result to this file")
+    parser.add_argument('--baseline', default=None, help="JSON result of an earlier run to compare against")
+    parser.add_argument('--threshold', type=float, default=10.0,
+                        help="percent change counted as a regression (default: 10)")
+    return parser.parse_args()
+
+def main():
+    """Main entry point"""
+    args = parse_arguments()
+    script_dir = Path(__file__).parent.absolute()
+    build_dir = script_dir / "build_emscripten"
+    if not (build_dir / "web" / "ft2-clone.html").exists():
+        print(f"Error: Build output not found in {build_dir}")
+        print("Please run the build script first:")
+        print("  python3 build-emscripten.py")
+        sys.exit(1)
+
+    mix, module_urls = get_page_load_mix(build_dir)
+    headers = {"Accept-Encoding": args.accept_encoding} if args.accept_encoding else {}
+    port = args.port or find_free_port()
+    server = start_server(args, script_dir, build_dir, port)
+    try:
+        if not wait_for_port(port, server, timeout=15):
+            print(f"Error: server did not start listening on port {port}")
+            sys.exit(1)
+
+        if args.warmup:
+            LoadGenerator(port, mix, module_urls, args.modules, headers, 0.0).run(
+                args.concurrency, 0, args.warmup * args.concurrency, args.seed)
+
+        print(f"Benchmarking {args.command or args.server} on port {port}: {args.concurrency} clients, "
+              + (f"{args.visits} page loads" if args.visits else f"{args.duration:g}s"), file=sys.stderr)
+        generator = LoadGenerator(port, mix, module_urls, args.modules, headers, args.revisit)
+        elapsed = generator.run(args.concurrency, args.duration, args.visits, args.seed)
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            server.kill()
+
+    result = {
+        "server": args.command or args.server,
+        "concurrency": args.concurrency,
+        "accept_encoding": args.accept_encoding,
+        "revisit": args.revisit,
+        "mix": [path for _, path in mix] + (["module"] * args.modules if module_urls else []),
+    }
+    result.update(generator.report(elapsed))
+
+    text = json.dumps(result, indent=1)
+    if args.output:
+        Path(args.output).write_text(text + "\n")
+    print(text)
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text())
+        print(f"Comparing against {args.baseline}:", file=sys.stderr)
+        regressions = compare_to_baseline(result, baseline, args.threshold)
+        if regressions:
+            print(f"Regressions (>= {args.threshold:g}%): {', '.join(regressions)}", file=sys.stderr)
+            sys.exit(1)
+        print("No regressions found", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -5,11 +5,28 @@ This script builds the project for WebAssembly using Emscripten on any platform.
 """
 
 import os
+import re
 import sys
+import json
+import gzip
+import hashlib
+import argparse
+import select
+import struct
+import tempfile
+import threading
+import time
 import subprocess
 import shutil
+import stat
 import platform
 from pathlib import Path
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from module_catalog import update_catalog
+from size_units import parse_size
+import asyncify_lists
 
 # ANSI color codes for cross-platform colored output
 class Colors:
@@ -32,6 +49,18 @@ class Colors:
 
 Colors.disable_on_windows()
 
+# Bump when the layout of build_emscripten/obj/objects.json changes
+OBJECT_MANIFEST_VERSION = 1
+
+# Shared compile cache location and size cap (overridable on the command line)
+DEFAULT_CACHE_DIR = os.environ.get('FT2_COMPILE_CACHE', str(Path.home() / ".cache" / "ft2-clone" / "emcc"))
+DEFAULT_CACHE_MAX_SIZE = os.environ.get('FT2_COMPILE_CACHE_SIZE', '2G')
+# Persistent EM_CACHE (SDL2 port, libc and other system libraries), one subdirectory per emcc version
+DEFAULT_EM_CACHE = os.environ.get('FT2_EM_CACHE', str(Path.home() / ".cache" / "ft2-clone" / "emscripten"))
+# `emcc --version` answers, keyed by emcc path and install fingerprint
+TOOLCHAIN_CACHE_FILE = Path(os.environ.get('FT2_TOOLCHAIN_CACHE',
+                                           str(Path.home() / ".cache" / "ft2-clone" / "toolchain.json")))
+
 def print_colored(message, color=Colors.NC):
     """Print colored message"""
     print(f"{color}{message}{Colors.NC}")
@@ -55,14 +84,160 @@ def run_command(cmd, description, cwd=None, check=True):
             sys.exit(1)
         return e
 
-def check_emscripten():
-    """Check if Emscripten is installed and available"""
+class BuildProfiler:
+    """Records build phases as Chrome trace events (chrome://tracing, Perfetto)"""
+
+    def __init__(self):
+        self.enabled = False
+        self.events = []
+        self.thread_ids = {}
+        self.lock = threading.Lock()
+        self.origin = time.perf_counter()
+
+    def _tid(self):
+        """Map Python thread idents to small, stable trace thread ids"""
+        ident = threading.get_ident()
+        with self.lock:
+            return self.thread_ids.setdefault(ident, len(self.thread_ids))
+
+    def record(self, name, category, start, end, **args):
+        """Add a complete event from perf_counter() timestamps"""
+        if not self.enabled:
+            return
+        event = {
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": round((start - self.origin) * 1e6),
+            "dur": round((end - start) * 1e6),
+            "pid": 1,
+            "tid": self._tid(),
+        }
+        if args:
+            event["args"] = args
+        with self.lock:
+            self.events.append(event)
+
+    @contextmanager
+    def phase(self, name, category="phase", **args):
+        """Time the enclosed block as one trace event"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, category, start, time.perf_counter(), **args)
+
+    def write(self, trace_file):
+        """Write the trace in Chrome trace event JSON format"""
+        metadata = [{"name": "process_name", "ph": "M", "pid": 1, "args": {"name": "build-emscripten"}}]
+        for tid in sorted(self.thread_ids.values()):
+            label = "main" if tid == 0 else f"compile worker {tid}"
+            metadata.append({"name": "thread_name", "ph": "M", "pid": 1, "tid": tid, "args": {"name": label}})
+        Path(trace_file).write_text(json.dumps({"traceEvents": metadata + self.events, "displayTimeUnit": "ms"}))
+        print_colored(f"Build profile written to {trace_file}", Colors.GREEN)
+
+profiler = BuildProfiler()
+
+def load_trace_durations(trace_file):
+    """Sum event durations (in ms) per (category, name) from a Chrome trace file"""
+    data = json.loads(Path(trace_file).read_text())
+    events = data["traceEvents"] if isinstance(data, dict) else data
+    durations = {}
+    for event in events:
+        if event.get("ph") != "X":
+            continue
+        key = (event.get("cat", ""), event["name"])
+        durations[key] = durations.get(key, 0.0) + event.get("dur", 0) / 1000.0
+    return durations
+
+def compare_profiles(old_trace, new_trace, threshold_percent, min_ms):
+    """Diff two build traces and flag phases or files that got slower; returns the number flagged"""
+    old = load_trace_durations(old_trace)
+    new = load_trace_durations(new_trace)
+
+    rows = []
+    for key in set(old) | set(new):
+        before = old.get(key, 0.0)
+        after = new.get(key, 0.0)
+        delta = after - before
+        percent = 100.0 * delta / before if before else float('inf') if after else 0.0
+        slower = delta >= min_ms and percent >= threshold_percent
+        rows.append((slower, delta, key, before, after, percent))
+    rows.sort(key=lambda row: (row[2][0] != "phase", -row[1]))
+
+    print_colored(f"Comparing {old_trace} -> {new_trace}", Colors.GREEN)
+    print(f"  {'category':<8} {'name':<44} {'before':>10} {'after':>10} {'delta':>10}")
+    for slower, delta, (category, name), before, after, percent in rows:
+        # Keep the table readable: every phase, but only files that moved noticeably
+        if category != "phase" and abs(delta) < min_ms:
+            continue
+        line = f"  {category:<8} {name:<44} {before:>8.0f}ms {after:>8.0f}ms {delta:>+8.0f}ms"
+        print_colored(line + ("  SLOWER" if slower else ""), Colors.RED if slower else Colors.NC)
+
+    flagged = sum(1 for row in rows if row[0])
+    if flagged:
+        print_colored(f"{flagged} phases/files got slower by >= {threshold_percent:g}% and >= {min_ms:g}ms", Colors.RED)
+    else:
+        print_colored("No regressions found", Colors.GREEN)
+    return flagged
+
+def toolchain_fingerprint(emcc):
+    """Identify an emcc install by the files that an emsdk update or reconfiguration rewrites"""
+    emcc = Path(emcc).resolve()
+    parts = [emcc.as_posix(), os.environ.get('EM_CONFIG', '')]
+    for path in (emcc, emcc.with_suffix('.py'), emcc.parent / "emscripten-version.txt",
+                 emcc.parent / ".emscripten", Path(os.environ.get('EM_CONFIG', emcc.parent / ".emscripten"))):
+        try:
+            st = path.stat()
+        except OSError:
+            continue
+        parts.append(f"{path.name}:{st.st_mtime_ns}:{st.st_size}")
+    return hash_strings(parts)
+
+def get_emcc_version():
+    """Get the first line of `emcc --version`, or None if emcc is not available.
+
+    Starting emcc costs a Python interpreter and a clang probe, so the answer is
+    cached in TOOLCHAIN_CACHE_FILE and reused until the emcc found on PATH, its
+    mtime or its version file changes.
+    """
+    emcc = shutil.which('emcc')
+    if not emcc:
+        return None
+    fingerprint = toolchain_fingerprint(emcc)
+    try:
+        probes = json.loads(TOOLCHAIN_CACHE_FILE.read_text())
+    except (OSError, ValueError):
+        probes = {}
+    probe = probes.get(emcc)
+    if probe and probe.get("fingerprint") == fingerprint:
+        return probe["version"]
+
     try:
         result = subprocess.run(['emcc', '--version'], capture_output=True, text=True, check=True)
+        version = result.stdout.splitlines()[0].strip()
+    except (subprocess.CalledProcessError, FileNotFoundError, IndexError):
+        return None
+    probes[emcc] = {"fingerprint": fingerprint, "version": version, "probed": round(time.time())}
+    try:
+        TOOLCHAIN_CACHE_FILE.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(dir=TOOLCHAIN_CACHE_FILE.parent, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(probes, f, indent=1)
+        os.replace(tmp_name, TOOLCHAIN_CACHE_FILE)
+    except OSError:
+        # A read-only home only costs the next build another probe
+        pass
+    return version
+
+def check_emscripten():
+    """Check if Emscripten is installed and available"""
+    version = get_emcc_version()
+    if version:
         print_colored("Emscripten found!", Colors.GREEN)
-        print_colored(f"Version: {result.stdout.splitlines()[0]}", Colors.YELLOW)
+        print_colored(f"Version: {version}", Colors.YELLOW)
         return True
-    except (subprocess.CalledProcessError, FileNotFoundError):
+    else:
         print_colored("Error: Emscripten not found!", Colors.RED)
         print_colored("Please install Emscripten SDK from: https://emscripten.org/docs/getting_started/downloads.html", Colors.RED)
         if platform.system() == 'Windows':
@@ -79,22 +254,22 @@ def get_cpu_count():
     except:
         return 4
 
-def setup_build_environment():
+def setup_build_environment(clean=False, build_dir=None):
     """Set up the build environment"""
     # Get script directory
     script_dir = Path(__file__).parent.absolute()
-    build_dir = script_dir / "build_emscripten"
+    build_dir = build_dir or script_dir / "build_emscripten"
     
     print_colored("Setting up build environment...", Colors.GREEN)
     
-    # Remove existing build directory
-    if build_dir.exists():
+    # Only --clean removes the build directory; normal builds keep objects and synced assets
+    if clean and build_dir.exists():
         print_colored("Removing existing build directory...", Colors.YELLOW)
         shutil.rmtree(build_dir)
     
     # Create build directory structure
     print_colored("Creating build directory...", Colors.GREEN)
-    build_dir.mkdir(exist_ok=True)
+    build_dir.mkdir(parents=True, exist_ok=True)
     (build_dir / "web").mkdir(exist_ok=True)
     (build_dir / "web" / "assets").mkdir(exist_ok=True)
     
@@ -117,20 +292,116 @@ Supported formats: .xm, .ft, .nst, .stk, .mod, .s3m, .stm, .fst, .digi, .bem, .i
     
     return script_dir, build_dir
 
-def copy_assets(script_dir, build_dir):
-    """Copy web assets if they exist"""
-    # Copy web assets
-    web_assets = script_dir / "web" / "assets"
-    if web_assets.exists():
-        print_colored("Copying web assets...", Colors.GREEN)
-        shutil.copytree(web_assets, build_dir / "web" / "assets", dirs_exist_ok=True)
+def load_sync_manifest(build_dir):
+    """Load the per-tree file fingerprints recorded by the last asset sync"""
+    try:
+        return json.loads((build_dir / "sync-manifest.json").read_text())
+    except (OSError, ValueError):
+        return {}
+
+def save_sync_manifest(build_dir, manifest):
+    """Write the asset sync manifest atomically"""
+    manifest_file = build_dir / "sync-manifest.json"
+    tmp_file = manifest_file.with_suffix('.json.tmp')
+    tmp_file.write_text(json.dumps(manifest, indent=1, sort_keys=True))
+    os.replace(tmp_file, manifest_file)
+
+def sync_tree(src_dir, dst_dir, records, link=False):
+    """Mirror src_dir into dst_dir, only copying, linking or deleting files that changed.
     
-    # Copy web_user directory  
-    web_user_src = script_dir / "web" / "web_user"
-    web_user_dst = build_dir / "web" / "web_user"
-    if web_user_src.exists():
-        print_colored("Copying web_user directory for VFS mapping...", Colors.GREEN)
-        shutil.copytree(web_user_src, web_user_dst, dirs_exist_ok=True)
+    `records` maps relative paths to [size, mtime_ns, sha256] of the source at the
+    last sync, plus the mtime_ns the output had after it, and is updated in place.
+    An output whose mtime changed since is hashed instead of trusted.
+    Returns counts per action.
+    """
+    counts = {"copied": 0, "linked": 0, "removed": 0, "unchanged": 0}
+    seen = set()
+
+    for src in sorted(p for p in src_dir.rglob('*') if p.is_file()):
+        rel = src.relative_to(src_dir).as_posix()
+        dst = dst_dir / rel
+        seen.add(rel)
+        st = src.stat()
+        record = records.get(rel)
+        dst_st = dst.stat() if dst.is_file() else None
+        dst_ok = dst_st is not None and dst_st.st_size == st.st_size
+        src_same = record is not None and record[0] == st.st_size and record[1] == st.st_mtime_ns
+        dst_same = dst_ok and record is not None and len(record) > 3 and record[3] == dst_st.st_mtime_ns
+        if src_same and dst_same:
+            counts["unchanged"] += 1
+            continue
+
+        digest = record[2] if src_same else hash_file(src)
+        # Without a record (first sync) or after the output was touched, an
+        # identical existing output is still reused
+        if dst_ok and digest == (record[2] if dst_same else hash_file(dst)):
+            counts["unchanged"] += 1
+        else:
+            dst.parent.mkdir(parents=True, exist_ok=True)
+            linked = False
+            if link:
+                try:
+                    if dst.exists():
+                        dst.unlink()
+                    os.link(src, dst)
+                    linked = True
+                except OSError:
+                    # Different filesystem or no hard link support: fall back to copying
+                    pass
+            if not linked:
+                atomic_copy(src, dst)
+                shutil.copystat(src, dst)
+            counts["linked" if linked else "copied"] += 1
+        records[rel] = [st.st_size, st.st_mtime_ns, digest, dst.stat().st_mtime_ns]
+
+    # Remove outputs whose source disappeared, and any directories left empty
+    for rel in sorted(set(records) - seen):
+        del records[rel]
+        dst = dst_dir / rel
+        if dst.is_file():
+            dst.unlink()
+            counts["removed"] += 1
+        parent = dst.parent
+        while parent != dst_dir and parent.is_dir() and not any(parent.iterdir()):
+            parent.rmdir()
+            parent = parent.parent
+
+    return counts
+
+def copy_assets(script_dir, build_dir, link=False):
+    """Sync web assets and the web_user directory into the build directory"""
+    manifest = load_sync_manifest(build_dir)
+    trees = [
+        ("assets", "web assets"),
+        ("web_user", "web_user directory for VFS mapping"),
+    ]
+    for name, description in trees:
+        src_dir = script_dir / "web" / name
+        if not src_dir.exists():
+            continue
+        print_colored(f"Syncing {description}...", Colors.GREEN)
+        counts = sync_tree(src_dir, build_dir / "web" / name, manifest.setdefault(name, {}), link)
+        print_colored("  " + ", ".join(f"{count} {action}" for action, count in counts.items()), Colors.CYAN)
+    save_sync_manifest(build_dir, manifest)
+
+def write_user_file_manifest(build_dir):
+    """List the synced web_user files with their sizes and hashes for lazy loading.
+
+    Reuses the fingerprints recorded by the asset sync, so nothing is hashed again.
+    Returns the number of files listed.
+    """
+    records = load_sync_manifest(build_dir).get("web_user", {})
+    manifest = {
+        "version": 1,
+        "base": "web_user/",
+        "files": [{"path": rel, "size": size, "sha256": digest}
+                  for rel, (size, mtime_ns, digest, *_) in sorted(records.items())],
+    }
+    manifest_file = build_dir / "web" / "web_user-manifest.json"
+    tmp_file = manifest_file.with_suffix('.json.tmp')
+    tmp_file.write_text(json.dumps(manifest, separators=(',', ':')))
+    os.replace(tmp_file, manifest_file)
+    return len(manifest["files"])
 
 def backup_and_restore_cmake(script_dir):
     """Context manager to backup and restore CMakeLists.txt"""
@@ -160,7 +431,64 @@ def backup_and_restore_cmake(script_dir):
     
     return CMakeBackup(script_dir)
 
-def get_source_files(script_dir):
+# Build variant matrix: each axis maps its values to extra compiler flags, linker flags
+# and excluded sources. A plain build uses DEFAULT_VARIANT; --variant and --variants
+# build others (see run_variant_matrix).
+VARIANT_AXES = {
+    "opt": {
+        "O2": {"cflags": ["-O2"], "ldflags": ["-O2"]},
+        "O3": {"cflags": ["-O3"], "ldflags": ["-O3"]},
+        "Os": {"cflags": ["-Os"], "ldflags": ["-Os"]},
+        "Oz": {"cflags": ["-Oz"], "ldflags": ["-Oz"]},
+    },
+    "flac": {
+        "on": {"cflags": ["-DHAS_LIBFLAC"]},
+        # ft2_load_flac.c compiles to nothing without HAS_LIBFLAC
+        "off": {"exclude": ["src/libflac/*.c"]},
+    },
+    "lto": {
+        "off": {},
+        "on": {"cflags": ["-flto"], "ldflags": ["-flto"]},
+    },
+    "simd": {
+        "off": {},
+        "on": {"cflags": ["-msimd128"], "ldflags": ["-msimd128"]},
+    },
+    # all: blanket -sASYNCIFY=1; remove/only: link with the lists from asyncify_lists.py.
+    # The lists come from a source-level call graph, so they stay opt-in until a
+    # build linked with them has been run through every blocking path
+    "asyncify": {
+        "all": {},
+        "remove": {"asyncify": ["remove"]},
+        "only": {"asyncify": ["only"]},
+    },
+}
+DEFAULT_VARIANT = {"opt": "O3", "flac": "on", "lto": "off", "simd": "off", "asyncify": "all"}
+
+def variant_settings(variant, key):
+    """Collect one kind of setting (cflags, ldflags, exclude) over all axes of a variant"""
+    variant = variant or DEFAULT_VARIANT
+    return [item for axis, values in VARIANT_AXES.items() for item in values[variant[axis]].get(key, [])]
+
+def variant_name(variant):
+    """Short directory name: the first axis, then every axis that differs from the default"""
+    axes = list(VARIANT_AXES)
+    return "-".join([variant[axes[0]]] + [f"{axis}-{variant[axis]}" for axis in axes[1:]
+                                          if variant[axis] != DEFAULT_VARIANT[axis]])
+
+def parse_variant_setting(text):
+    """argparse type for AXIS=VALUE[,VALUE...]; returns (axis, [values])"""
+    axis, sep, values = text.partition('=')
+    if not sep or axis not in VARIANT_AXES:
+        raise argparse.ArgumentTypeError(f"expected AXIS=VALUE with AXIS one of {', '.join(VARIANT_AXES)}")
+    values = list(VARIANT_AXES[axis]) if values == '*' else values.split(',')
+    for value in values:
+        if value not in VARIANT_AXES[axis]:
+            raise argparse.ArgumentTypeError(f"unknown {axis} value {value!r}, expected one of "
+                                             f"{', '.join(VARIANT_AXES[axis])} or *")
+    return axis, values
+
+def get_source_files(script_dir, variant=None):
     """Get all source files for compilation"""
     source_patterns = [
         "src/*.c",
@@ -172,26 +500,19 @@ def get_source_files(script_dir):
         "src/libflac/*.c"
     ]
     
+    excluded = {f for pattern in variant_settings(variant, "exclude") for f in script_dir.glob(pattern)}
     all_source_files = []
     for pattern in source_patterns:
-        files = list(script_dir.glob(pattern))
+        files = [f for f in script_dir.glob(pattern) if f not in excluded]
         all_source_files.extend([str(f) for f in files])
     
     print_colored(f"Found {len(all_source_files)} source files", Colors.GREEN)
     return all_source_files
 
-def build_with_direct_emcc(script_dir, build_dir):
-    """Build using direct emcc compilation (like PowerShell script)"""
-    print_colored("Building with direct emcc compilation...", Colors.GREEN)
-    
-    # Get source files
-    source_files = get_source_files(script_dir)
-    
-    # Define compiler flags
-    compiler_flags = [
-        "-O3",
+def get_compiler_flags(variant=None):
+    """Get the flags used to compile every translation unit"""
+    return variant_settings(variant, "cflags") + [
         "-DNDEBUG", 
-        "-DHAS_LIBFLAC",
         "-D__EMSCRIPTEN__",
         "-Wall",
         "-Wno-unused-result",
@@ -202,8 +523,9 @@ def build_with_direct_emcc(script_dir, build_dir):
         "-I", "src/mixer", 
         "-I", "src/scopes"
     ]
-    
-    # Define linker flags
+
+def get_linker_flags(script_dir, lazy_user_files=False, chunked_packages=False):
+    """Get the flags used for the final link, including preloaded files"""
     linker_flags = [
         "-sUSE_SDL=2",
         "-sALLOW_MEMORY_GROWTH=1", 
@@ -215,34 +537,1009 @@ def build_with_direct_emcc(script_dir, build_dir):
         "-sEXPORTED_FUNCTIONS=_main,_malloc,_free,_refreshModuleDirectory",
         "-sFORCE_FILESYSTEM=1",
         "-lidbfs.js",
-        f"--embed-file={script_dir}/src/gfxdata/bmp@/",
         f"--shell-file={script_dir}/web/shell.html"
     ]
     
+    if chunked_packages:
+        # UI bitmaps, demo modules and sample packs come from web/packages, see build_data_packages()
+        linker_flags.append(f"--pre-js={script_dir}/web/chunked-packages.js")
+        print_colored("Loading VFS contents from chunked data packages", Colors.CYAN)
+    else:
+        linker_flags.append(f"--embed-file={script_dir}/src/gfxdata/bmp@/")
+
     # Add preload files if they exist
-    preload_flags = []
     web_user_dir = script_dir / "web" / "web_user"
-    if web_user_dir.exists():
-        preload_flags.extend([
+    if lazy_user_files:
+        # web_user is fetched file by file at runtime, see write_user_file_manifest()
+        linker_flags.append(f"--pre-js={script_dir}/web/lazy-user-files.js")
+        print_colored("Loading web_user lazily instead of preloading it", Colors.CYAN)
+    elif web_user_dir.exists() and not chunked_packages:
+        linker_flags.extend([
             f"--preload-file={web_user_dir}@/home/web_user"
         ])
         print_colored("Including web_user directory in VFS", Colors.CYAN)
     
-    # Output file
-    output_file = build_dir / "web" / "ft2-clone.html"
+    return linker_flags
+
+def hash_file(path):
+    """Get the SHA-256 hex digest of a file's contents"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def hash_strings(values):
+    """Get a stable SHA-256 hex digest of a list of strings"""
+    return hashlib.sha256(json.dumps(list(values)).encode('utf-8')).hexdigest()
+
+def dependency_key(path, script_dir):
+    """Get the manifest key for a dependency (relative to the repo when possible)"""
+    path = Path(path)
+    if not path.is_absolute():
+        path = script_dir / path
+    try:
+        return path.resolve().relative_to(script_dir).as_posix()
+    except ValueError:
+        return path.resolve().as_posix()
+
+def parse_depfile(dep_file):
+    """Parse a make-style dependency file written by `emcc -MMD` into a list of paths"""
+    text = dep_file.read_text().replace('\\\n', ' ')
+    if ': ' not in text:
+        return []
+    prerequisites = text.split(': ', 1)[1]
+    return [token.replace('\\ ', ' ') for token in re.split(r'(?<!\\)\s+', prerequisites.strip()) if token]
+
+def fingerprint_dependencies(paths, script_dir):
+    """Record size, mtime and content hash for each dependency"""
+    deps = {}
+    for path in paths:
+        key = dependency_key(path, script_dir)
+        full_path = script_dir / key
+        st = full_path.stat()
+        deps[key] = [st.st_mtime_ns, st.st_size, hash_file(full_path)]
+    return deps
+
+def dependencies_unchanged(deps, script_dir):
+    """Check recorded dependencies, rehashing only files whose mtime or size moved"""
+    for key, record in deps.items():
+        mtime_ns, size, digest = record
+        path = script_dir / key
+        try:
+            st = path.stat()
+        except OSError:
+            return False
+        if st.st_mtime_ns == mtime_ns and st.st_size == size:
+            continue
+        if st.st_size != size or hash_file(path) != digest:
+            return False
+        # Touched but identical: remember the new mtime so we don't rehash next time
+        record[0] = st.st_mtime_ns
+    return True
+
+def load_object_manifest(obj_dir):
+    """Load the incremental build manifest (source -> object fingerprint)"""
+    manifest_file = obj_dir / "objects.json"
+    if manifest_file.exists():
+        try:
+            manifest = json.loads(manifest_file.read_text())
+            if manifest.get("version") == OBJECT_MANIFEST_VERSION:
+                return manifest
+        except (OSError, ValueError):
+            print_colored("Object manifest is unreadable, rebuilding all objects", Colors.YELLOW)
+    return {"version": OBJECT_MANIFEST_VERSION, "objects": {}}
+
+def save_object_manifest(obj_dir, manifest):
+    """Write the incremental build manifest atomically"""
+    manifest_file = obj_dir / "objects.json"
+    tmp_file = manifest_file.with_suffix('.json.tmp')
+    tmp_file.write_text(json.dumps(manifest, indent=1, sort_keys=True))
+    os.replace(tmp_file, manifest_file)
+
+def get_object_path(source, script_dir, obj_dir):
+    """Map a source file to its object file, mirroring the source tree"""
+    rel = Path(source).relative_to(script_dir)
+    return obj_dir / rel.with_suffix('.o')
+
+def get_include_dirs(script_dir, compiler_flags):
+    """Get the -I include directories from a compiler flag list"""
+    return [script_dir / flag for prev, flag in zip(compiler_flags, compiler_flags[1:]) if prev == "-I"]
+
+class IncludeGraph:
+    """Persistent #include graph of the source tree.
+
+    Files are rescanned only when their mtime/size moved and their content hash
+    changed. Includes under #if are all followed, so the graph may over-approximate
+    what the preprocessor really reads, never under-approximate it.
+    """
+
+    INCLUDE_RE = re.compile(rb'^[ \t]*#[ \t]*include[ \t]*([<"])([^">]+)[">]', re.M)
+
+    def __init__(self, script_dir, include_dirs, index_file):
+        self.script_dir = script_dir
+        self.include_dirs = include_dirs
+        self.index_file = index_file
+        self.files = {}
+        try:
+            data = json.loads(index_file.read_text())
+            if data.get("include_dirs") == [d.as_posix() for d in include_dirs]:
+                self.files = data["files"]
+        except (OSError, ValueError):
+            pass
+
+    def save(self):
+        """Persist the graph next to the objects"""
+        self.index_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = self.index_file.with_suffix('.json.tmp')
+        tmp_file.write_text(json.dumps({
+            "include_dirs": [d.as_posix() for d in self.include_dirs],
+            "files": self.files,
+        }, indent=1, sort_keys=True))
+        os.replace(tmp_file, self.index_file)
+
+    def resolve(self, including_file, name, quoted):
+        """Resolve an include to a repo-relative path, or None for system headers"""
+        search = ([(self.script_dir / including_file).parent] if quoted else []) + self.include_dirs
+        for directory in search:
+            candidate = directory / name
+            if candidate.is_file():
+                return dependency_key(candidate, self.script_dir)
+        return None
+
+    def scan(self, rel):
+        """Read the direct includes of one file"""
+        data = (self.script_dir / rel).read_bytes()
+        includes = []
+        for kind, name in self.INCLUDE_RE.findall(data):
+            resolved = self.resolve(rel, name.decode('utf-8', 'replace'), kind == b'"')
+            if resolved and resolved not in includes:
+                includes.append(resolved)
+        return hashlib.sha256(data).hexdigest(), includes
+
+    def refresh(self, translation_units):
+        """Bring the graph up to date; returns the set of files that changed"""
+        changed = set()
+        seen = set()
+        pending = list(translation_units)
+        while pending:
+            rel = pending.pop()
+            if rel in seen:
+                continue
+            seen.add(rel)
+            path = self.script_dir / rel
+            record = self.files.get(rel)
+            try:
+                st = path.stat()
+            except OSError:
+                continue
+            if not record or record["mtime_ns"] != st.st_mtime_ns or record["size"] != st.st_size:
+                digest, includes = self.scan(rel)
+                if not record or record["hash"] != digest:
+                    changed.add(rel)
+                record = {"mtime_ns": st.st_mtime_ns, "size": st.st_size, "hash": digest, "includes": includes}
+                self.files[rel] = record
+            pending.extend(record["includes"])
+
+        for rel in list(self.files):
+            if rel not in seen:
+                del self.files[rel]
+                changed.add(rel)
+        return changed
     
-    # Build the command
-    cmd = ["emcc"] + compiler_flags + source_files + linker_flags + preload_flags + ["-o", str(output_file)]
+    def affected(self, changed, translation_units):
+        """Map every translation unit that reaches a changed file to its include chain"""
+        dependents = {}
+        for rel, record in self.files.items():
+            for include in record["includes"]:
+                dependents.setdefault(include, []).append(rel)
+
+        # Breadth-first from the changed files up to the translation units, keeping the shortest chain
+        chains = {rel: [rel] for rel in changed}
+        queue = list(changed)
+        while queue:
+            rel = queue.pop(0)
+            for parent in dependents.get(rel, []):
+                if parent not in chains:
+                    chains[parent] = [parent] + chains[rel]
+                    queue.append(parent)
+        return {tu: chains[tu] for tu in translation_units if tu in chains}
+
+def explain_rebuild(script_dir, build_dir, changed_files):
+    """Print which translation units a change would rebuild, and why"""
+    translation_units = [Path(f).relative_to(script_dir).as_posix() for f in get_source_files(script_dir)]
+    graph = IncludeGraph(script_dir, get_include_dirs(script_dir, get_compiler_flags()),
+                         build_dir / "obj" / "includes.json")
+    detected = graph.refresh(translation_units)
     
-    print_colored(f"Running emcc with {len(cmd)} arguments...", Colors.YELLOW)
+    if changed_files:
+        changed = {dependency_key(Path(f).absolute(), script_dir) for f in changed_files}
+        print_colored(f"Explaining rebuild for: {', '.join(sorted(changed))}", Colors.GREEN)
+    else:
+        changed = detected
+        print_colored("Explaining rebuild for changes since the last build", Colors.GREEN)
+        for rel in sorted(changed):
+            print(f"  changed: {rel}")
     
-    # Change to script directory for relative paths
-    old_cwd = os.getcwd()
+    affected = graph.affected(changed, translation_units)
+    total = len(translation_units)
+    percent = 100.0 * len(affected) / total if total else 0.0
+    color = Colors.RED if percent >= 50 else Colors.CYAN
+    print_colored(f"{len(affected)} of {total} translation units would be rebuilt ({percent:.1f}%)", color)
+    for tu in sorted(affected):
+        print(f"  {' -> '.join(affected[tu])}")
+    if percent >= 50:
+        print_colored("Warning: this change triggers a near-full rebuild", Colors.YELLOW)
+
+def format_size(num_bytes):
+    """Format a byte count for humans"""
+    for unit in ('B', 'KB', 'MB'):
+        if abs(num_bytes) < 1024:
+            return f"{num_bytes:.1f} {unit}" if unit != 'B' else f"{num_bytes} B"
+        num_bytes /= 1024
+    return f"{num_bytes:.1f} GB"
+
+def atomic_copy(src, dst):
+    """Copy a file so that readers only ever see the old or the complete new file"""
+    dst = Path(dst)
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_name = tempfile.mkstemp(dir=dst.parent, prefix=dst.name + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as tmp, open(src, 'rb') as f:
+            shutil.copyfileobj(f, tmp)
+        os.replace(tmp_name, dst)
+    except BaseException:
+        if os.path.exists(tmp_name):
+            os.unlink(tmp_name)
+        raise
+
+def codegen_flags(compiler_flags):
+    """Drop -D and -I flags: they only act on the preprocessor, whose output is hashed anyway.
+
+    Objects from builds that differ only in defines (e.g. the flac=on/off variants) are
+    then shared for every file the define doesn't change.
+    """
+    flags = []
+    skip = False
+    for flag in compiler_flags:
+        if skip:
+            skip = False
+        elif flag in ("-D", "-I"):
+            skip = True
+        elif not flag.startswith(("-D", "-I")):
+            flags.append(flag)
+    return flags
+
+class CompileCache:
+    """Content-addressed object store shared between checkouts (ccache-style).
+
+    Objects are keyed by the preprocessed source, the code generation flags and the
+    emcc version. Every write is atomic, so concurrent builds may share one directory.
+    """
+
+    def __init__(self, cache_dir, max_size, emcc_version):
+        self.cache_dir = Path(cache_dir).expanduser()
+        self.objects_dir = self.cache_dir / "objects"
+        self.max_size = max_size
+        self.emcc_version = emcc_version or ""
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self.lock = threading.Lock()
+        self.objects_dir.mkdir(parents=True, exist_ok=True)
+
+    def compute_key(self, script_dir, source, compiler_flags, dep_file):
+        """Preprocess a source file and hash it with the flags, or None if preprocessing fails"""
+        cmd = ["emcc"] + compiler_flags + ["-MMD", "-MF", str(dep_file), "-E", source]
+        result = subprocess.run(cmd, cwd=script_dir, capture_output=True)
+        if result.returncode != 0:
+            # Let the real compile produce the diagnostics
+            return None
+        digest = hashlib.sha256()
+        digest.update(hash_strings(codegen_flags(compiler_flags) + [self.emcc_version]).encode('ascii'))
+        digest.update(result.stdout)
+        return digest.hexdigest()
+
+    def entry_path(self, key):
+        """Get the path of a cached object"""
+        return self.objects_dir / key[:2] / (key[2:] + ".o")
+
+    def fetch(self, key, obj_file):
+        """Copy a cached object into place; returns True on a hit"""
+        cached = self.entry_path(key)
+        try:
+            atomic_copy(cached, obj_file)
+            # Bump the mtime so eviction treats it as recently used
+            os.utime(cached)
+        except FileNotFoundError:
+            with self.lock:
+                self.misses += 1
+            return False
+        with self.lock:
+            self.hits += 1
+            self.bytes_saved += cached.stat().st_size
+        return True
+
+    def store(self, key, obj_file):
+        """Add a freshly compiled object to the cache"""
+        atomic_copy(obj_file, self.entry_path(key))
+
+    def evict(self):
+        """Delete least recently used objects until the cache fits its size cap"""
+        entries = []
+        total = 0
+        for path in self.objects_dir.glob("*/*.o"):
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+        if total <= self.max_size:
+            return 0
+
+        removed = 0
+        for _, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += 1
+        print_colored(f"Compile cache: evicted {removed} objects to stay under {format_size(self.max_size)}", Colors.YELLOW)
+        return removed
+
+    def load_stats(self):
+        """Load the cumulative hit/miss counters"""
+        try:
+            return json.loads((self.cache_dir / "stats.json").read_text())
+        except (OSError, ValueError):
+            return {"hits": 0, "misses": 0, "bytes_saved": 0}
+
+    def save_stats(self):
+        """Fold this build's counters into the cumulative ones"""
+        stats = self.load_stats()
+        stats["hits"] += self.hits
+        stats["misses"] += self.misses
+        stats["bytes_saved"] += self.bytes_saved
+        stats_file = self.cache_dir / "stats.json"
+        fd, tmp_name = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(stats, f)
+        os.replace(tmp_name, stats_file)
+
+    def print_stats(self):
+        """Print cumulative cache statistics"""
+        stats = self.load_stats()
+        sizes = [p.stat().st_size for p in self.objects_dir.glob("*/*.o")]
+        lookups = stats["hits"] + stats["misses"]
+        hit_rate = 100.0 * stats["hits"] / lookups if lookups else 0.0
+        print_colored(f"Compile cache: {self.cache_dir}", Colors.GREEN)
+        print(f"  Objects:     {len(sizes)} ({format_size(sum(sizes))} of {format_size(self.max_size)})")
+        print(f"  Hits:        {stats['hits']}")
+        print(f"  Misses:      {stats['misses']}")
+        print(f"  Hit rate:    {hit_rate:.1f}%")
+        print(f"  Bytes saved: {format_size(stats['bytes_saved'])}")
+
+class EmscriptenCache:
+    """Persistent EM_CACHE shared by every build and variant, with port build accounting.
+
+    emcc builds the SDL2 port and the system libraries (libc, libGL, ...) on the
+    first link that needs them and keeps them in EM_CACHE. Pointing EM_CACHE at a
+    directory outside emsdk, one per emcc version, lets CI cache it and keeps
+    toolchain updates from wiping it. Links run through run() report every
+    library emcc had to build and how long it took.
+    """
+
+    BUILD_RE = re.compile(r'generating (?:system library|port): (\S+?)(?:\.\.\.|\s|$)')
+    DONE_RE = re.compile(r'^cache:INFO:\s+- ok')
+
+    def __init__(self):
+        self.root = None
+        self.cache_dir = None
+
+    def configure(self, root, emcc_version):
+        """Export EM_CACHE for every emcc this build starts"""
+        self.root = Path(root).expanduser()
+        match = re.search(r'\d+\.\d+\.\d+[\w.-]*', emcc_version or "")
+        slug = f"{match.group(0) if match else 'unknown'}-{hashlib.sha256((emcc_version or '').encode()).hexdigest()[:8]}"
+        self.cache_dir = self.root / slug
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        os.environ['EM_CACHE'] = str(self.cache_dir)
+        return self.cache_dir
+
+    def run(self, cmd, description, cwd=None):
+        """Run an emcc link like run_command(), timing each library it builds; returns [(library, seconds)]"""
+        print_colored(f"Running: {description}", Colors.CYAN)
+        print_colored(f"Command: {' '.join(cmd)}", Colors.YELLOW)
+        built = []
+        building = []
+        process = subprocess.Popen(cmd, cwd=cwd, stderr=subprocess.PIPE, text=True, errors='replace')
+        for line in process.stderr:
+            sys.stderr.write(line)
+            now = time.perf_counter()
+            match = self.BUILD_RE.search(line)
+            if match:
+                building.append((Path(match.group(1)).name, now))
+            elif self.DONE_RE.match(line) and building:
+                # Ports can pull in other libraries, so builds may nest
+                name, start = building.pop()
+                built.append((name, now - start))
+                profiler.record(f"build {name}", "em-cache", start, now)
+        returncode = process.wait()
+        end = time.perf_counter()
+        built.extend((name, end - start) for name, start in reversed(building))
+
+        self.save_stats(built)
+        if built:
+            total = sum(seconds for _, seconds in built)
+            print_colored(f"Emscripten cache: {len(built)} {'miss' if len(built) == 1 else 'misses'}, {total:.1f}s spent building "
+                          f"{', '.join(f'{name} ({seconds:.1f}s)' for name, seconds in built)}", Colors.YELLOW)
+        else:
+            print_colored("Emscripten cache: hit, every port and system library was already built", Colors.CYAN)
+
+        if returncode != 0:
+            print_colored(f"Error: Command failed with exit code {returncode}", Colors.RED)
+            sys.exit(1)
+        return built
+
+    def load_stats(self):
+        """Load the cumulative counters kept next to the per-version caches"""
+        try:
+            return json.loads((self.root / "stats.json").read_text())
+        except (OSError, ValueError, TypeError):
+            return {"links": 0, "warm_links": 0, "built": 0, "build_seconds": 0.0}
+
+    def save_stats(self, built):
+        """Fold one link into the cumulative counters"""
+        if not self.root:
+            return
+        stats = self.load_stats()
+        stats["links"] += 1
+        stats["warm_links"] += 0 if built else 1
+        stats["built"] += len(built)
+        stats["build_seconds"] = round(stats["build_seconds"] + sum(seconds for _, seconds in built), 2)
+        fd, tmp_name = tempfile.mkstemp(dir=self.root, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(stats, f)
+        os.replace(tmp_name, self.root / "stats.json")
+
+    def print_stats(self, root):
+        """Print cumulative port cache statistics and the size of each toolchain's cache"""
+        self.root = Path(root).expanduser()
+        stats = self.load_stats()
+        print_colored(f"Emscripten cache: {self.root}", Colors.GREEN)
+        for version_dir in sorted(self.root.glob("*/")):
+            size = sum(p.stat().st_size for p in version_dir.rglob("*") if p.is_file())
+            print(f"  {version_dir.name + ':':<24} {format_size(size)}")
+        print(f"  Links:       {stats['links']} ({stats['warm_links']} found everything cached)")
+        print(f"  Misses:      {stats['built']} ports/system libraries built")
+        print(f"  Time spent:  {stats['build_seconds']:.1f}s building them")
+
+em_cache = EmscriptenCache()
+
+# The stub link in --prewarm has no shell, assets or FT2 exports
+PREWARM_SKIPPED_FLAGS = ("--shell-file", "--embed-file", "--preload-file", "--pre-js", "-sEXPORTED_FUNCTIONS")
+
+def prewarm_em_cache(script_dir, variants):
+    """Link a stub program with each variant's flags so emcc builds every port and library the real link needs.
+
+    Using the real link flags rather than a list of embuilder targets keeps this
+    in step with whatever the build links against. Returns [(library, seconds)].
+    """
+    base_flags = [flag for flag in get_linker_flags(script_dir) if not flag.startswith(PREWARM_SKIPPED_FLAGS)]
+    work_dir = Path(tempfile.mkdtemp(prefix="ft2-prewarm-"))
+    built = []
+    seen = set()
     try:
-        os.chdir(script_dir)
-        run_command(cmd, "Direct emcc compilation")
+        stub = work_dir / "prewarm.c"
+        stub.write_text("int main(void)\n{\n\treturn 0;\n}\n")
+        for variant in variants:
+            # Defines and excluded sources don't change which libraries are linked
+            flags = [flag for flag in variant_settings(variant, "cflags") if not flag.startswith("-D")]
+            flags += variant_settings(variant, "ldflags")
+            if tuple(flags) in seen:
+                continue
+            seen.add(tuple(flags))
+            cmd = ["emcc"] + flags + [str(stub)] + base_flags + ["-o", str(work_dir / "prewarm.js")]
+            with profiler.phase(f"prewarm {variant_name(variant)}"):
+                built += em_cache.run(cmd, f"Prewarming the Emscripten cache for {variant_name(variant)}",
+                                      cwd=script_dir)
     finally:
-        os.chdir(old_cwd)
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return built
+
+def compile_translation_unit(script_dir, source, obj_file, compiler_flags, cache=None):
+    """Compile one source file to an object, returning (returncode, output, cached)"""
+    start = time.perf_counter()
+    obj_file.parent.mkdir(parents=True, exist_ok=True)
+    dep_file = obj_file.with_suffix('.d')
+    # Relative paths keep preprocessed output (and so cache keys) identical across checkouts
+    rel_source = Path(source).relative_to(script_dir).as_posix()
+
+    key = None
+    if cache:
+        with profiler.phase(f"preprocess {rel_source}", "cache"):
+            key = cache.compute_key(script_dir, rel_source, compiler_flags, dep_file)
+        if key and cache.fetch(key, obj_file):
+            profiler.record(rel_source, "compile", start, time.perf_counter(), cached=True)
+            return 0, "", True
+
+    cmd = ["emcc"] + compiler_flags + ["-MMD", "-MF", str(dep_file), "-c", rel_source, "-o", str(obj_file)]
+    result = subprocess.run(cmd, cwd=script_dir, capture_output=True, text=True)
+    if result.returncode == 0 and key:
+        cache.store(key, obj_file)
+    profiler.record(rel_source, "compile", start, time.perf_counter(), cached=False, returncode=result.returncode)
+    return result.returncode, result.stdout + result.stderr, False
+
+def print_compile_result(index, total, rel, output, cached=False):
+    """Print the progress line and compiler output for one translation unit"""
+    print_colored(f"[{index}/{total}] {'Cached' if cached else 'Compiling'} {rel}", Colors.BLUE)
+    if output:
+        print(output, end='' if output.endswith('\n') else '\n')
+
+def compile_objects(script_dir, stale, compiler_flags, jobs, on_success, cache=None):
+    """Compile (source, object) pairs with up to `jobs` concurrent emcc processes.
+
+    Each file's output is buffered and printed as one block, in source order.
+    The first failure cancels everything still queued; its source path is returned.
+    """
+    total = len(stale)
+    results = {}
+    failed = None
+    next_to_print = 0
+
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        futures = {
+            executor.submit(compile_translation_unit, script_dir, source, obj_file, compiler_flags, cache): index
+            for index, (source, obj_file) in enumerate(stale)
+        }
+        try:
+            for future in as_completed(futures):
+                if future.cancelled():
+                    continue
+                index = futures[future]
+                source, obj_file = stale[index]
+                returncode, output, cached = future.result()
+                results[index] = (output, cached)
+                if returncode == 0:
+                    on_success(source, obj_file)
+                elif failed is None:
+                    failed = index
+                    for pending in futures:
+                        pending.cancel()
+
+                while next_to_print in results:
+                    rel = Path(stale[next_to_print][0]).relative_to(script_dir).as_posix()
+                    print_compile_result(next_to_print + 1, total, rel, *results.pop(next_to_print))
+                    next_to_print += 1
+        except KeyboardInterrupt:
+            for pending in futures:
+                pending.cancel()
+            raise
+
+    # Files that finished after a cancelled gap are still reported, in order
+    for index in sorted(results):
+        rel = Path(stale[index][0]).relative_to(script_dir).as_posix()
+        print_compile_result(index + 1, total, rel, *results[index])
+
+    if failed is not None:
+        return Path(stale[failed][0]).relative_to(script_dir).as_posix()
+    return None
+
+UNITY_PATTERNS = ["src/*.c", "src/mixer/*.c", "src/scopes/*.c", "src/modloaders/*.c", "src/smploaders/*.c"]
+UNITY_PLAN_VERSION = 1
+
+POINTER_DECLARATOR_RE = re.compile(r'\(\s*\*\s*([A-Za-z_]\w*)\s*\)')
+PROTOTYPE_NAME_RE = re.compile(r'([A-Za-z_]\w*)\s*\(')
+DECLARATOR_NAME_RE = re.compile(r'([A-Za-z_]\w*)\s*(?:\[[^\]]*\]\s*)*$')
+TAG_RE = re.compile(r'\b(?:struct|union|enum)\s+([A-Za-z_]\w*)\s*$')
+INCLUDE_LINE_RE = re.compile(r'^[ \t]*#[ \t]*include\b', re.M)
+CONDITIONAL_RE = re.compile(r'^[ \t]*#[ \t]*(ifdef|ifndef|if|elif|else|endif)\b(.*)$')
+DEFINED_RE = re.compile(r'^(!?)\s*(?:defined\s*\(?\s*)?([A-Za-z_]\w*|\d+)\s*\)?$')
+
+# What the preprocessor knows about the target when it reads the sources
+PLATFORM_MACROS = {"__EMSCRIPTEN__": True, "_WIN32": False, "_WIN64": False, "_MSC_VER": False, "__APPLE__": False}
+
+def evaluate_condition(kind, expression):
+    """Evaluate a simple #if/#ifdef/#ifndef condition: True, False or None if unknown"""
+    if kind != "if":
+        expression = ("!" if kind == "ifndef" else "") + f"defined({expression})"
+    match = DEFINED_RE.match(expression.strip())
+    if not match:
+        return None
+    negate, name = match.groups()
+    value = bool(int(name)) if name.isdigit() else PLATFORM_MACROS.get(name)
+    return value if value is None or not negate else not value
+
+def drop_inactive_branches(text):
+    """Blank out #if branches that can't be taken on this platform, keeping unknown ones"""
+    lines = text.split('\n')
+    stack = []  # [enclosing branch active, an earlier branch was taken, every earlier branch was false]
+    active = True
+    for index, line in enumerate(lines):
+        match = CONDITIONAL_RE.match(line)
+        if match:
+            kind, expression = match.group(1), match.group(2).strip()
+            if kind in ("if", "ifdef", "ifndef"):
+                value = evaluate_condition(kind, expression)
+                stack.append([active, value is True, value is False])
+                active = active and value is not False
+            elif stack and kind == "elif":
+                value = False if stack[-1][1] else evaluate_condition("if", expression)
+                if not stack[-1][2] and value is True:
+                    value = None
+                stack[-1][1] = stack[-1][1] or (value is True and stack[-1][2])
+                stack[-1][2] = stack[-1][2] and value is False
+                active = stack[-1][0] and value is not False
+            elif stack and kind == "else":
+                active = stack[-1][0] and not stack[-1][1]
+            elif stack and kind == "endif":
+                active = stack.pop()[0]
+            lines[index] = ''
+        elif not active:
+            lines[index] = ''
+    return '\n'.join(lines)
+
+def read_macros(text):
+    """Map each macro a file #defines to its (whitespace-normalized) definition"""
+    return {name: ' '.join(body.replace('\\\n', ' ').split()) for name, body in asyncify_lists.DEFINE_RE.findall(text)}
+
+def declared_name(declarator):
+    """Get the identifier a declarator declares ('*foo[4]', '(*fn)(int)', 'f(void)', 'x = 1')"""
+    declarator = declarator.split('=', 1)[0].strip()
+    match = POINTER_DECLARATOR_RE.search(declarator)
+    if match:
+        return match.group(1)
+    match = (PROTOTYPE_NAME_RE if '(' in declarator else DECLARATOR_NAME_RE).search(declarator)
+    if match and match.group(1) not in asyncify_lists.C_KEYWORDS:
+        return match.group(1)
+    return None
+
+def scan_file_scope(path):
+    """Collect what a translation unit puts in file scope.
+
+    Returns a dict with "private" (statics, typedefs, tags and enum constants),
+    "exported" (non-static definitions), "macros" (#define name -> definition) and
+    "macro_before_include" (a #define ahead of the first #include, e.g. a feature
+    macro that only works before any system header has been read).
+    """
+    text = drop_inactive_branches(asyncify_lists.strip_source(Path(path).read_text(errors='replace')))
+    defines = list(asyncify_lists.DEFINE_RE.finditer(text))
+    first_include = INCLUDE_LINE_RE.search(text)
+    code = asyncify_lists.DIRECTIVE_RE.sub(' ', text)
+
+    private, exported = set(), set()
+    statement = ''
+    depth = 0
+    body_start = 0
+    for index, char in enumerate(code):
+        if depth:
+            depth += {'{': 1, '}': -1}.get(char, 0)
+            if depth:
+                continue
+            if re.search(r'\benum\b[^;]*$', statement):
+                for item in asyncify_lists.split_params(code[body_start:index]):
+                    if item.split('=', 1)[0].strip():
+                        private.add(item.split('=', 1)[0].strip())
+            if statement.rstrip().endswith(')'):
+                # A function definition ends at its closing brace
+                name = declared_name(statement)
+                if name:
+                    (private if re.search(r'\bstatic\b', statement) else exported).add(name)
+                statement = ''
+            else:
+                statement += ' '
+        elif char == '{':
+            match = TAG_RE.search(statement)
+            if match:
+                private.add(match.group(1))
+            depth = 1
+            body_start = index + 1
+        elif char == ';':
+            words = statement.split()
+            if words and words[0] != 'extern':
+                is_private = words[0] in ('static', 'typedef')
+                for declarator in asyncify_lists.split_params(statement):
+                    name = declared_name(declarator)
+                    if not name:
+                        continue
+                    if is_private:
+                        private.add(name)
+                    elif '(' not in declarator or '=' in declarator or POINTER_DECLARATOR_RE.search(declarator):
+                        # Non-static prototypes only declare; variables define
+                        exported.add(name)
+            statement = ''
+        else:
+            statement += char
+
+    return {
+        "private": private,
+        "exported": exported,
+        "macros": read_macros(text),
+        "macro_before_include": bool(defines and first_include and defines[0].start() < first_include.start()),
+    }
+
+def files_conflict(a, b):
+    """Whether two scanned files would clash if included into one translation unit"""
+    return bool(a["private"] & (b["private"] | b["exported"]) or b["private"] & a["exported"])
+
+def load_compile_times(trace_file):
+    """Real (uncached) per-file compile times in ms from a build trace"""
+    try:
+        data = json.loads(Path(trace_file).read_text())
+    except (OSError, ValueError):
+        return {}
+    events = data["traceEvents"] if isinstance(data, dict) else data
+    return {event["name"]: event["dur"] / 1000.0 for event in events
+            if event.get("ph") == "X" and event.get("cat") == "compile"
+            and not event.get("args", {}).get("cached")}
+
+def load_unity_plan(plan_file):
+    """Load the previous unity plan, or an empty one"""
+    try:
+        plan = json.loads(plan_file.read_text())
+        if plan.get("version") == UNITY_PLAN_VERSION:
+            return plan
+    except (OSError, ValueError):
+        pass
+    return {"version": UNITY_PLAN_VERSION, "units": None, "balance": None, "groups": [],
+            "isolated": {}, "left_over": [], "failed": {}, "times": {}}
+
+def save_unity_plan(plan_file, plan):
+    """Write the unity plan atomically"""
+    plan_file.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = plan_file.with_suffix('.json.tmp')
+    tmp_file.write_text(json.dumps(plan, indent=1, sort_keys=True))
+    os.replace(tmp_file, plan_file)
+
+def plan_unity_groups(candidates, scans, weights, count):
+    """Spread files over `count` units, heaviest first onto the lightest unit they don't clash with.
+
+    Returns (groups, left_over); left_over files clash with every unit.
+    """
+    groups = [[] for _ in range(count)]
+    loads = [0.0] * count
+    left_over = []
+    for rel in sorted(candidates, key=lambda rel: (-weights[rel], rel)):
+        options = [i for i in range(count)
+                   if not any(files_conflict(scans[rel], scans[other]) for other in groups[i])]
+        if not options:
+            left_over.append(rel)
+            continue
+        best = min(options, key=lambda i: (loads[i], i))
+        groups[best].append(rel)
+        loads[best] += weights[rel]
+    return [sorted(group) for group in groups if group], left_over
+
+def prepare_unity_build(script_dir, build_dir, source_files, count, balance, trace_file=None):
+    """Group translation units into jumbo units and write their sources.
+
+    Returns (translation_units, members): the sources to compile (unity units
+    plus files compiled separately) and a map from each unit source to the files
+    it includes. The plan is kept in build_dir/unity/plan.json and reused while
+    the file set, unit count and isolated files stay the same, so one edit
+    doesn't reshuffle (and recompile) every unit.
+    """
+    unity_dir = build_dir / "unity"
+    plan_file = unity_dir / "plan.json"
+    plan = load_unity_plan(plan_file)
+
+    eligible = {f for pattern in UNITY_PATTERNS for f in script_dir.glob(pattern)}
+    rels = {Path(f).relative_to(script_dir).as_posix(): f for f in source_files}
+    candidates = sorted(rel for rel, f in rels.items() if Path(f) in eligible)
+
+    header_macros = {}
+    for pattern in asyncify_lists.HEADER_PATTERNS:
+        for path in script_dir.glob(pattern):
+            text = drop_inactive_branches(asyncify_lists.strip_source(path.read_text(errors='replace')))
+            for name, body in read_macros(text).items():
+                header_macros.setdefault(name, set()).add(body)
+    scans = {rel: scan_file_scope(script_dir / rel) for rel in candidates}
+
+    # Files that can't share a unit with anything: they stay separate
+    failed = {rel: digest for rel, digest in plan["failed"].items()
+              if rel in scans and hash_file(script_dir / rel) == digest}
+    isolated = {}
+    for rel in candidates:
+        scan = scans[rel]
+        if rel in failed:
+            isolated[rel] = "failed to compile in a unit"
+        elif scan["macro_before_include"]:
+            isolated[rel] = "defines a macro before its first #include"
+        else:
+            # Repeating a header's definition is harmless; changing it would leak into later files
+            clashes = sorted(name for name, body in scan["macros"].items()
+                             if name in header_macros and body not in header_macros[name])
+            if clashes:
+                isolated[rel] = f"redefines header macro {clashes[0]}"
+    candidates = [rel for rel in candidates if rel not in isolated]
+
+    times = dict(plan["times"])
+    if trace_file:
+        times.update({rel: ms for rel, ms in load_compile_times(trace_file).items() if rel in rels})
+
+    previous = [rel for group in plan["groups"] for rel in group] + plan["left_over"]
+    reuse = (plan["units"] == count and plan["balance"] == balance
+             and sorted(previous) == candidates and sorted(plan["isolated"]) == sorted(isolated)
+             and not any(files_conflict(scans[a], scans[b])
+                         for group in plan["groups"] for a in group for b in group if a < b))
+    if reuse:
+        groups, left_over = plan["groups"], plan["left_over"]
+    else:
+        sizes = {rel: (script_dir / rel).stat().st_size for rel in candidates}
+        known = [rel for rel in candidates if rel in times]
+        if balance == "time" and known:
+            # Files without a recorded time are estimated from their size
+            ms_per_byte = sum(times[rel] for rel in known) / max(1, sum(sizes[rel] for rel in known))
+            weights = {rel: times.get(rel, sizes[rel] * ms_per_byte) for rel in candidates}
+        else:
+            if balance == "time":
+                print_colored("No compile times recorded yet (build once with --profile), balancing by size",
+                              Colors.YELLOW)
+            weights = sizes
+        groups, left_over = plan_unity_groups(candidates, scans, weights, count)
+
+    plan.update({"units": count, "balance": balance, "groups": groups, "isolated": isolated,
+                 "left_over": left_over, "failed": failed, "times": times})
+    save_unity_plan(plan_file, plan)
+
+    translation_units = []
+    members = {}
+    grouped = set()
+    for index, group in enumerate(groups, 1):
+        if len(group) == 1:
+            continue
+        unit = unity_dir / f"unity-{index:02d}.c"
+        lines = ["/* Generated by build-emscripten.py --unity, do not edit */"]
+        for rel in group:
+            lines.append(f'#include "{Path(os.path.relpath(script_dir / rel, unity_dir)).as_posix()}"')
+            # Keep each file's own macros out of the files after it
+            lines.extend(f"#undef {name}" for name in sorted(scans[rel]["macros"]) if name not in header_macros)
+        content = "\n".join(lines) + "\n"
+        if not unit.exists() or unit.read_text() != content:
+            unit.write_text(content)
+        translation_units.append(str(unit))
+        members[str(unit)] = group
+        grouped.update(group)
+    for stale_unit in unity_dir.glob("unity-*.c"):
+        if str(stale_unit) not in members:
+            stale_unit.unlink()
+    translation_units.extend(f for rel, f in rels.items() if rel not in grouped)
+
+    print_colored(f"Unity build: {len(grouped)} files in {len(members)} units "
+                  f"({'reused' if reuse else balance + '-balanced'} plan), "
+                  f"{len(rels) - len(grouped)} compiled separately", Colors.CYAN)
+    for rel, reason in sorted(isolated.items()):
+        print(f"  separate: {rel} ({reason})")
+    for rel in left_over:
+        print(f"  separate: {rel} (clashes with a file in every unit)")
+    return translation_units, members
+
+def isolate_unity_members(build_dir, group, script_dir):
+    """Remember that a unit failed so its files are compiled separately until they change"""
+    plan_file = build_dir / "unity" / "plan.json"
+    plan = load_unity_plan(plan_file)
+    plan["failed"].update({rel: hash_file(script_dir / rel) for rel in group})
+    save_unity_plan(plan_file, plan)
+
+def build_with_direct_emcc(script_dir, build_dir, jobs, cache=None, extra_linker_flags=(), lazy_user_files=False,
+                           chunked_packages=False, live_reload=False, variant=None, unity=None,
+                           unity_balance="size", trace_file=None):
+    """Build using direct emcc compilation: one object per translation unit, then a link.
+
+    With `unity` set, files under UNITY_PATTERNS are compiled as that many jumbo units.
+    """
+    print_colored("Building with direct emcc compilation...", Colors.GREEN)
+
+    source_files = get_source_files(script_dir, variant)
+    # -sUSE_SDL=2 is needed at compile time too so the SDL2 port headers are found
+    compiler_flags = get_compiler_flags(variant) + ["-sUSE_SDL=2"]
+    linker_flags = get_linker_flags(script_dir, lazy_user_files, chunked_packages) + list(extra_linker_flags)
+    if live_reload:
+        linker_flags.append(f"--pre-js={script_dir}/web/live-reload.js")
+
+    # An object is only valid for the exact flags and compiler it was built with
+    emcc_version = get_emcc_version()
+    flags_key = hash_strings(compiler_flags + [emcc_version or ""])
+
+    obj_dir = build_dir / "obj"
+    obj_dir.mkdir(parents=True, exist_ok=True)
+    manifest = load_object_manifest(obj_dir)
+    entries = manifest["objects"]
+
+    def record_object(source, obj_file):
+        deps = parse_depfile(obj_file.with_suffix('.d')) or [source]
+        entries[Path(source).relative_to(script_dir).as_posix()] = {
+            "flags": flags_key,
+            "deps": fingerprint_dependencies(deps, script_dir),
+        }
+
+    # A unit that fails to compile is split up and the build retried with its files separate
+    while True:
+        translation_units, unity_members = source_files, {}
+        if unity is not None:
+            with profiler.phase("plan unity units"):
+                translation_units, unity_members = prepare_unity_build(
+                    script_dir, build_dir, source_files, unity or jobs, unity_balance, trace_file)
+
+        # Forget sources that no longer exist
+        current = {Path(f).relative_to(script_dir).as_posix() for f in translation_units}
+        for key in list(entries):
+            if key not in current:
+                del entries[key]
+
+        objects = []
+        stale = []
+        for source in translation_units:
+            key = Path(source).relative_to(script_dir).as_posix()
+            obj_file = get_object_path(source, script_dir, obj_dir)
+            objects.append(str(obj_file))
+            entry = entries.get(key)
+            if (entry and obj_file.exists() and entry.get("flags") == flags_key
+                    and dependencies_unchanged(entry["deps"], script_dir)):
+                continue
+            stale.append((source, obj_file))
+
+        print_colored(f"{len(translation_units) - len(stale)} objects up to date, "
+                      f"{len(stale)} to compile with {jobs} parallel jobs", Colors.CYAN)
+
+        try:
+            with profiler.phase("compile", files=len(stale)):
+                failed = compile_objects(script_dir, stale, compiler_flags, jobs, record_object, cache)
+        finally:
+            save_object_manifest(obj_dir, manifest)
+            if cache:
+                cache.save_stats()
+                cache.evict()
+
+        if cache and stale:
+            print_colored(f"Compile cache: {cache.hits} hits, {cache.misses} misses, "
+                          f"{format_size(cache.bytes_saved)} reused", Colors.CYAN)
+
+        unit = str(script_dir / failed) if failed else None
+        if unit not in unity_members:
+            break
+        print_colored(f"{failed} failed to compile; compiling its {len(unity_members[unit])} files "
+                      f"separately until they change", Colors.YELLOW)
+        isolate_unity_members(build_dir, unity_members[unit], script_dir)
+
+    if failed:
+        print_colored(f"Error: Failed to compile {failed}", Colors.RED)
+        sys.exit(1)
+
+    # Snapshot the include graph the objects were built from, for --explain
+    with profiler.phase("index includes"):
+        graph = IncludeGraph(script_dir, get_include_dirs(script_dir, compiler_flags), obj_dir / "includes.json")
+        graph.refresh(sorted(Path(f).relative_to(script_dir).as_posix() for f in source_files))
+        graph.save()
+
+    # Only instrument what can actually be on the stack while sleeping
+    for mode in variant_settings(variant, "asyncify"):
+        with profiler.phase("analyze asyncify call graph"):
+            excluded = {f for pattern in variant_settings(variant, "exclude") for f in script_dir.glob(pattern)}
+            analysis = asyncify_lists.load_or_analyze(script_dir, build_dir / "asyncify-analysis.json", excluded)
+            list_file = build_dir / f"asyncify-{mode}.json"
+            names = asyncify_lists.write_list(analysis, mode, list_file)
+        linker_flags.append(f"-sASYNCIFY_{mode.upper()}=@{list_file}")
+        print_colored(f"ASYNCIFY_{mode.upper()}: {len(names)} functions "
+                      f"({len(analysis['may_sleep'])} of {analysis['functions']} can reach a blocking call, "
+                      f"{len(analysis['hot_kept'])} of them in hot modules)", Colors.CYAN)
+
+    # Linking always runs; it is the only step that sees every object
+    output_file = build_dir / "web" / "ft2-clone.html"
+    if lazy_user_files or chunked_packages:
+        # Nothing is preloaded, so emcc writes no package; drop one left by an earlier build
+        for stale in ("ft2-clone.data", "ft2-clone.data.gz", "ft2-clone.data.br"):
+            stale_file = build_dir / "web" / stale
+            if stale_file.exists():
+                stale_file.unlink()
+    cmd = ["emcc"] + variant_settings(variant, "ldflags") + objects + linker_flags + ["-o", str(output_file)]
+    # emcc also packages the embedded/preloaded assets into ft2-clone.data during the link
+    with profiler.phase("link and package assets", objects=len(objects)):
+        em_cache.run(cmd, f"Linking {len(objects)} objects", cwd=script_dir)
 
 def build_with_cmake(script_dir, build_dir):
     """Build using CMake (recommended approach)"""
@@ -260,12 +1557,470 @@ def build_with_cmake(script_dir, build_dir):
         make_cmd = ['emmake', 'make', f'-j{cpu_count}']
         run_command(make_cmd, f"Building with {cpu_count} parallel jobs", cwd=build_dir)
 
-def verify_build(build_dir):
-    """Verify that the build was successful"""
-    html_file = build_dir / "web" / "ft2-clone.html"
-    js_file = build_dir / "web" / "ft2-clone.js"
-    wasm_file = build_dir / "web" / "ft2-clone.wasm"
-    data_file = build_dir / "web" / "ft2-clone.data"
+# Build outputs that get a content hash in their file name, in dependency order:
+# the loader references the wasm and data files, the HTML references the loader
+HASHED_ARTIFACTS = ["ft2-clone.wasm", "ft2-clone.data", "ft2-clone.js"]
+HASHED_REFERENCES = {"ft2-clone.js": "ft2-clone.html"}
+
+def load_artifact_names(web_dir):
+    """Map logical output names (ft2-clone.wasm, ...) to the files actually written"""
+    names = {name: name for name in ["ft2-clone.html"] + HASHED_ARTIFACTS}
+    try:
+        names.update(json.loads((web_dir / "asset-manifest.json").read_text()))
+    except (OSError, ValueError):
+        pass
+    return names
+
+def hash_artifact_names(build_dir):
+    """Rename outputs to content-hashed names and rewrite the references to them.
+
+    ft2-clone.html stays the (revalidated) entry point; everything it pulls in gets
+    a name that changes with its content, so servers can cache it forever.
+    """
+    web_dir = build_dir / "web"
+    names = {}
+    for name in HASHED_ARTIFACTS:
+        source = web_dir / name
+        if not source.exists():
+            continue
+        if name == "ft2-clone.js":
+            # The loader must point at the hashed wasm/data before it is hashed itself
+            text = source.read_text(encoding='utf-8')
+            for original, hashed in names.items():
+                text = re.sub(re.escape(original) + r'\b', hashed, text)
+            source.write_text(text, encoding='utf-8')
+        stem, ext = name.rsplit('.', 1)
+        names[name] = f"{stem}.{hash_file(source)[:10]}.{ext}"
+        os.replace(source, web_dir / names[name])
+        for suffix in (".gz", ".br"):
+            stale = web_dir / (name + suffix)
+            if stale.exists():
+                stale.unlink()
+
+    for name, referrer in HASHED_REFERENCES.items():
+        referrer_file = web_dir / referrer
+        if name in names and referrer_file.exists():
+            text = referrer_file.read_text(encoding='utf-8')
+            referrer_file.write_text(re.sub(re.escape(name) + r'\b', names[name], text), encoding='utf-8')
+
+    # Drop hashed outputs (and their compressed copies) from earlier builds
+    current = set(names.values())
+    hashed_re = re.compile(r'(ft2-clone\.[0-9a-f]{10}\.(?:js|wasm|data))(?:\.gz|\.br)?')
+    for old in web_dir.iterdir():
+        match = hashed_re.fullmatch(old.name)
+        if match and match.group(1) not in current:
+            old.unlink()
+
+    manifest_file = web_dir / "asset-manifest.json"
+    manifest_file.write_text(json.dumps(names, indent=1, sort_keys=True))
+    for name, hashed in names.items():
+        print_colored(f"  - {name} -> {hashed}", Colors.CYAN)
+
+# Build outputs that get precompressed copies for the servers
+COMPRESSED_ARTIFACTS = ["ft2-clone.html", "ft2-clone.js", "ft2-clone.wasm", "ft2-clone.data"]
+
+def compress_artifacts(build_dir):
+    """Write .gz (and .br when the brotli module is available) next to each build output"""
+    try:
+        import brotli
+    except ImportError:
+        brotli = None
+        print_colored("brotli module not found, writing gzip variants only (pip install brotli)", Colors.YELLOW)
+
+    encoders = [(".gz", lambda data: gzip.compress(data, compresslevel=9, mtime=0))]
+    if brotli:
+        encoders.append((".br", lambda data: brotli.compress(data, quality=11)))
+
+    names = load_artifact_names(build_dir / "web")
+    for name in COMPRESSED_ARTIFACTS:
+        source = build_dir / "web" / names[name]
+        if not source.exists():
+            continue
+        data = None
+        for suffix, encode in encoders:
+            target = source.with_name(source.name + suffix)
+            if target.exists() and target.stat().st_mtime_ns >= source.stat().st_mtime_ns:
+                continue
+            if data is None:
+                data = source.read_bytes()
+            compressed = encode(data)
+            if len(compressed) >= len(data):
+                # Not worth it (tiny file); make sure no stale variant is served either
+                if target.exists():
+                    target.unlink()
+                continue
+            tmp_file = target.with_name(target.name + ".tmp")
+            tmp_file.write_bytes(compressed)
+            os.replace(tmp_file, target)
+            print_colored(f"  - {target.name}: {format_size(len(data))} -> {format_size(len(compressed))} "
+                          f"({100.0 * len(compressed) / max(len(data), 1):.0f}%)", Colors.CYAN)
+
+# Packages written by --chunked-packages, in load order: (name, source relative to the
+# repo, mount point in the VFS, optional). Optional packages are fetched after startup.
+DATA_PACKAGES = [
+    ("ui", "src/gfxdata/bmp", "/", False),
+    ("demo-modules", "web/web_user", "/home/web_user", False),
+]
+SAMPLE_PACKS_DIR = "web/sample_packs"
+DEFAULT_CHUNK_SIZE = '64K'
+
+def get_data_packages(script_dir, lazy_user_files=False):
+    """List the packages to build: static UI assets, demo modules and any sample packs"""
+    packages = [(name, script_dir / source, mount, optional)
+                for name, source, mount, optional in DATA_PACKAGES
+                if not (lazy_user_files and name == "demo-modules")]
+    packs_dir = script_dir / SAMPLE_PACKS_DIR
+    if packs_dir.is_dir():
+        for pack in sorted(p for p in packs_dir.iterdir() if p.is_dir()):
+            packages.append((f"samples-{pack.name}", pack, f"/home/web_user/samples/{pack.name}", True))
+    return [package for package in packages if package[1].is_dir()]
+
+def split_package(files, chunk_size):
+    """Lay files out in chunks of at most chunk_size bytes.
+
+    Small files are packed together; a file of half a chunk or more starts a new
+    chunk. A changed file therefore only alters the chunks up to the next such
+    file instead of shifting the rest of the package. Yields (chunk bytes, file
+    placements) with placements as (path, size, offset in the chunk) for files
+    starting in that chunk.
+    """
+    chunk, placements = bytearray(), []
+    for rel, path in files:
+        data = path.read_bytes()
+        if chunk and (len(data) >= chunk_size // 2 or len(chunk) + len(data) > chunk_size):
+            yield bytes(chunk), placements
+            chunk, placements = bytearray(), []
+        placements.append((rel, len(data), len(chunk)))
+        while data:
+            room = chunk_size - len(chunk)
+            chunk += data[:room]
+            data = data[room:]
+            if len(chunk) == chunk_size:
+                yield bytes(chunk), placements
+                chunk, placements = bytearray(), []
+    if chunk:
+        yield bytes(chunk), placements
+
+def build_data_packages(script_dir, build_dir, chunk_size, lazy_user_files=False):
+    """Write content-addressed, chunked data packages and their manifests to web/packages.
+
+    Chunks and package manifests are named after their content, so the servers cache
+    them as immutable and a browser only downloads the chunks that changed. The small
+    packages.json index is revalidated on every visit.
+    """
+    packages_dir = build_dir / "web" / "packages"
+    packages_dir.mkdir(parents=True, exist_ok=True)
+    written = set()
+    index = {"version": 1, "chunk_size": chunk_size, "packages": []}
+
+    for name, source_dir, mount, optional in get_data_packages(script_dir, lazy_user_files):
+        files = sorted((p.relative_to(source_dir).as_posix(), p) for p in source_dir.rglob('*') if p.is_file())
+        package = {"name": name, "mount": mount, "chunks": [], "files": []}
+        new_bytes = 0
+        for data, placements in split_package(files, chunk_size):
+            digest = hashlib.sha256(data).hexdigest()
+            chunk_name = f"chunk.{digest[:16]}.bin"
+            chunk_file = packages_dir / chunk_name
+            if not chunk_file.exists():
+                tmp_file = chunk_file.with_name(chunk_name + ".tmp")
+                tmp_file.write_bytes(data)
+                os.replace(tmp_file, chunk_file)
+                new_bytes += len(data)
+            written.add(chunk_name)
+            for rel, size, offset in placements:
+                package["files"].append({"path": rel, "size": size,
+                                         "chunk": len(package["chunks"]), "offset": offset})
+            package["chunks"].append({"file": chunk_name, "size": len(data)})
+
+        text = json.dumps(package, separators=(',', ':'), sort_keys=True)
+        package_hash = hashlib.sha256(text.encode('utf-8')).hexdigest()[:16]
+        manifest_name = f"{name}.{package_hash}.json"
+        (packages_dir / manifest_name).write_text(text)
+        written.add(manifest_name)
+
+        total = sum(chunk["size"] for chunk in package["chunks"])
+        index["packages"].append({"name": name, "manifest": manifest_name, "hash": package_hash,
+                                  "size": total, "optional": optional})
+        print_colored(f"  - {name}: {len(package['files'])} files, {len(package['chunks'])} chunks, "
+                      f"{format_size(total)} ({format_size(new_bytes)} new)", Colors.CYAN)
+
+    index_file = packages_dir / "packages.json"
+    tmp_file = index_file.with_suffix('.json.tmp')
+    tmp_file.write_text(json.dumps(index, indent=1, sort_keys=True))
+    os.replace(tmp_file, index_file)
+    written.add(index_file.name)
+
+    # Chunks and manifests no package refers to anymore
+    for old in packages_dir.iterdir():
+        if old.is_file() and old.name not in written:
+            old.unlink()
+
+class WasmBinary:
+    """Minimal pure-Python reader for the WebAssembly binary format.
+
+    Only what the size report needs is decoded: the section table, imported
+    function count, code body sizes, data segments and the "name" custom section.
+    """
+
+    SECTION_NAMES = {
+        0: "custom", 1: "type", 2: "import", 3: "function", 4: "table", 5: "memory",
+        6: "global", 7: "export", 8: "start", 9: "element", 10: "code", 11: "data",
+        12: "datacount", 13: "tag",
+    }
+
+    def __init__(self, data):
+        if data[:4] != b'\0asm':
+            raise ValueError("not a WebAssembly binary")
+        self.data = data
+        self.sections = []
+        self.imported_functions = 0
+        self.function_bodies = []
+        self.data_segments = []
+        self.function_names = {}
+        self.data_segment_names = {}
+
+        pos = 8
+        while pos < len(data):
+            section_id = data[pos]
+            size, pos = self.read_leb(pos + 1)
+            name = self.SECTION_NAMES.get(section_id, f"unknown{section_id}")
+            if section_id == 0:
+                custom_name, body = self.read_name(pos)
+                name = "names" if custom_name == "name" else f"custom:{custom_name}"
+                if custom_name == "name":
+                    self.parse_names(body, pos + size)
+            elif section_id == 2:
+                self.parse_imports(pos)
+            elif section_id == 10:
+                self.parse_code(pos)
+            elif section_id == 11:
+                self.parse_data(pos)
+            self.sections.append((name, pos, size))
+            pos += size
+
+    @classmethod
+    def from_file(cls, path):
+        """Read and parse a .wasm file"""
+        return cls(Path(path).read_bytes())
+
+    def read_leb(self, pos):
+        """Read an unsigned LEB128 integer, returning (value, new position)"""
+        result = shift = 0
+        while True:
+            byte = self.data[pos]
+            pos += 1
+            result |= (byte & 0x7f) << shift
+            shift += 7
+            if byte < 0x80:
+                return result, pos
+
+    def skip_sleb(self, pos):
+        """Skip a signed LEB128 integer"""
+        while self.data[pos] & 0x80:
+            pos += 1
+        return pos + 1
+
+    def read_name(self, pos):
+        """Read a length-prefixed UTF-8 name"""
+        length, pos = self.read_leb(pos)
+        return self.data[pos:pos + length].decode('utf-8', 'replace'), pos + length
+
+    def skip_limits(self, pos):
+        """Skip table/memory limits"""
+        flags = self.data[pos]
+        _, pos = self.read_leb(pos + 1)
+        if flags & 1:
+            _, pos = self.read_leb(pos)
+        return pos
+
+    def skip_const_expr(self, pos):
+        """Skip a constant initializer expression up to its `end` opcode"""
+        while self.data[pos] != 0x0b:
+            opcode = self.data[pos]
+            if opcode in (0x41, 0x42):  # i32.const, i64.const
+                pos = self.skip_sleb(pos + 1)
+            elif opcode == 0x23:  # global.get
+                _, pos = self.read_leb(pos + 1)
+            else:
+                raise ValueError(f"unsupported opcode 0x{opcode:02x} in constant expression")
+        return pos + 1
+
+    def parse_imports(self, pos):
+        count, pos = self.read_leb(pos)
+        for _ in range(count):
+            _, pos = self.read_name(pos)
+            _, pos = self.read_name(pos)
+            kind = self.data[pos]
+            pos += 1
+            if kind == 0:
+                self.imported_functions += 1
+                _, pos = self.read_leb(pos)
+            elif kind == 1:
+                pos = self.skip_limits(pos + 1)
+            elif kind == 2:
+                pos = self.skip_limits(pos)
+            elif kind == 3:
+                pos += 2
+            elif kind == 4:
+                _, pos = self.read_leb(pos + 1)
+
+    def parse_code(self, pos):
+        count, pos = self.read_leb(pos)
+        for _ in range(count):
+            size, body = self.read_leb(pos)
+            self.function_bodies.append((body, size))
+            pos = body + size
+
+    def parse_data(self, pos):
+        count, pos = self.read_leb(pos)
+        for _ in range(count):
+            flags, pos = self.read_leb(pos)
+            if flags == 2:
+                _, pos = self.read_leb(pos)
+            if flags in (0, 2):
+                pos = self.skip_const_expr(pos)
+            size, pos = self.read_leb(pos)
+            self.data_segments.append((pos, size))
+            pos += size
+
+    def parse_names(self, pos, end):
+        while pos < end:
+            subsection = self.data[pos]
+            size, body = self.read_leb(pos + 1)
+            if subsection in (1, 9):
+                names = self.function_names if subsection == 1 else self.data_segment_names
+                count, cursor = self.read_leb(body)
+                for _ in range(count):
+                    index, cursor = self.read_leb(cursor)
+                    names[index], cursor = self.read_name(cursor)
+            pos = body + size
+
+    def section_sizes(self):
+        """Total bytes per section kind (custom sections are listed by name)"""
+        sizes = {}
+        for name, _, size in self.sections:
+            sizes[name] = sizes.get(name, 0) + size
+        return sizes
+
+    def function_sizes(self):
+        """Code size per defined function, named when a name section is present"""
+        sizes = {}
+        for i, (_, size) in enumerate(self.function_bodies):
+            index = self.imported_functions + i
+            name = self.function_names.get(index, f"function[{index}]")
+            sizes[name] = sizes.get(name, 0) + size
+        return sizes
+
+# Source directories (or files) and the module they are reported under in size breakdowns
+SIZE_MODULES = [
+    ("src/mixer/", "mixer"),
+    ("src/libflac/", "libflac"),
+    ("src/gfxdata/", "gfxdata"),
+    ("src/scopes/", "scopes"),
+    ("src/modloaders/", "modloaders"),
+    ("src/smploaders/", "smploaders"),
+    ("src/ft2_replayer.c", "replayer"),
+    ("src/", "ft2 core/gui"),
+]
+
+C_FUNCTION_RE = re.compile(r'^[A-Za-z_][\w \t\*]*?\b([A-Za-z_]\w*)\s*\([^;{]*\)\s*(?:\{|$)', re.M)
+
+def build_function_module_index(script_dir):
+    """Map C function names defined in src/ to the module they belong to"""
+    index = {}
+    for source in get_source_files(script_dir):
+        rel = Path(source).relative_to(script_dir).as_posix()
+        module = next(name for prefix, name in SIZE_MODULES if rel.startswith(prefix))
+        text = Path(source).read_text(errors='replace')
+        for name in C_FUNCTION_RE.findall(text):
+            if name not in ('if', 'for', 'while', 'switch', 'return', 'sizeof'):
+                index.setdefault(name, module)
+    return index
+
+def analyze_wasm_size(script_dir, wasm_file, top=15):
+    """Print a per-section (and per-module, when names are present) size breakdown"""
+    wasm = WasmBinary.from_file(wasm_file)
+    total = wasm_file.stat().st_size
+    report = {"total": total, "sections": wasm.section_sizes(), "modules": {}}
+
+    print_colored(f"WebAssembly size breakdown ({wasm_file.name}, {format_size(total)}):", Colors.GREEN)
+    for name, size in sorted(report["sections"].items(), key=lambda item: -item[1]):
+        print(f"  {name:<24} {format_size(size):>10} {100.0 * size / total:5.1f}%")
+
+    if not wasm.function_names:
+        print_colored("  No name section: link with --profiling-funcs (--size-names) for per-function sizes", Colors.YELLOW)
+        return report
+
+    function_sizes = wasm.function_sizes()
+    module_index = build_function_module_index(script_dir)
+    for name, size in function_sizes.items():
+        module = module_index.get(name, "runtime (libc/SDL/emscripten)")
+        report["modules"][module] = report["modules"].get(module, 0) + size
+
+    code_total = sum(function_sizes.values()) or 1
+    print_colored("Code size per source module:", Colors.GREEN)
+    for module, size in sorted(report["modules"].items(), key=lambda item: -item[1]):
+        print(f"  {module:<32} {format_size(size):>10} {100.0 * size / code_total:5.1f}%")
+    print_colored(f"Largest {top} functions:", Colors.GREEN)
+    for name, size in sorted(function_sizes.items(), key=lambda item: -item[1])[:top]:
+        print(f"  {format_size(size):>10}  {name} [{module_index.get(name, 'runtime')}]")
+    if wasm.data_segment_names:
+        print_colored("Data segments:", Colors.GREEN)
+        for index, (_, size) in sorted(enumerate(wasm.data_segments), key=lambda item: -item[1][1])[:top]:
+            print(f"  {format_size(size):>10}  {wasm.data_segment_names.get(index, f'segment[{index}]')}")
+    return report
+
+def check_size_budget(build_dir, report, budget_file, history_file):
+    """Record artifact sizes in the history file and check them against the budget.
+
+    Returns a list of budget violations (empty when everything fits).
+    """
+    web_dir = build_dir / "web"
+    entry = {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "files": {name: (web_dir / actual).stat().st_size
+                  for name, actual in sorted(load_artifact_names(web_dir).items()) if (web_dir / actual).is_file()},
+        "sections": report["sections"],
+        "modules": report["modules"],
+    }
+
+    previous = None
+    if history_file and history_file.exists():
+        lines = history_file.read_text().splitlines()
+        if lines:
+            previous = json.loads(lines[-1])
+
+    violations = []
+    if budget_file and budget_file.exists():
+        budget = json.loads(budget_file.read_text())
+        for group in ("files", "sections", "modules"):
+            for name, limit in budget.get(group, {}).items():
+                size = entry[group].get(name)
+                if size is not None and size > parse_size(limit):
+                    violations.append(f"{name}: {format_size(size)} exceeds budget of {format_size(parse_size(limit))}")
+
+        max_growth = budget.get("max_growth_percent")
+        if previous and max_growth is not None:
+            for group in ("files", "sections"):
+                for name, size in entry[group].items():
+                    before = previous.get(group, {}).get(name)
+                    if before and size > before * (1 + max_growth / 100.0):
+                        violations.append(f"{name}: grew {100.0 * (size - before) / before:.1f}% "
+                                          f"({format_size(before)} -> {format_size(size)}), "
+                                          f"more than {max_growth}%")
+
+    if history_file:
+        with open(history_file, 'a') as f:
+            f.write(json.dumps(entry, sort_keys=True) + "\n")
+    return violations
+
+def verify_build(script_dir, build_dir, budget_file=None, history_file=None):
+    """Verify that the build was successful and that artifacts fit the size budget"""
+    names = load_artifact_names(build_dir / "web")
+    html_file = build_dir / "web" / names["ft2-clone.html"]
+    js_file = build_dir / "web" / names["ft2-clone.js"]
+    wasm_file = build_dir / "web" / names["ft2-clone.wasm"]
+    data_file = build_dir / "web" / names["ft2-clone.data"]
     
     if html_file.exists():
         print_colored("Build successful!", Colors.GREEN)
@@ -278,10 +2033,28 @@ def verify_build(build_dir):
         ]:
             if file.exists():
                 size_mb = file.stat().st_size / (1024 * 1024)
-                print_colored(f"  - {file.relative_to(build_dir)} ({size_mb:.1f} MB) - {desc}", Colors.CYAN)
+                compressed = [f"{suffix[1:]} {format_size(variant.stat().st_size)}"
+                              for suffix in (".br", ".gz")
+                              for variant in [file.with_name(file.name + suffix)] if variant.exists()]
+                extra = f", {', '.join(compressed)}" if compressed else ""
+                print_colored(f"  - {file.relative_to(build_dir)} ({size_mb:.1f} MB{extra}) - {desc}", Colors.CYAN)
             else:
                 print_colored(f"  - {file.relative_to(build_dir)} - {desc} (NOT FOUND)", Colors.YELLOW)
         
+        if wasm_file.exists():
+            print("")
+            try:
+                report = analyze_wasm_size(script_dir, wasm_file)
+            except (ValueError, IndexError) as e:
+                print_colored(f"Could not analyze {wasm_file.name}: {e}", Colors.YELLOW)
+                report = {"total": wasm_file.stat().st_size, "sections": {}, "modules": {}}
+            violations = check_size_budget(build_dir, report, budget_file, history_file)
+            if violations:
+                print_colored("Size budget exceeded:", Colors.RED)
+                for violation in violations:
+                    print_colored(f"  - {violation}", Colors.RED)
+                return False
+
         print_colored("\nTo run the application:", Colors.GREEN)
         print("1. Start a local web server in the build directory:")
         print_colored(f"   cd {build_dir}", Colors.YELLOW)
@@ -302,31 +2075,539 @@ def verify_build(build_dir):
         print("Output file not found. Check the error messages above for details.")
         return False
 
+# Written into the served web directory by --watch after every rebuild; the servers
+# push it to browsers over /api/live-reload (see serve.py and web/live-reload.js)
+LIVE_RELOAD_STAMP = "live-reload.json"
+
+# What --watch monitors, relative to the repo
+WATCHED_PATHS = ["src", "web/shell.html", "web/web_user", "web/assets",
+                 "web/lazy-user-files.js", "web/chunked-packages.js", "web/live-reload.js"]
+
+def write_live_reload_stamp(build_dir, changed, relinked):
+    """Record a finished rebuild; every write makes connected browsers reload"""
+    stamp_file = build_dir / "web" / LIVE_RELOAD_STAMP
+    try:
+        build = json.loads(stamp_file.read_text()).get("build", 0) + 1
+    except (OSError, ValueError, AttributeError):
+        build = 1
+    tmp_file = stamp_file.with_suffix('.json.tmp')
+    tmp_file.write_text(json.dumps({"build": build, "time": time.time(),
+                                    "relinked": relinked, "changed": list(changed)}))
+    os.replace(tmp_file, stamp_file)
+
+class FileWatcher:
+    """Reports files that changed below a set of files and directories.
+
+    Uses inotify on Linux and falls back to polling mtimes and sizes elsewhere (or
+    when inotify watches run out). Single files are watched through their parent
+    directory, so editors that save by renaming a temporary file are still seen.
+    """
+
+    IN_MODIFY, IN_ATTRIB, IN_CLOSE_WRITE = 0x2, 0x4, 0x8
+    IN_MOVED_FROM, IN_MOVED_TO, IN_CREATE, IN_DELETE = 0x40, 0x80, 0x100, 0x200
+    IN_Q_OVERFLOW, IN_IGNORED, IN_ISDIR = 0x4000, 0x8000, 0x40000000
+    WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+    EVENT_HEADER = struct.Struct('iIII')
+
+    def __init__(self, roots, poll_interval=0.5, force_poll=False):
+        self.roots = [Path(root) for root in roots]
+        self.poll_interval = poll_interval
+        self.fd = None
+        self.watches = {}
+        if not force_poll and platform.system() == 'Linux':
+            try:
+                self.start_inotify()
+            except (OSError, AttributeError) as e:
+                print_colored(f"inotify unavailable ({e}), polling for changes instead", Colors.YELLOW)
+                self.close()
+        self.snapshot = None if self.fd is not None else self.scan()
+
+    @property
+    def mode(self):
+        return "inotify" if self.fd is not None else f"polling every {self.poll_interval:g}s"
+
+    def start_inotify(self):
+        import ctypes
+        libc = ctypes.CDLL(None, use_errno=True)
+        self.inotify_add_watch = libc.inotify_add_watch
+        self.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.fd = fd
+        for root in self.roots:
+            if root.is_dir():
+                self.add_tree(root)
+            elif root.parent.is_dir():
+                self.add_watch(root.parent)
+
+    def add_watch(self, directory):
+        import ctypes
+        wd = self.inotify_add_watch(self.fd, os.fsencode(directory), self.WATCH_MASK)
+        if wd < 0:
+            errno_value = ctypes.get_errno()
+            raise OSError(errno_value, f"cannot watch {directory}: {os.strerror(errno_value)}")
+        self.watches[wd] = Path(directory)
+
+    def add_tree(self, directory):
+        self.add_watch(directory)
+        for sub in sorted(p for p in Path(directory).rglob('*') if p.is_dir()):
+            self.add_watch(sub)
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def is_watched(self, path):
+        """Whether a path is one of the roots or lies below a directory root"""
+        if path.name.startswith('.') or path.name.endswith(('~', '.tmp', '.swp')):
+            return False
+        return any(path == root or root in path.parents for root in self.roots)
+
+    def scan(self):
+        """Polling fallback: (mtime, size) of every watched file"""
+        snapshot = {}
+        for root in self.roots:
+            files = root.rglob('*') if root.is_dir() else [root]
+            for path in files:
+                try:
+                    st = path.stat()
+                except OSError:
+                    continue
+                if not stat.S_ISDIR(st.st_mode) and self.is_watched(path):
+                    snapshot[path] = (st.st_mtime_ns, st.st_size)
+        return snapshot
+
+    def poll(self, timeout):
+        """Wait up to `timeout` seconds (None: forever) and return the changed paths"""
+        if self.fd is None:
+            deadline = None if timeout is None else time.monotonic() + timeout
+            while True:
+                snapshot = self.scan()
+                changed = {path for path in set(snapshot) | set(self.snapshot)
+                           if snapshot.get(path) != self.snapshot.get(path)}
+                self.snapshot = snapshot
+                if changed or (deadline is not None and time.monotonic() >= deadline):
+                    return changed
+                time.sleep(self.poll_interval if deadline is None
+                           else max(0.0, min(self.poll_interval, deadline - time.monotonic())))
+
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return set()
+        changed = set()
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, length = self.EVENT_HEADER.unpack_from(data, offset)
+                offset += self.EVENT_HEADER.size
+                name = data[offset:offset + length].rstrip(b'\0')
+                offset += length
+                if mask & self.IN_Q_OVERFLOW:
+                    # Events were dropped: treat every root as changed
+                    changed.update(self.roots)
+                    continue
+                directory = self.watches.get(wd)
+                if directory is None or mask & self.IN_IGNORED:
+                    self.watches.pop(wd, None)
+                    continue
+                path = directory / os.fsdecode(name) if name else directory
+                if mask & self.IN_ISDIR:
+                    if mask & (self.IN_CREATE | self.IN_MOVED_TO) and path.is_dir() and self.is_watched(path):
+                        # Watch new directories, and report files that landed before the watch did
+                        self.add_tree(path)
+                        changed.update(p for p in path.rglob('*') if p.is_file() and self.is_watched(p))
+                    continue
+                if self.is_watched(path):
+                    changed.add(path)
+        return changed
+
+    def wait(self, debounce):
+        """Block until something changes, then until `debounce` seconds pass without changes"""
+        changed = self.poll(None)
+        while True:
+            more = self.poll(debounce)
+            if not more:
+                return changed
+            changed |= more
+
+def rebuild_needs_link(changed, args):
+    """Whether changed repo-relative paths need a compile/link, or only an asset resync"""
+    for rel in changed:
+        if rel.startswith("web/assets/"):
+            continue
+        # web_user is packaged by emcc unless it is fetched lazily or chunked separately
+        if rel.startswith("web/web_user/") and (args.lazy_user_files or args.chunked_packages):
+            continue
+        return True
+    return False
+
+def watch_and_rebuild(args, script_dir, build_dir, cache):
+    """Build, then rebuild whenever a watched file changes until interrupted.
+
+    Bursts of changes are debounced into one rebuild. Only compile and link when
+    sources, the shell or packaged files changed; plain asset changes are resynced.
+    Every finished rebuild updates the live-reload stamp for the servers.
+    """
+    def rebuild(link=True, changed=()):
+        start = time.perf_counter()
+        try:
+            success = build_outputs(args, script_dir, build_dir, cache, link=link, changed=changed)
+        except SystemExit:
+            # A compile or link error: keep watching, the next save may fix it
+            success = False
+        except Exception as e:
+            print_colored(f"Unexpected error: {e}", Colors.RED)
+            success = False
+        elapsed = time.perf_counter() - start
+        if success:
+            print_colored(f"Rebuilt in {elapsed:.1f}s, browsers reloading", Colors.GREEN)
+        else:
+            print_colored(f"Rebuild failed after {elapsed:.1f}s, keeping the previous outputs", Colors.RED)
+
+    rebuild()
+    watcher = FileWatcher([script_dir / path for path in WATCHED_PATHS],
+                          args.watch_poll_interval, force_poll=args.watch_poll)
+    print_colored(f"Watching {', '.join(WATCHED_PATHS)} ({watcher.mode}); press Ctrl+C to stop", Colors.GREEN)
+    try:
+        while True:
+            paths = watcher.wait(args.watch_debounce)
+            changed = sorted({p.relative_to(script_dir).as_posix() for p in paths})
+            link = rebuild_needs_link(changed, args)
+            print_colored(f"\n{len(changed)} changed: {', '.join(changed[:5])}"
+                          f"{' ...' if len(changed) > 5 else ''} -> {'rebuild' if link else 'asset sync'}",
+                          Colors.BLUE)
+            rebuild(link, changed)
+    except KeyboardInterrupt:
+        print_colored("\nStopped watching", Colors.YELLOW)
+    finally:
+        watcher.close()
+
+VARIANTS_DIR = Path(__file__).parent.absolute() / "build_emscripten" / "variants"
+
+def expand_variant_matrix(settings):
+    """List the variants to build for --variants.
+
+    Without settings: the default, plus every other value of each axis on its own.
+    With AXIS=VALUES settings: every combination of them, other axes at their default.
+    """
+    if not settings:
+        variants = [dict(DEFAULT_VARIANT)]
+        for axis, values in VARIANT_AXES.items():
+            variants.extend({**DEFAULT_VARIANT, axis: value} for value in values if value != DEFAULT_VARIANT[axis])
+        return variants
+
+    variants = [dict(DEFAULT_VARIANT)]
+    for axis, values in settings:
+        variants = [{**variant, axis: value} for variant in variants for value in values]
+    unique = []
+    for variant in variants:
+        if variant not in unique:
+            unique.append(variant)
+    return unique
+
+def build_variant(args, variant, jobs):
+    """Build one variant in a child build-emscripten.py; returns its result row"""
+    name = variant_name(variant)
+    build_dir = VARIANTS_DIR / name
+    if args.clean and build_dir.exists():
+        # Here rather than in the child, which would delete its own log
+        shutil.rmtree(build_dir)
+    build_dir.mkdir(parents=True, exist_ok=True)
+    trace_file = build_dir / "build-profile.json"
+    cmd = [sys.executable, str(Path(__file__).absolute()), "--variant"]
+    cmd += [f"{axis}={value}" for axis, value in variant.items()]
+    cmd += ["-j", str(jobs), "--profile", str(trace_file),
+            "--size-history", str(build_dir / "wasm-size-history.jsonl"),
+            "--cache-dir", args.cache_dir, "--cache-max-size", str(args.cache_max_size),
+            "--chunk-size", str(args.chunk_size), "--em-cache", args.em_cache]
+    for flag in ("no_cache", "no_em_cache", "lazy_user_files", "chunked_packages", "no_compress", "hash_names"):
+        if getattr(args, flag):
+            cmd.append("--" + flag.replace('_', '-'))
+    if args.unity is not None:
+        cmd += ["--unity", str(args.unity), "--unity-balance", args.unity_balance]
+
+    log_file = build_dir / "build.log"
+    start = time.perf_counter()
+    with open(log_file, 'w') as log:
+        returncode = subprocess.run(cmd, stdout=log, stderr=subprocess.STDOUT).returncode
+    elapsed = time.perf_counter() - start
+
+    row = {"variant": name, "settings": variant, "ok": returncode == 0, "log": str(log_file),
+           "total_s": round(elapsed, 2), "compile_s": None, "link_s": None, "sizes": {}}
+    if trace_file.exists():
+        durations = load_trace_durations(trace_file)
+        row["compile_s"] = round(durations.get(("phase", "compile"), 0.0) / 1000.0, 2)
+        row["link_s"] = round(durations.get(("phase", "link and package assets"), 0.0) / 1000.0, 2)
+    web_dir = build_dir / "web"
+    for logical, actual in load_artifact_names(web_dir).items():
+        path = web_dir / actual
+        if logical != "ft2-clone.html" and path.is_file():
+            row["sizes"][logical] = path.stat().st_size
+            for suffix in (".br", ".gz"):
+                variant_file = path.with_name(path.name + suffix)
+                if variant_file.is_file():
+                    row["sizes"][logical + suffix] = variant_file.stat().st_size
+                    break
+    return row
+
+def print_variant_table(rows):
+    """Print sizes and build times of every variant, with wasm size relative to the default"""
+    def size(row, name):
+        value = row["sizes"].get(name)
+        return format_size(value) if value is not None else "-"
+
+    def compressed(row, name):
+        for suffix in (".br", ".gz"):
+            if name + suffix in row["sizes"]:
+                return f"{format_size(row['sizes'][name + suffix])} {suffix[1:]}"
+        return "-"
+
+    def seconds(value):
+        return f"{value:.1f}s" if value is not None else "-"
+
+    baseline = next((row["sizes"].get("ft2-clone.wasm") for row in rows
+                     if row["settings"] == DEFAULT_VARIANT), None)
+    print(f"  {'variant':<28} {'wasm':>10} {'vs default':>10} {'compressed':>14} {'js':>10} {'data':>10} "
+          f"{'compile':>8} {'link':>8} {'total':>8}")
+    for row in rows:
+        wasm = row["sizes"].get("ft2-clone.wasm")
+        delta = f"{100.0 * (wasm - baseline) / baseline:+.1f}%" if wasm and baseline else "-"
+        line = (f"  {row['variant']:<28} {size(row, 'ft2-clone.wasm'):>10} {delta:>10} "
+                f"{compressed(row, 'ft2-clone.wasm'):>14} {size(row, 'ft2-clone.js'):>10} "
+                f"{size(row, 'ft2-clone.data'):>10} {seconds(row['compile_s']):>8} "
+                f"{seconds(row['link_s']):>8} {seconds(row['total_s']):>8}")
+        print_colored(line + ("" if row["ok"] else "  FAILED"), Colors.NC if row["ok"] else Colors.RED)
+
+def run_variant_matrix(args):
+    """Build several flag variants side by side and compare their sizes and build times"""
+    if not check_emscripten():
+        sys.exit(1)
+    configure_em_cache(args)
+    variants = expand_variant_matrix(args.variants)
+    parallel = max(1, min(args.variant_jobs, len(variants)))
+    jobs = max(1, args.jobs // parallel)
+    print_colored(f"Building {len(variants)} variants, {parallel} at a time with {jobs} jobs each, "
+                  f"into {VARIANTS_DIR}", Colors.GREEN)
+
+    rows = [None] * len(variants)
+    with ThreadPoolExecutor(max_workers=parallel) as executor:
+        futures = {executor.submit(build_variant, args, variant, jobs): index
+                   for index, variant in enumerate(variants)}
+        for future in as_completed(futures):
+            row = rows[futures[future]] = future.result()
+            status = "built" if row["ok"] else f"FAILED, see {row['log']}"
+            print_colored(f"  {row['variant']}: {status} in {row['total_s']:.1f}s",
+                          Colors.CYAN if row["ok"] else Colors.RED)
+
+    print("")
+    print_variant_table(rows)
+    report_file = VARIANTS_DIR / "variants-report.json"
+    report_file.write_text(json.dumps({"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "variants": rows}, indent=1))
+    print_colored(f"Variant report written to {report_file}", Colors.GREEN)
+    return all(row["ok"] for row in rows)
+
+def parse_arguments():
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(description="FastTracker II Clone - Unified Emscripten Build Script")
+    parser.add_argument('--clean', action='store_true',
+                        help="remove build_emscripten first; by default objects are only recompiled when "
+                             "their source, headers, flags or emcc version changed, and assets are synced")
+    parser.add_argument('--link-assets', action='store_true',
+                        help="hard-link changed asset and web_user files into the build instead of copying")
+    parser.add_argument('--lazy-user-files', action='store_true',
+                        help="don't preload web_user into ft2-clone.data; fetch each file when it is first opened")
+    parser.add_argument('--chunked-packages', action='store_true',
+                        help="package UI assets, demo modules and sample packs separately in content-addressed "
+                             "chunks under web/packages instead of embedding/preloading them")
+    parser.add_argument('--chunk-size', default=DEFAULT_CHUNK_SIZE,
+                        help=f"maximum chunk size for --chunked-packages (default: {DEFAULT_CHUNK_SIZE})")
+    parser.add_argument('-j', '--jobs', type=int, default=get_cpu_count(),
+                        help="number of translation units to compile in parallel (default: all cores)")
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR,
+                        help="shared compile cache directory, may be shared by several worktrees "
+                             "(default: $FT2_COMPILE_CACHE or ~/.cache/ft2-clone/emcc)")
+    parser.add_argument('--cache-max-size', type=parse_size, default=DEFAULT_CACHE_MAX_SIZE,
+                        help="evict least recently used objects above this size, e.g. 500M or 2G (default: 2G)")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="do not use the shared compile cache")
+    parser.add_argument('--cache-stats', action='store_true',
+                        help="print shared compile cache statistics and exit")
+    parser.add_argument('--em-cache', default=DEFAULT_EM_CACHE, metavar='DIR',
+                        help="persistent Emscripten cache for the SDL2 port and system libraries, shared by "
+                             "builds and variants, one subdirectory per emcc version "
+                             "(default: $FT2_EM_CACHE or ~/.cache/ft2-clone/emscripten)")
+    parser.add_argument('--no-em-cache', action='store_true',
+                        help="leave EM_CACHE alone and use emsdk's own cache")
+    parser.add_argument('--prewarm', action='store_true',
+                        help="build the ports and system libraries the link needs (for --variant/--variants "
+                             "if given) into the Emscripten cache, then exit")
+    parser.add_argument('--profile', nargs='?', const='build-profile.json', metavar='TRACE',
+                        help="write a Chrome trace of build phases and per-file compile times "
+                             "(default: build-profile.json)")
+    parser.add_argument('--profile-compare', nargs=2, metavar=('OLD', 'NEW'),
+                        help="compare two build traces, flag phases/files that got slower and exit")
+    parser.add_argument('--profile-threshold', type=float, default=10.0, metavar='PERCENT',
+                        help="minimum slowdown in percent to flag in --profile-compare (default: 10)")
+    parser.add_argument('--profile-min-ms', type=float, default=50.0, metavar='MS',
+                        help="minimum slowdown in milliseconds to flag in --profile-compare (default: 50)")
+    parser.add_argument('--hash-names', action='store_true',
+                        help="rename ft2-clone.js/.wasm/.data to content-hashed names (for cache-forever deployments)")
+    parser.add_argument('--no-compress', action='store_true',
+                        help="do not write precompressed .gz/.br copies of the build outputs")
+    parser.add_argument('--size-budget', type=Path, default=Path(__file__).parent / "wasm-size-budget.json",
+                        metavar='FILE', help="size budget checked after the build (default: wasm-size-budget.json)")
+    parser.add_argument('--size-history', type=Path, default=Path(__file__).parent / "wasm-size-history.jsonl",
+                        metavar='FILE', help="append artifact sizes of every build to this file "
+                                             "(default: wasm-size-history.jsonl)")
+    parser.add_argument('--size-names', action='store_true',
+                        help="link with --profiling-funcs so the size report can break code down per function/module")
+    parser.add_argument('--size-report', nargs='?', const='', metavar='WASM',
+                        help="print the size breakdown of a .wasm file (default: the last build's) and exit")
+    parser.add_argument('--watch', action='store_true',
+                        help="after building, watch src/, web/shell.html and web/web_user and rebuild on "
+                             "changes; browsers with the app open reload once the new outputs are in place")
+    parser.add_argument('--watch-debounce', type=float, default=0.3, metavar='SECONDS',
+                        help="wait until files stop changing for this long before rebuilding (default: 0.3)")
+    parser.add_argument('--watch-poll', action='store_true',
+                        help="poll for changes instead of using inotify (e.g. on network or VM shared folders)")
+    parser.add_argument('--watch-poll-interval', type=float, default=0.5, metavar='SECONDS',
+                        help="seconds between scans when polling (default: 0.5)")
+    parser.add_argument('--variant', nargs='+', type=parse_variant_setting, metavar='AXIS=VALUE',
+                        help="build one variant of the flag matrix into build_emscripten/variants/<name>, "
+                             "e.g. --variant opt=Oz lto=on (axes: " +
+                             "; ".join(f"{axis}: {'/'.join(values)}" for axis, values in VARIANT_AXES.items()) +
+                             f"; unset axes: {' '.join(f'{a}={v}' for a, v in DEFAULT_VARIANT.items())})")
+    parser.add_argument('--variants', nargs='*', type=parse_variant_setting, metavar='AXIS=VALUES',
+                        help="build several variants in parallel and compare sizes and compile/link times, "
+                             "e.g. --variants opt=O2,O3,Os,Oz lto=* (no arguments: the default and every "
+                             "other value of each axis on its own)")
+    parser.add_argument('--variant-jobs', type=int, default=2, metavar='N',
+                        help="number of variants built at the same time; -j is split between them (default: 2)")
+    parser.add_argument('--unity', nargs='?', type=int, const=0, metavar='UNITS',
+                        help="compile src/, src/mixer, src/scopes and the loaders as UNITS jumbo translation "
+                             "units (default: one per -j job); files whose statics or macros clash are "
+                             "compiled separately")
+    parser.add_argument('--unity-balance', choices=["size", "time"], default="size",
+                        help="balance unity units by source size or by compile times from the --profile "
+                             "trace (default: size)")
+    parser.add_argument('--explain', nargs='*', metavar='FILE',
+                        help="show which translation units a change to FILE(s) would rebuild and "
+                             "through which includes, then exit (no FILE: changes since the last build)")
+    args = parser.parse_args()
+
+    if args.variant:
+        variant = dict(DEFAULT_VARIANT)
+        for axis, values in args.variant:
+            if len(values) != 1:
+                parser.error(f"--variant takes one value per axis, got {axis}={','.join(values)}")
+            variant[axis] = values[0]
+        args.variant = variant
+    return args
+
 def main():
     """Main build function"""
+    args = parse_arguments()
+
+    if args.cache_stats:
+        CompileCache(args.cache_dir, args.cache_max_size, None).print_stats()
+        em_cache.print_stats(args.em_cache)
+        sys.exit(0)
+
+    if args.profile_compare:
+        flagged = compare_profiles(*args.profile_compare, args.profile_threshold, args.profile_min_ms)
+        sys.exit(1 if flagged else 0)
+
+    if args.size_report is not None:
+        script_dir = Path(__file__).parent.absolute()
+        web_dir = script_dir / "build_emscripten" / "web"
+        wasm_file = Path(args.size_report) if args.size_report else web_dir / load_artifact_names(web_dir)["ft2-clone.wasm"]
+        analyze_wasm_size(script_dir, wasm_file)
+        sys.exit(0)
+
+    if args.prewarm:
+        run_prewarm(args)
+        sys.exit(0)
+
+    if args.variants is not None:
+        sys.exit(0 if run_variant_matrix(args) else 1)
+
+    if args.explain is not None:
+        script_dir = Path(__file__).parent.absolute()
+        explain_rebuild(script_dir, script_dir / "build_emscripten", args.explain)
+        sys.exit(0)
+
     print_colored("FastTracker II Clone - Unified Emscripten Build Script", Colors.GREEN)
     print_colored("=" * 60, Colors.GREEN)
     print_colored(f"Platform: {platform.system()} {platform.machine()}", Colors.BLUE)
     print_colored(f"Python: {sys.version.split()[0]}", Colors.BLUE)
     print("")
     
-    # Check prerequisites
+    if args.profile:
+        profiler.enabled = True
+    try:
+        run_build(args)
+    finally:
+        if args.profile:
+            profiler.write(args.profile)
+
+def configure_em_cache(args):
+    """Point EM_CACHE at the persistent cache unless --no-em-cache"""
+    if args.no_em_cache:
+        return
+    cache_dir = em_cache.configure(args.em_cache, get_emcc_version())
+    print_colored(f"Using Emscripten cache: {cache_dir}", Colors.BLUE)
+
+def run_prewarm(args):
+    """Fill the Emscripten cache ahead of the first build, e.g. in a CI cache-restore step"""
+    if args.profile:
+        profiler.enabled = True
     if not check_emscripten():
         sys.exit(1)
+    configure_em_cache(args)
+    if args.variants is not None:
+        variants = expand_variant_matrix(args.variants)
+    else:
+        variants = [args.variant or DEFAULT_VARIANT]
+
+    start = time.perf_counter()
+    built = prewarm_em_cache(Path(__file__).parent.absolute(), variants)
+    elapsed = time.perf_counter() - start
+    if built:
+        print_colored(f"Prewarmed in {elapsed:.1f}s: built {len(built)} ports/system libraries", Colors.GREEN)
+    else:
+        print_colored(f"Emscripten cache was already warm ({elapsed:.1f}s)", Colors.GREEN)
+    if args.profile:
+        profiler.write(args.profile)
+
+def run_build(args):
+    """Run every build phase, recording each one in the profiler"""
+    # Check prerequisites
+    with profiler.phase("check emscripten"):
+        if not check_emscripten():
+            sys.exit(1)
+        configure_em_cache(args)
     
-    # Set up build environment
-    script_dir, build_dir = setup_build_environment()
+    # Set up build environment; variants build into their own directory
+    with profiler.phase("setup build environment"):
+        build_dir = VARIANTS_DIR / variant_name(args.variant) if args.variant else None
+        script_dir, build_dir = setup_build_environment(clean=args.clean, build_dir=build_dir)
     
-    # Copy assets
-    copy_assets(script_dir, build_dir)
+    cache = None
+    if not args.no_cache:
+        cache = CompileCache(args.cache_dir, args.cache_max_size, get_emcc_version())
+        print_colored(f"Using compile cache: {cache.cache_dir}", Colors.BLUE)
     
     try:
-        # Try direct emcc compilation first (more reliable)
-        build_with_direct_emcc(script_dir, build_dir)
-        
-        # Verify build success
-        success = verify_build(build_dir)
+        if args.watch:
+            watch_and_rebuild(args, script_dir, build_dir, cache)
+            sys.exit(0)
         
+        success = build_outputs(args, script_dir, build_dir, cache)
         if success:
             print_colored("Build completed successfully!", Colors.GREEN)
             sys.exit(0)
@@ -340,5 +2621,80 @@ def main():
         print_colored(f"Unexpected error: {e}", Colors.RED)
         sys.exit(1)
 
+def build_outputs(args, script_dir, build_dir, cache, link=True, changed=()):
+    """Sync assets and build everything that depends on them; returns whether the build verified.
+
+    With link=False (asset-only changes in --watch mode) the compile, link, hashing and
+    verification steps are skipped and the existing binaries are kept.
+    """
+    # Copy assets
+    with profiler.phase("copy assets"):
+        copy_assets(script_dir, build_dir, link=args.link_assets)
+
+    # Lazy builds list web_user for on-demand fetching instead of packaging it
+    user_manifest = build_dir / "web" / "web_user-manifest.json"
+    if args.lazy_user_files:
+        with profiler.phase("write web_user manifest"):
+            count = write_user_file_manifest(build_dir)
+        print_colored(f"web_user manifest: {count} files fetched on demand", Colors.CYAN)
+    elif user_manifest.exists():
+        user_manifest.unlink()
+
+    # Index the module library so the app and servers can list it without scanning
+    modules_dir = build_dir / "web" / "web_user" / "modules"
+    if modules_dir.is_dir():
+        with profiler.phase("index modules"):
+            catalog, stats = update_catalog(modules_dir, build_dir / "web" / "module-catalog.json", args.jobs)
+            print_colored(f"Module catalog: {len(catalog['modules'])} modules "
+                          f"({stats['indexed']} indexed, {stats['reused']} unchanged)", Colors.CYAN)
+
+    if link:
+        # Try direct emcc compilation first (more reliable)
+        extra_linker_flags = ["--profiling-funcs"] if args.size_names else []
+        build_with_direct_emcc(script_dir, build_dir, args.jobs, cache, extra_linker_flags,
+                               lazy_user_files=args.lazy_user_files,
+                               chunked_packages=args.chunked_packages,
+                               live_reload=args.watch,
+                               variant=args.variant,
+                               unity=args.unity,
+                               unity_balance=args.unity_balance,
+                               trace_file=args.profile or "build-profile.json")
+
+    packages_dir = build_dir / "web" / "packages"
+    if args.chunked_packages:
+        print_colored("Writing chunked data packages...", Colors.GREEN)
+        with profiler.phase("write data packages"):
+            build_data_packages(script_dir, build_dir, parse_size(args.chunk_size), args.lazy_user_files)
+    elif packages_dir.exists():
+        shutil.rmtree(packages_dir)
+
+    success = True
+    if link:
+        # A fresh link wrote unhashed names; without hashing, forget the previous manifest
+        manifest_file = build_dir / "web" / "asset-manifest.json"
+        if args.hash_names:
+            print_colored("Hashing build output names...", Colors.GREEN)
+            with profiler.phase("hash artifact names"):
+                hash_artifact_names(build_dir)
+        elif manifest_file.exists():
+            manifest_file.unlink()
+
+        if not args.no_compress:
+            print_colored("Precompressing build outputs...", Colors.GREEN)
+            with profiler.phase("compress artifacts"):
+                compress_artifacts(build_dir)
+
+        # Verify build success
+        with profiler.phase("verify build"):
+            success = verify_build(script_dir, build_dir, args.size_budget, args.size_history)
+
+    # Tell live-reloading browsers (see web/live-reload.js) that new outputs are in place
+    stamp_file = build_dir / "web" / LIVE_RELOAD_STAMP
+    if args.watch and success:
+        write_live_reload_stamp(build_dir, changed, link)
+    elif not args.watch and stamp_file.exists():
+        stamp_file.unlink()
+    return success
+
 if __name__ == "__main__":
     main()
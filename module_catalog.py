@@ -0,0 +1,392 @@
+#!/usr/bin/env python3
+"""
+FastTracker II Clone - Module library indexer
+Parses the headers of the module formats the loaders in src/modloaders support
+(XM, MOD, S3M, IT, STM, DIGI, BEM) and writes a compact JSON catalog of a module
+library, so the web build doesn't have to open every file to list the library.
+"""
+
+import os
+import sys
+import json
+import struct
+import hashlib
+import argparse
+import tempfile
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+# Bump when the layout of the catalog changes
+CATALOG_VERSION = 2
+
+# Same list as supportedModExtensions[] in ft2_module_loader.c (Disk Op. module mode)
+MODULE_EXTENSIONS = {'.xm', '.ft', '.nst', '.stk', '.mod', '.s3m', '.stm', '.fst', '.digi', '.bem', '.it'}
+
+# Below this many changed files, parsing inline beats starting worker processes
+MIN_PARALLEL_FILES = 32
+
+# mkstemp() creates files 0600; the catalog gets the mode open() would give it
+UMASK = os.umask(0o022)
+os.umask(UMASK)
+
+def decode_name(raw):
+    """Decode a fixed-size, NUL/space padded name field"""
+    return raw.split(b'\0', 1)[0].decode('cp437', errors='replace').strip()
+
+def mod_channels(module_id):
+    """Channel count for a MOD signature at offset 1080 (mirrors getModType() in ft2_load_mod.c)"""
+    if module_id in (b'M.K.', b'M!K!', b'NSMS', b'LARD', b'PATT', b'FLT4', b'EXO4', b'N.T.', b'M&K!', b'FEST'):
+        return 4
+    if module_id in (b'FLT8', b'EXO8', b'OKTA', b'OCTA'):
+        return 8
+    if module_id in (b'CD61', b'CD81'):
+        return module_id[2] - ord('0')
+    text = module_id.decode('latin-1')
+    if text[0] in '123456789' and text[1:] == 'CHN':
+        return int(text[0])
+    if text[:2].isdigit() and text[0] != '0' and text[2:] in ('CH', 'CN'):
+        return int(text[:2])
+    if text[:3] == 'FA0' and text[3] in '45678':
+        return int(text[3])
+    return 0
+
+def parse_xm(data):
+    numOrders, _, numChannels, numPatterns, numInstr = struct.unpack_from('<5H', data, 64)
+    return {
+        'format': 'XM',
+        'title': decode_name(data[17:37]),
+        'channels': numChannels,
+        'patterns': numPatterns,
+        'instruments': numInstr,
+        'length': numOrders,
+    }
+
+def parse_mod(data, channels):
+    lengths = [struct.unpack_from('>H', data, 20 + i * 30 + 22)[0] for i in range(31)]
+    return {
+        'format': 'MOD',
+        'title': decode_name(data[0:20]),
+        'channels': channels,
+        'patterns': max(data[952:1080]) + 1,
+        'instruments': sum(1 for length in lengths if length > 0),
+        'length': data[950],
+    }
+
+def parse_stk(data):
+    """15-sample Soundtracker MOD (FORMAT_POSSIBLY_STK in ft2_module_loader.c)"""
+    lengths = [struct.unpack_from('>H', data, 20 + i * 30 + 22)[0] for i in range(15)]
+    return {
+        'format': 'MOD',
+        'title': decode_name(data[0:20]),
+        'channels': 4,
+        'patterns': max(data[472:600]) + 1,
+        'instruments': sum(1 for length in lengths if length > 0),
+        'length': data[470],
+    }
+
+def parse_digi(data):
+    """DIGI Booster (non-Pro) module (ft2_load_digi.c)"""
+    lengths = struct.unpack_from('>31I', data, 176)
+    return {
+        'format': 'DIGI',
+        'title': decode_name(data[610:630]),
+        'channels': data[0x19],
+        'patterns': data[46] + 1,
+        'instruments': sum(1 for length in lengths if length > 0),
+        'length': data[47] + 1,
+    }
+
+def is_bem(data):
+    """detectBEM() in ft2_load_bem.c: "UN05", XM periods, tracker string after the title"""
+    if data[0:4] != b'UN05' or not data[0x131] & 1:
+        return False
+    title_length, = struct.unpack_from('<H', data, 0x132)
+    if title_length == 0 or title_length > 512:
+        return False
+    tracker = 0x134 + title_length + 2
+    return data[tracker:tracker + 17] == b'FastTracker v2.00'
+
+def parse_bem(data):
+    """MikMod UNI module converted from XM (ft2_load_bem.c)"""
+    numchn, numpos, _, numpat, _, numins = struct.unpack_from('<B5H', data, 4)
+    title_length, = struct.unpack_from('<H', data, 0x132)
+    return {
+        'format': 'BEM',
+        'title': decode_name(data[0x134:0x134 + title_length]),
+        'channels': numchn,
+        'patterns': numpat,
+        'instruments': numins,
+        'length': numpos,
+    }
+
+def parse_s3m(data):
+    numOrders, numSamples, numPatterns = struct.unpack_from('<3h', data, 32)
+    orders = data[96:96 + max(numOrders, 0)]
+    length = 0
+    for order in orders:
+        if order == 255:
+            break
+        if order != 254:
+            length += 1
+    return {
+        'format': 'S3M',
+        'title': decode_name(data[0:28]),
+        'channels': sum(1 for setting in data[64:96] if setting < 16),
+        'patterns': numPatterns,
+        'instruments': numSamples,
+        'length': length,
+    }
+
+def parse_it(data):
+    ordNum, insNum, smpNum, patNum, _, _, flags = struct.unpack_from('<7H', data, 32)
+    orders = data[192:192 + ordNum]
+    length = 0
+    for order in orders:
+        if order == 255:
+            break
+        if order != 254:
+            length += 1
+    return {
+        'format': 'IT',
+        'title': decode_name(data[4:30]),
+        # Bit 7 of the initial pan marks a disabled channel
+        'channels': sum(1 for pan in data[64:128] if pan < 128),
+        'patterns': patNum,
+        'instruments': insNum if flags & 4 else smpNum,
+        'length': length,
+    }
+
+def parse_stm(data):
+    lengths = [struct.unpack_from('<H', data, 48 + i * 32 + 16)[0] for i in range(31)]
+    length = 0
+    while length < 128 and data[1040 + length] < 99:
+        length += 1
+    return {
+        'format': 'STM',
+        'title': decode_name(data[0:20]),
+        'channels': 4,
+        'patterns': data[33],
+        'instruments': sum(1 for sample_length in lengths if sample_length > 0),
+        'length': length,
+    }
+
+def parse_module_header(data, size):
+    """Identify a module from its first bytes like detectModule() in ft2_module_loader.c.
+
+    `data` must hold at least the first 1536 bytes (or the whole file when shorter).
+    Returns the header fields, or None for unsupported/truncated files.
+    """
+    head = data.ljust(1168, b'\0')
+    module_id = head[1080:1084]
+    if is_bem(head):
+        return parse_bem(head)
+    if head[0:20] == b'DIGI Booster module\0' and 1 <= head[0x19] <= 8:
+        return parse_digi(head)
+    if head[0x2C:0x30] == b'SCRM' and head[0x1D] == 16:
+        return parse_s3m(head)
+    if head[0x14:0x1C] in (b'!Scream!', b'BMOD2STM', b'WUZAMOD!', b'SWavePro') and head[0x1D] == 2:
+        return parse_stm(head)
+    channels = mod_channels(module_id)
+    if channels and size >= 1084:
+        return parse_mod(head, channels)
+    if head[0:4] == b'IMPM' and head[0x1D] == 0:
+        return parse_it(head)
+    if head[0:17] == b'Extended Module: ':
+        return parse_xm(head)
+    if 1624 <= size <= 984634 and head[470] <= 128 and head[471] <= 220:
+        return parse_stk(head)
+    return None
+
+def index_module(path):
+    """Parse one module file; returns (header fields or None, sha256)"""
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        # Enough for every fixed header plus the IT order list
+        head = f.read(1536)
+        sha.update(head)
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha.update(chunk)
+        size = os.fstat(f.fileno()).st_size
+    try:
+        info = parse_module_header(head, size)
+    except (struct.error, IndexError, ValueError):
+        info = None
+    return info, sha.hexdigest()
+
+def index_entry(task):
+    """Worker: build the catalog entry for (relative path, absolute path, stat)"""
+    rel, path, size, mtime_ns = task
+    try:
+        info, digest = index_module(path)
+    except OSError as e:
+        return rel, None, str(e)
+    entry = {'size': size, 'mtime_ns': mtime_ns, 'sha256': digest}
+    if info:
+        entry.update(info)
+    return rel, entry, None
+
+def scan_modules(modules_dir):
+    """Yield (relative path, absolute path, size, mtime_ns) for every module-like file"""
+    for root, dirs, files in os.walk(modules_dir):
+        dirs.sort()
+        for name in sorted(files):
+            if os.path.splitext(name)[1].lower() not in MODULE_EXTENSIONS and not name.lower().startswith('mod.'):
+                continue
+            path = os.path.join(root, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            rel = os.path.relpath(path, modules_dir).replace(os.sep, '/')
+            yield rel, path, st.st_size, st.st_mtime_ns
+
+def load_catalog(catalog_file):
+    """Load an existing catalog, or an empty one if it is missing or from another version"""
+    try:
+        with open(catalog_file) as f:
+            catalog = json.load(f)
+    except (OSError, ValueError):
+        return {'version': CATALOG_VERSION, 'modules': {}, 'unsupported': {}}
+    if catalog.get('version') != CATALOG_VERSION:
+        return {'version': CATALOG_VERSION, 'modules': {}, 'unsupported': {}}
+    return catalog
+
+def save_catalog(catalog_file, catalog):
+    """Write the catalog compactly and atomically"""
+    catalog_file = Path(catalog_file)
+    catalog_file.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=catalog_file.parent, prefix=catalog_file.name, suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(catalog, f, separators=(',', ':'), sort_keys=True)
+        os.chmod(tmp, 0o666 & ~UMASK)
+        os.replace(tmp, catalog_file)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+def update_catalog(modules_dir, catalog_file, jobs=None):
+    """Re-index files whose size or mtime changed and drop removed ones.
+
+    Returns (catalog, stats) where stats counts indexed, reused and removed files.
+    The catalog is only rewritten when something changed.
+    """
+    old = load_catalog(catalog_file)
+    known = dict(old['modules'])
+    known.update(old['unsupported'])
+    catalog = {'version': CATALOG_VERSION, 'modules': {}, 'unsupported': {}}
+    stats = {'indexed': 0, 'reused': 0, 'removed': 0, 'errors': 0}
+
+    tasks = []
+    for rel, path, size, mtime_ns in scan_modules(modules_dir):
+        entry = known.pop(rel, None)
+        if entry and entry['size'] == size and entry['mtime_ns'] == mtime_ns:
+            catalog['modules' if 'format' in entry else 'unsupported'][rel] = entry
+            stats['reused'] += 1
+        else:
+            tasks.append((rel, path, size, mtime_ns))
+    stats['removed'] = len(known)
+
+    if len(tasks) >= MIN_PARALLEL_FILES and (jobs is None or jobs > 1):
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            results = list(executor.map(index_entry, tasks, chunksize=16))
+    else:
+        results = [index_entry(task) for task in tasks]
+
+    for rel, entry, error in results:
+        if error:
+            print(f"Warning: could not index {rel}: {error}", file=sys.stderr)
+            stats['errors'] += 1
+            continue
+        catalog['modules' if 'format' in entry else 'unsupported'][rel] = entry
+        stats['indexed'] += 1
+
+    if stats['indexed'] or stats['removed'] or not os.path.exists(catalog_file):
+        save_catalog(catalog_file, catalog)
+    return catalog, stats
+
+def synthetic_digi(channels=8):
+    """A minimal DIGI Booster header: 3 patterns, 5 orders, samples 1 and 4 used"""
+    data = bytearray(1572)
+    data[0:20] = b'DIGI Booster module\0'
+    data[20:24] = b'V1.7'
+    data[0x19] = channels
+    data[46], data[47] = 2, 4
+    struct.pack_into('>I', data, 176, 1000)
+    struct.pack_into('>I', data, 176 + 3 * 4, 2000)
+    data[610:619] = b'digi song'
+    return bytes(data)
+
+def synthetic_bem(channels=12):
+    """A minimal BEM header: 9 positions, 6 patterns, 3 instruments"""
+    title = b'bem song'
+    data = bytearray(1024)
+    data[0:4] = b'UN05'
+    struct.pack_into('<B5H', data, 4, channels, 9, 0, 6, 40, 3)
+    data[0x131] = 1
+    struct.pack_into('<H', data, 0x132, len(title))
+    data[0x134:0x134 + len(title)] = title
+    tracker = b'FastTracker v2.00'
+    struct.pack_into('<H', data, 0x134 + len(title), len(tracker))
+    data[0x136 + len(title):0x136 + len(title) + len(tracker)] = tracker
+    return bytes(data)
+
+def self_test():
+    """Check format detection against synthetic headers; returns a list of failures"""
+    cases = [
+        ("DIGI", synthetic_digi(), {'format': 'DIGI', 'title': 'digi song', 'channels': 8,
+                                    'patterns': 3, 'instruments': 2, 'length': 5}),
+        ("DIGI, 9 channels", synthetic_digi(9), None),
+        ("BEM", synthetic_bem(), {'format': 'BEM', 'title': 'bem song', 'channels': 12,
+                                  'patterns': 6, 'instruments': 3, 'length': 9}),
+    ]
+    failures = []
+    for name, data, expected in cases:
+        info = parse_module_header(data, len(data))
+        if expected is None and info is not None and info['format'] == 'DIGI':
+            failures.append(f"{name}: detected as {info}")
+        elif expected is not None and info != expected:
+            failures.append(f"{name}: expected {expected}, got {info}")
+    return failures
+
+def parse_arguments():
+    """Parse command line arguments"""
+    script_dir = Path(__file__).parent
+    parser = argparse.ArgumentParser(description="Index a module library into a JSON catalog")
+    parser.add_argument('modules_dir', nargs='?', default=str(script_dir / "web" / "web_user" / "modules"),
+                        help="directory to index (default: web/web_user/modules)")
+    parser.add_argument('-o', '--output', default=None,
+                        help="catalog file (default: build_emscripten/web/module-catalog.json)")
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help="parallel indexing processes (default: number of CPUs)")
+    parser.add_argument('--full', action='store_true',
+                        help="ignore the existing catalog and re-index every file")
+    parser.add_argument('--self-test', action='store_true',
+                        help="check format detection against built-in synthetic headers and exit")
+    return parser.parse_args()
+
+def main():
+    """Main entry point"""
+    args = parse_arguments()
+    if args.self_test:
+        failures = self_test()
+        for failure in failures:
+            print(f"FAIL {failure}")
+        print("Self-test " + ("failed" if failures else "passed"))
+        sys.exit(1 if failures else 0)
+    output = args.output or str(Path(__file__).parent / "build_emscripten" / "web" / "module-catalog.json")
+    if not os.path.isdir(args.modules_dir):
+        print(f"Error: Module directory not found: {args.modules_dir}")
+        sys.exit(1)
+    if args.full and os.path.exists(output):
+        os.remove(output)
+
+    catalog, stats = update_catalog(args.modules_dir, output, args.jobs)
+    print(f"Indexed {stats['indexed']}, reused {stats['reused']}, removed {stats['removed']} "
+          f"({len(catalog['modules'])} modules, {len(catalog['unsupported'])} unsupported)")
+    print(f"Catalog: {output}")
+    if stats['errors']:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
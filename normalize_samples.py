@@ -0,0 +1,459 @@
+#!/usr/bin/env python3
+"""
+FastTracker II Clone - Sample library normalizer
+Converts WAV and AIFF samples to what the loaders in src/smploaders keep after
+loading them: 24/32-bit and float data is peak-normalized to 16 bits exactly
+like normalizeSigned32Bit()/normalize32BitFloatToSigned16Bit() do, and stereo
+is mixed down (or reduced to one channel) like the "stereo sample" request.
+The result is written as a plain 8/16-bit mono WAV, so sample packs preloaded
+from web_user are smaller and need no conversion in the browser.
+"""
+
+import os
+import sys
+import json
+import stat
+import struct
+import hashlib
+import argparse
+import tempfile
+from array import array
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+# Bump when the layout of the manifest or the conversion changes
+MANIFEST_VERSION = 1
+
+SAMPLE_EXTENSIONS = {'.wav', '.aif', '.aiff', '.aifc'}
+
+# Below this many changed files, converting inline beats starting worker processes
+MIN_PARALLEL_FILES = 4
+
+# mkstemp() creates files 0600; written files get the source's mode, or the one open() would give
+UMASK = os.umask(0o022)
+os.umask(UMASK)
+
+WAV_FORMAT_PCM = 1
+WAV_FORMAT_IEEE_FLOAT = 3
+WAV_FORMAT_EXTENSIBLE = 0xFFFE
+
+# Chunks that only describe the old sample data
+WAV_DROPPED_CHUNKS = {b'fmt ', b'data', b'fact', b'PEAK'}
+
+# AIFC compression types ft2_load_aiff.c accepts; the others are converted to make them loadable
+AIFC_LOADABLE = {b'raw ', b'fl32', b'FL32', b'fl64', b'FL64'}
+
+# AIFC compression types: (byte order, unsigned 8-bit, float)
+AIFC_TYPES = {
+    b'NONE': ('>', False, False), b'twos': ('>', False, False), b'sowt': ('<', False, False),
+    b'raw ': ('>', True, False), b'fl32': ('>', False, True), b'FL32': ('>', False, True),
+    b'fl64': ('>', False, True), b'FL64': ('>', False, True),
+}
+
+INT32_MAX = 0x7FFFFFFF
+INT16_MAX = 0x7FFF
+
+SIGN_FLIP = bytes(i ^ 0x80 for i in range(256))
+
+class UnsupportedSample(Exception):
+    """The file isn't a sample this tool (or the tracker) can convert"""
+
+def iter_chunks(data, start, big_endian):
+    """Yield (id, offset, size) for the RIFF/IFF chunks from `start` on"""
+    pos = start
+    size_format = '>I' if big_endian else '<I'
+    while pos + 8 <= len(data):
+        chunk_id = data[pos:pos + 4]
+        size = struct.unpack_from(size_format, data, pos + 4)[0]
+        # Like the loaders, clamp chunks that claim to run past the end of the file
+        size = min(size, len(data) - pos - 8)
+        yield chunk_id, pos + 8, size
+        pos += 8 + size + (size & 1)
+
+def read_extended(raw):
+    """Decode an 80-bit IEEE extended float (the AIFF sample rate)"""
+    exponent, mantissa = struct.unpack('>HQ', raw)
+    sign = -1 if exponent & 0x8000 else 1
+    exponent &= 0x7FFF
+    if exponent == 0 and mantissa == 0:
+        return 0.0
+    return sign * mantissa * 2.0 ** (exponent - 16383 - 63)
+
+def parse_wav(data):
+    """Return the sample description and the chunks to keep"""
+    fmt = None
+    sample_data = None
+    extra_chunks = []
+    extensible = False
+    for chunk_id, offset, size in iter_chunks(data, 12, False):
+        if chunk_id == b'fmt ' and size >= 16:
+            fmt = struct.unpack_from('<HHIIHH', data, offset)
+            extensible = fmt[0] == WAV_FORMAT_EXTENSIBLE
+            if extensible and size >= 26:
+                # The real format is the first two bytes of the subformat GUID
+                fmt = (struct.unpack_from('<H', data, offset + 24)[0],) + fmt[1:]
+        elif chunk_id == b'data':
+            sample_data = data[offset:offset + size]
+        elif chunk_id not in WAV_DROPPED_CHUNKS:
+            extra_chunks.append((chunk_id, data[offset:offset + size]))
+    if fmt is None or sample_data is None:
+        raise UnsupportedSample("no fmt or data chunk")
+    audio_format, channels, rate, _, _, bits = fmt
+    if audio_format not in (WAV_FORMAT_PCM, WAV_FORMAT_IEEE_FLOAT):
+        raise UnsupportedSample(f"WAV format {audio_format:#x}")
+    # The loader only knows plain PCM and float headers, not WAVE_FORMAT_EXTENSIBLE
+    return {
+        'container': 'wav', 'channels': channels, 'rate': rate, 'bits': bits,
+        'float': audio_format == WAV_FORMAT_IEEE_FLOAT, 'byteorder': '<', 'unsigned8': True,
+        'data': sample_data, 'chunks': extra_chunks, 'loadable': not extensible,
+    }
+
+def parse_aiff(data):
+    """Return the sample description of an AIFF/AIFC file"""
+    is_aifc = data[8:12] == b'AIFC'
+    comm = None
+    sample_data = None
+    for chunk_id, offset, size in iter_chunks(data, 12, True):
+        if chunk_id == b'COMM' and size >= 18:
+            comm = (data[offset:offset + size], size)
+        elif chunk_id == b'SSND' and size >= 8:
+            data_offset = struct.unpack_from('>I', data, offset)[0]
+            sample_data = data[offset + 8 + data_offset:offset + size]
+    if comm is None or sample_data is None:
+        raise UnsupportedSample("no COMM or SSND chunk")
+    raw, size = comm
+    channels, _, bits = struct.unpack_from('>HIH', raw, 0)
+    rate = read_extended(raw[8:18])
+    compression = raw[18:22] if is_aifc and size >= 22 else b'NONE'
+    if compression not in AIFC_TYPES:
+        raise UnsupportedSample(f"AIFC compression {compression.decode('latin-1')!r}")
+    byteorder, unsigned8, is_float = AIFC_TYPES[compression]
+    return {
+        'container': 'aiff', 'channels': channels, 'rate': int(round(rate)), 'bits': bits, 'float': is_float,
+        'byteorder': byteorder, 'unsigned8': unsigned8, 'data': sample_data, 'chunks': [],
+        'loadable': not is_aifc or compression in AIFC_LOADABLE,
+    }
+
+def parse_sample(data):
+    """Parse a WAV or AIFF file by its header, like the sample loader does"""
+    if data[0:4] == b'RIFF' and data[8:12] == b'WAVE':
+        sample = parse_wav(data)
+    elif data[0:4] == b'FORM' and data[8:12] in (b'AIFF', b'AIFC'):
+        sample = parse_aiff(data)
+    else:
+        raise UnsupportedSample("not a WAV or AIFF file")
+    if sample['channels'] not in (1, 2):
+        raise UnsupportedSample(f"{sample['channels']} channels")
+    if sample['bits'] not in ((32, 64) if sample['float'] else (8, 16, 24, 32)):
+        raise UnsupportedSample(f"{sample['bits']}-bit {'float' if sample['float'] else 'integer'} data")
+    return sample
+
+def native(values, byteorder):
+    """Fix up an array read from `byteorder` data for this machine"""
+    if (byteorder == '<') != (sys.byteorder == 'little'):
+        values.byteswap()
+    return values
+
+def decode_samples(sample):
+    """Decode interleaved sample data to ('u8' | 's16' | 's32' | 'float', values)"""
+    data, bits, byteorder = sample['data'], sample['bits'], sample['byteorder']
+    if sample['float']:
+        typecode = 'f' if bits == 32 else 'd'
+        width = 4 if bits == 32 else 8
+        return 'float', native(array(typecode, data[:len(data) // width * width]), byteorder)
+    if bits == 8:
+        # The tracker keeps 8-bit samples as 8 bits; WAV stores them unsigned
+        return 'u8', array('B', data if sample['unsigned8'] else data.translate(SIGN_FLIP))
+    if bits == 16:
+        return 's16', native(array('h', data[:len(data) // 2 * 2]), byteorder)
+    if bits == 24:
+        # Widen to 32 bits with the 24 bits at the top, like the loaders
+        count = len(data) // 3
+        widened = bytearray(count * 4)
+        order = (0, 1, 2) if byteorder == '<' else (2, 1, 0)
+        for dst, src in zip((1, 2, 3), order):
+            widened[dst::4] = data[src:count * 3:3]
+        return 's32', native(array('i', bytes(widened)), '<')
+    return 's32', native(array('i', data[:len(data) // 4 * 4]), byteorder)
+
+def reduce_stereo(kind, values, mode):
+    """Turn interleaved stereo into mono the way ft2_load_wav.c/ft2_load_aiff.c do"""
+    silence = 128 if kind == 'u8' else 0
+    left, right = values[0::2], values[1::2]
+    if mode == 'left':
+        return left
+    if mode == 'right':
+        mono = right
+    elif kind == 'float':
+        mono = array(values.typecode, [(l + r) * 0.5 for l, r in zip(left, right)])
+    else:
+        mono = array(values.typecode, [(l + r) >> 1 for l, r in zip(left, right)])
+    # The loaders write silence into the last frame when mixing or taking the right channel
+    if mono:
+        mono[-1] = silence
+    return mono
+
+def to_tracker_precision(kind, values):
+    """Scale to what the tracker stores: 8-bit stays, 16-bit stays, the rest is peak-normalized to 16 bits"""
+    if kind in ('u8', 's16'):
+        return values
+    if not values:
+        return array('h')
+    peak = max(abs(max(values)), abs(min(values)))
+    if kind == 's32':
+        gain = INT32_MAX / peak if peak else 1.0
+        return array('h', [int(value * gain) >> 16 for value in values])
+    gain = INT16_MAX / peak if peak else 0.0
+    return array('h', [int(value * gain) for value in values])
+
+def needs_conversion(sample, stereo):
+    """Whether the file holds more than the tracker keeps, or isn't loadable as-is"""
+    return (sample['bits'] > 16 or sample['float'] or not sample['loadable']
+            or (sample['channels'] == 2 and stereo != 'keep'))
+
+def encode_wav(sample, kind, values, channels):
+    """Write an 8/16-bit PCM WAV, keeping chunks such as smpl (loops), xtra and LIST/INAM"""
+    bits = 8 if kind == 'u8' else 16
+    if bits == 16:
+        values = native(array('h', values), '<')
+    block_align = channels * bits // 8
+    fmt = struct.pack('<HHIIHH', WAV_FORMAT_PCM, channels, sample['rate'],
+                      sample['rate'] * block_align, block_align, bits)
+    pcm = values.tobytes()
+    chunks = [(b'fmt ', fmt)] + sample['chunks'] + [(b'data', pcm)]
+    body = b''.join(chunk_id + struct.pack('<I', len(payload)) + payload + (b'\0' if len(payload) & 1 else b'')
+                    for chunk_id, payload in chunks)
+    return b'RIFF' + struct.pack('<I', 4 + len(body)) + b'WAVE' + body
+
+def convert_sample(data, stereo):
+    """Convert one file; returns (WAV bytes or None if it is already compact, description)"""
+    sample = parse_sample(data)
+    description = (f"{sample['container']} {sample['bits']}-bit{' float' if sample['float'] else ''} "
+                   f"{'stereo' if sample['channels'] == 2 else 'mono'}")
+    if not needs_conversion(sample, stereo):
+        return None, description
+    kind, values = decode_samples(sample)
+    channels = sample['channels']
+    if channels == 2 and stereo != 'keep':
+        values = reduce_stereo(kind, values, stereo)
+        channels = 1
+    values = to_tracker_precision(kind, values)
+    return encode_wav(sample, kind, values, channels), description
+
+def output_name(rel, taken):
+    """Name of the converted file: same stem as .wav, unless another file already uses that name"""
+    stem, ext = os.path.splitext(rel)
+    if ext.lower() == '.wav':
+        return rel
+    candidate = stem + '.wav'
+    return rel + '.wav' if candidate in taken else candidate
+
+def write_atomic(path, payload, mode=None):
+    """Write bytes to path via a temporary file in the same directory"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=path.name, suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(payload)
+        os.chmod(tmp, mode if mode is not None else 0o666 & ~UMASK)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+def normalize_entry(task):
+    """Worker: convert or copy one file; returns (manifest key, entry, reused, error)
+
+    The manifest describes the library as it is after the run: with an output
+    directory entries are keyed by source file, in place by the converted file.
+    """
+    rel, path, size, mtime_ns, old, target, settings = task
+    output_dir = Path(settings['output'])
+    in_place = settings['source'] == settings['output']
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+            mode = stat.S_IMODE(os.fstat(f.fileno()).st_mode)
+        digest = hashlib.sha256(data).hexdigest()
+        # Touched but identical: keep the earlier output
+        if old and old['sha256'] == digest and (output_dir / old['output']).is_file():
+            return rel, dict(old, size=size, mtime_ns=mtime_ns), True, None
+
+        entry = {'size': size, 'mtime_ns': mtime_ns, 'sha256': digest, 'original_size': size}
+        converted = None
+        if os.path.splitext(rel)[1].lower() in SAMPLE_EXTENSIONS:
+            try:
+                converted, entry['format'] = convert_sample(data, settings['stereo'])
+            except (UnsupportedSample, struct.error, ValueError, IndexError) as e:
+                entry['format'] = f"unsupported: {e}"
+
+        if converted is None:
+            if not in_place:
+                write_atomic(output_dir / rel, data, mode)
+            entry.update(action='unchanged', output=rel, output_size=size)
+            return rel, entry, False, None
+
+        write_atomic(output_dir / target, converted, mode)
+        entry.update(action='converted', output=target, output_size=len(converted))
+        if in_place:
+            if target != rel:
+                os.remove(path)
+            # Describe the file that now sits in the library, so the next run skips it
+            st = os.stat(output_dir / target)
+            entry.update(size=st.st_size, mtime_ns=st.st_mtime_ns, sha256=hashlib.sha256(converted).hexdigest())
+            return target, entry, False, None
+    except OSError as e:
+        return rel, None, False, str(e)
+    return rel, entry, False, None
+
+def scan_library(library_dir):
+    """Yield (relative path, absolute path, size, mtime_ns) for every file in the library"""
+    for root, dirs, files in os.walk(library_dir):
+        dirs.sort()
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            rel = os.path.relpath(path, library_dir).replace(os.sep, '/')
+            yield rel, path, st.st_size, st.st_mtime_ns
+
+def load_manifest(manifest_file, settings):
+    """Load the previous run's manifest, or an empty one for another library, output or settings"""
+    empty = {'version': MANIFEST_VERSION, 'settings': settings, 'files': {}}
+    try:
+        with open(manifest_file) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return empty
+    if manifest.get('version') != MANIFEST_VERSION or manifest.get('settings') != settings:
+        return empty
+    return manifest
+
+def save_manifest(manifest_file, manifest):
+    """Write the manifest atomically"""
+    manifest_file = Path(manifest_file)
+    manifest_file.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=manifest_file.parent, prefix=manifest_file.name, suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+        os.chmod(tmp, 0o666 & ~UMASK)
+        os.replace(tmp, manifest_file)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+def normalize_library(library_dir, output_dir, manifest_file, stereo='mix', jobs=None):
+    """Convert new and changed files, reuse unchanged ones and drop outputs of removed ones.
+
+    Returns (manifest, stats) where stats counts converted, unchanged, reused and
+    removed files, errors and the bytes saved by this run.
+    """
+    settings = {'source': os.path.abspath(library_dir), 'output': os.path.abspath(output_dir), 'stereo': stereo}
+    in_place = settings['source'] == settings['output']
+    old = load_manifest(manifest_file, settings)
+    known = dict(old['files'])
+    manifest = {'version': MANIFEST_VERSION, 'settings': settings, 'files': {}}
+    stats = {'converted': 0, 'unchanged': 0, 'reused': 0, 'removed': 0, 'errors': 0, 'bytes_saved': 0}
+
+    files = list(scan_library(library_dir))
+    taken = {rel for rel, _, _, _ in files}
+    tasks = []
+    for rel, path, size, mtime_ns in files:
+        entry = known.pop(rel, None)
+        if (entry and entry['size'] == size and entry['mtime_ns'] == mtime_ns
+                and os.path.isfile(os.path.join(output_dir, entry['output']))):
+            manifest['files'][rel] = entry
+            stats['reused'] += 1
+        else:
+            tasks.append((rel, path, size, mtime_ns, entry, output_name(rel, taken), settings))
+
+    # Outputs of files that are gone from the library
+    if not in_place:
+        for entry in known.values():
+            target = os.path.join(output_dir, entry['output'])
+            if os.path.isfile(target):
+                os.remove(target)
+    stats['removed'] = len(known)
+
+    if len(tasks) >= MIN_PARALLEL_FILES and (jobs is None or jobs > 1):
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            results = list(executor.map(normalize_entry, tasks))
+    else:
+        results = [normalize_entry(task) for task in tasks]
+
+    for key, entry, reused, error in results:
+        if error:
+            print(f"Warning: could not convert {key}: {error}", file=sys.stderr)
+            stats['errors'] += 1
+            continue
+        manifest['files'][key] = entry
+        if reused:
+            stats['reused'] += 1
+        else:
+            stats[entry['action']] += 1
+            stats['bytes_saved'] += entry['original_size'] - entry['output_size']
+
+    save_manifest(manifest_file, manifest)
+    return manifest, stats
+
+def format_size(num_bytes):
+    """Format a byte count for humans"""
+    for unit in ('B', 'KB', 'MB'):
+        if abs(num_bytes) < 1024:
+            return f"{num_bytes:.1f} {unit}" if unit != 'B' else f"{num_bytes} B"
+        num_bytes /= 1024
+    return f"{num_bytes:.1f} GB"
+
+def parse_arguments():
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(
+        description="Convert a WAV/AIFF sample library to the 8/16-bit mono samples the tracker keeps")
+    parser.add_argument('library', help="sample or instrument library to convert")
+    parser.add_argument('-o', '--output', default=None,
+                        help="directory for the converted library, e.g. web/web_user/samples "
+                             "(other files are copied unchanged)")
+    parser.add_argument('--in-place', action='store_true',
+                        help="replace files in the library itself instead of writing to --output")
+    parser.add_argument('--stereo', choices=['mix', 'left', 'right', 'keep'], default='mix',
+                        help="what to do with stereo samples; the tracker asks on every load and mixes by "
+                             "default (default: mix)")
+    parser.add_argument('--manifest', default=None,
+                        help="manifest of converted files, used to skip unchanged ones "
+                             "(default: build_emscripten/sample-manifest.json)")
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help="parallel conversion processes (default: number of CPUs)")
+    parser.add_argument('--full', action='store_true',
+                        help="ignore the manifest and convert every file again")
+    args = parser.parse_args()
+    if bool(args.output) == args.in_place:
+        parser.error("give either -o/--output or --in-place")
+    return args
+
+def main():
+    """Main entry point"""
+    args = parse_arguments()
+    output = args.library if args.in_place else args.output
+    manifest_file = args.manifest or str(Path(__file__).parent / "build_emscripten" / "sample-manifest.json")
+    if not os.path.isdir(args.library):
+        print(f"Error: Library directory not found: {args.library}")
+        sys.exit(1)
+    if args.full and os.path.exists(manifest_file):
+        os.remove(manifest_file)
+
+    manifest, stats = normalize_library(args.library, output, manifest_file, args.stereo, args.jobs)
+    converted = [entry for entry in manifest['files'].values() if entry['action'] == 'converted']
+    before = sum(entry['original_size'] for entry in converted)
+    after = sum(entry['output_size'] for entry in converted)
+    print(f"Converted {stats['converted']}, unchanged {stats['unchanged']}, reused {stats['reused']}, "
+          f"removed {stats['removed']} ({format_size(stats['bytes_saved'])} saved by this run)")
+    print(f"Library: {len(converted)} converted samples, {format_size(before)} -> {format_size(after)} "
+          f"({format_size(before - after)} saved)")
+    print(f"Manifest: {manifest_file}")
+    if stats['errors']:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
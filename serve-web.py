@@ -4,40 +4,37 @@ Simple web server for serving FastTracker II Clone WebAssembly build
 Fixes caching and MIME type issues
 """
 
-import http.server
-import socketserver
 import mimetypes
+import argparse
 import os
 import sys
 from pathlib import Path
 
+from serve import FT2HTTPRequestHandler, add_server_arguments, create_server, serve_until_stopped
+
 # Add WASM MIME type
 mimetypes.add_type('application/wasm', '.wasm')
 
 
-class CustomHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
+class CustomHTTPRequestHandler(FT2HTTPRequestHandler):
     def end_headers(self):
-        # Add headers to prevent caching issues
-        self.send_header(
-            'Cache-Control', 'no-cache, no-store, must-revalidate')
-        self.send_header('Pragma', 'no-cache')
-        self.send_header('Expires', '0')
+        # Caching is handled by FT2HTTPRequestHandler: content-hashed build
+        # outputs are immutable, everything else is revalidated via ETag
 
         # Add CORS headers for local development
         self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
-
-        # Set proper MIME types
-        if self.path.endswith('.wasm'):
-            self.send_header('Content-Type', 'application/wasm')
-        elif self.path.endswith('.js'):
-            self.send_header('Content-Type', 'application/javascript')
-        elif self.path.endswith('.html'):
-            self.send_header('Content-Type', 'text/html')
+        self.send_header('Access-Control-Allow-Methods', 'GET, PUT, POST, OPTIONS')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type, X-Content-SHA256')
+        # Content-Type comes from FT2HTTPRequestHandler.guess_type
 
         super().end_headers()
 
+    def do_OPTIONS(self):
+        # CORS preflight, e.g. for uploads that send X-Content-SHA256
+        self.send_response(204)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
     def do_GET(self):
         # Handle root requests
         if self.path == '/':
@@ -46,12 +43,14 @@ class CustomHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
         # Handle missing favicon.ico
         if self.path == '/favicon.ico':
             self.send_response(404)
+            self.send_header('Content-Length', '0')
             self.end_headers()
             return
 
         # Handle service worker requests
         if self.path.endswith('/sw.js'):
             self.send_response(404)
+            self.send_header('Content-Length', '0')
             self.end_headers()
             return
 
@@ -59,7 +58,11 @@ class CustomHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
 
 
 def main():
-    PORT = 8000
+    parser = argparse.ArgumentParser(description="Serve the FastTracker II Clone WebAssembly build")
+    parser.add_argument('port', nargs='?', type=int, default=8000, help="port to listen on (default: 8000)")
+    add_server_arguments(parser)
+    args = parser.parse_args()
+    PORT = args.port
 
     # Change to build directory if we're not already there
     if not os.path.exists('web'):
@@ -72,20 +75,19 @@ def main():
     # Create index.html for easier navigation
     create_index_html()
 
-    with socketserver.TCPServer(("", PORT), CustomHTTPRequestHandler) as httpd:
+    with create_server(PORT, CustomHTTPRequestHandler, args) as httpd:
         print(f"FastTracker II Clone Web Server")
         print(f"Serving at http://localhost:{PORT}")
         print(f"")
         print(
             f"🎵 FastTracker II Clone: http://localhost:{PORT}/web/ft2-clone.html")
         print(f"📋 Test Page: http://localhost:{PORT}/test-fix.html")
+        if args.allow_upload:
+            print(f"⬆️  Uploads: http://localhost:{PORT}/api/upload/<name> -> {httpd.upload_dir}")
         print(f"")
         print(f"Press Ctrl+C to stop the server")
 
-        try:
-            httpd.serve_forever()
-        except KeyboardInterrupt:
-            print("\nServer stopped")
+        serve_until_stopped(httpd, args.grace)
 
 
 def create_index_html():
@@ -155,10 +157,11 @@ def create_index_html():
             <h3>🔧 Server Features:</h3>
             <ul style="text-align: left;">
                 <li>✅ Proper WASM MIME types</li>
-                <li>✅ No-cache headers (fixes reload issues)</li>
+                <li>✅ Immutable caching for content-hashed files, ETag revalidation for pages</li>
                 <li>✅ CORS headers for local development</li>
                 <li>✅ Handles missing favicon.ico</li>
                 <li>✅ Filters out service worker requests</li>
+                <li>✅ Concurrent HTTP/1.1 keep-alive connections</li>
             </ul>
         </div>
     </div>
@@ -5,27 +5,1251 @@ This serves the build output with proper MIME types for WebAssembly
 """
 
 import os
+import re
 import sys
+import errno
+import io
+import json
+import hashlib
+import datetime
+import email.utils
+import signal
+import time
+import socket
+import argparse
+import tempfile
+import shutil
+import threading
+import collections
 import http.server
-import socketserver
+import urllib.parse
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+from module_catalog import update_catalog
+from size_units import parse_size
+
+class ServerMetrics:
+    """Request counters and latency histograms, exported at /metrics.
+
+    Everything is a dict update under one lock per request, cheap enough to
+    leave on. Counters and histograms are keyed by (name, sorted label pairs).
+    """
+
+    latency_buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    descriptions = {
+        'ft2_http_requests_total': ('counter', "Requests by path, method and status"),
+        'ft2_http_response_bytes_total': ('counter', "Response body bytes sent by path"),
+        'ft2_http_request_duration_seconds': ('histogram', "Time to handle a request by path"),
+        'ft2_http_conditional_requests_total': ('counter', "Requests carrying If-None-Match or If-Modified-Since"),
+        'ft2_http_not_modified_total': ('counter', "Conditional requests answered with 304"),
+        'ft2_http_compressible_responses_total': ('counter', "File responses that have a precompressed variant"),
+        'ft2_http_compressed_responses_total': ('counter', "Responses served from a precompressed variant"),
+        'ft2_http_rejected_connections_total': ('counter', "Connections refused with 503 over the limit"),
+        'ft2_cache_hits_total': ('counter', "File bodies served from the in-memory cache"),
+        'ft2_cache_misses_total': ('counter', "File bodies read from disk into the in-memory cache"),
+        'ft2_cache_evictions_total': ('counter', "Least recently used bodies dropped from the in-memory cache"),
+        'ft2_cache_bytes': ('gauge', "Bytes held by the in-memory cache"),
+        'ft2_cache_entries': ('gauge', "Files held by the in-memory cache"),
+        'ft2_live_reload_clients': ('gauge', "Browser tabs subscribed to live reload"),
+        'ft2_http_connections': ('gauge', "Open client connections"),
+        'ft2_http_requests_in_flight': ('gauge', "Requests being handled right now"),
+        'ft2_uptime_seconds': ('gauge', "Seconds since the server started"),
+    }
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.started = time.time()
+
+    def inc(self, name, labels=(), value=1):
+        key = (name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def record_request(self, path, method, status, nbytes, seconds):
+        """Count one finished request; the histogram is [bucket counts..., count, sum]"""
+        with self.lock:
+            key = ('ft2_http_requests_total', (('method', method), ('path', path), ('status', str(status))))
+            self.counters[key] = self.counters.get(key, 0) + 1
+            if nbytes:
+                key = ('ft2_http_response_bytes_total', (('path', path),))
+                self.counters[key] = self.counters.get(key, 0) + nbytes
+            key = ('ft2_http_request_duration_seconds', (('path', path),))
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [0] * (len(self.latency_buckets) + 2)
+            for i, bound in enumerate(self.latency_buckets):
+                if seconds <= bound:
+                    histogram[i] += 1
+                    break
+            histogram[-2] += 1
+            histogram[-1] += seconds
+
+    @staticmethod
+    def format_labels(labels):
+        if not labels:
+            return ''
+        escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+        return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + '}'
+
+    def render(self, gauges):
+        """Prometheus text exposition format (version 0.0.4)"""
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = {key: list(value) for key, value in self.histograms.items()}
+        samples = {}
+        for (name, labels), value in sorted(counters.items()):
+            samples.setdefault(name, []).append(f"{name}{self.format_labels(labels)} {value}")
+        for (name, labels), histogram in sorted(histograms.items()):
+            lines = samples.setdefault(name, [])
+            cumulative = 0
+            for bound, count in zip(self.latency_buckets, histogram):
+                cumulative += count
+                lines.append(f"{name}_bucket{self.format_labels(labels + (('le', f'{bound:g}'),))} {cumulative}")
+            lines.append(f"{name}_bucket{self.format_labels(labels + (('le', '+Inf'),))} {histogram[-2]}")
+            lines.append(f"{name}_count{self.format_labels(labels)} {histogram[-2]}")
+            lines.append(f"{name}_sum{self.format_labels(labels)} {histogram[-1]:.6f}")
+        for name, value in gauges.items():
+            samples[name] = [f"{name} {value}"]
+
+        out = []
+        for name in sorted(samples):
+            kind, description = self.descriptions.get(name, ('untyped', name))
+            out.append(f"# HELP {name} {description}")
+            out.append(f"# TYPE {name} {kind}")
+            out.extend(samples[name])
+        return '\n'.join(out) + '\n'
+
+    def snapshot(self, gauges):
+        """The same numbers as a JSON-friendly dict"""
+        with self.lock:
+            counters = [{"name": name, "labels": dict(labels), "value": value}
+                        for (name, labels), value in sorted(self.counters.items())]
+            histograms = [{"name": name, "labels": dict(labels),
+                           "buckets": dict(zip((f"{b:g}" for b in self.latency_buckets), histogram)),
+                           "count": histogram[-2], "sum": round(histogram[-1], 6)}
+                          for (name, labels), histogram in sorted(self.histograms.items())]
+        return {"time": time.time(), "gauges": gauges, "counters": counters, "histograms": histograms}
+
+class ThreadPoolHTTPServer(http.server.HTTPServer):
+    """HTTP server that handles connections on a bounded pool of worker threads.
+
+    Each keep-alive connection occupies one worker until it closes or idles out,
+    so `max_connections` bounds both threads and open connections. Connections
+    over the limit get an immediate 503 instead of waiting behind the others.
+    """
+
+    request_queue_size = 128
+
+    def __init__(self, server_address, handler_class, max_connections=128, keep_alive_timeout=15.0):
+        super().__init__(server_address, handler_class)
+        self.keep_alive_timeout = keep_alive_timeout
+        self.draining = False
+        self.connections = set()
+        self.connections_lock = threading.Lock()
+        self.connection_slots = threading.BoundedSemaphore(max_connections)
+        self.executor = ThreadPoolExecutor(max_workers=max_connections, thread_name_prefix="http")
+        self.metrics = ServerMetrics()
+        self.metrics_file = None
+        self.artifact_cache = None
+        self.live_reload = None
+
+    def process_request(self, request, client_address):
+        if self.draining or not self.connection_slots.acquire(blocking=False):
+            self.metrics.inc('ft2_http_rejected_connections_total')
+            try:
+                request.sendall(b"HTTP/1.1 503 Service Unavailable\r\nContent-Length: 0\r\n"
+                                b"Retry-After: 1\r\nConnection: close\r\n\r\n")
+            except OSError:
+                pass
+            self.shutdown_request(request)
+            return
+        self.executor.submit(self.process_request_thread, request, client_address)
+
+    def process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self.connection_slots.release()
+
+    def register_connection(self, handler):
+        with self.connections_lock:
+            self.connections.add(handler)
+
+    def unregister_connection(self, handler):
+        with self.connections_lock:
+            self.connections.discard(handler)
+
+    def metrics_gauges(self):
+        with self.connections_lock:
+            connections = list(self.connections)
+        gauges = {
+            'ft2_http_connections': len(connections),
+            'ft2_http_requests_in_flight': sum(1 for handler in connections if handler.busy),
+            'ft2_uptime_seconds': round(time.time() - self.metrics.started, 3),
+        }
+        if self.live_reload:
+            gauges['ft2_live_reload_clients'] = self.live_reload.clients
+        if self.artifact_cache:
+            gauges['ft2_cache_bytes'] = self.artifact_cache.size
+            gauges['ft2_cache_entries'] = len(self.artifact_cache.entries)
+        return gauges
+
+    def write_metrics(self):
+        """Write a JSON snapshot of the metrics to metrics_file"""
+        if not self.metrics_file:
+            return
+        tmp = self.metrics_file + ".tmp"
+        with open(tmp, 'w') as f:
+            json.dump(self.metrics.snapshot(self.metrics_gauges()), f, indent=1)
+        os.replace(tmp, self.metrics_file)
+
+    def dump_metrics_periodically(self, metrics_file, interval):
+        """Keep metrics_file updated every `interval` seconds from a background thread"""
+        self.metrics_file = metrics_file
+        def loop():
+            while not self.draining:
+                time.sleep(interval)
+                try:
+                    self.write_metrics()
+                except OSError as e:
+                    print(f"Could not write {metrics_file}: {e}")
+        threading.Thread(target=loop, name="metrics-dump", daemon=True).start()
+
+    def drain(self, grace=5.0):
+        """Stop accepting, close idle keep-alive connections and let in-flight requests finish"""
+        self.draining = True
+        if self.live_reload:
+            # Live-reload streams never go idle; end them so they don't use up the grace period
+            self.live_reload.stop()
+        with self.connections_lock:
+            connections = list(self.connections)
+        for handler in connections:
+            if not handler.busy:
+                handler.close_idle()
+
+        done = threading.Event()
+        threading.Thread(target=lambda: (self.executor.shutdown(wait=True), done.set()), daemon=True).start()
+        if not done.wait(grace):
+            print(f"Closing {len(self.connections)} connections still open after {grace:g}s")
+            with self.connections_lock:
+                connections = list(self.connections)
+            for handler in connections:
+                handler.close_idle()
+            done.wait(grace)
+
+class ContentIndex:
+    """SHA-256 index of every file in the upload directory, for upload dedup.
+
+    Records are [size, mtime_ns, sha256] per relative path, persisted so that only
+    files changed since the last run are hashed again.
+    """
+
+    def __init__(self, root, index_file):
+        self.root = root
+        self.index_file = index_file
+        self.lock = threading.Lock()
+        self.records = None
+        self.by_digest = {}
+
+    def load(self):
+        try:
+            with open(self.index_file) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def save(self):
+        tmp = self.index_file + ".tmp"
+        with open(tmp, 'w') as f:
+            json.dump(self.records, f, separators=(',', ':'))
+        os.replace(tmp, self.index_file)
+
+    def refresh(self):
+        """Rescan the upload directory, hashing new and changed files (call with the lock held)"""
+        old = self.records if self.records is not None else self.load()
+        records = {}
+        for root, dirs, files in os.walk(self.root):
+            dirs[:] = [d for d in dirs if not d.startswith('.')]
+            for name in files:
+                if name.startswith('.'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                rel = os.path.relpath(path, self.root).replace(os.sep, '/')
+                record = old.get(rel)
+                if not record or record[0] != st.st_size or record[1] != st.st_mtime_ns:
+                    record = [st.st_size, st.st_mtime_ns, hash_path(path)]
+                records[rel] = record
+        self.records = records
+        self.by_digest = {record[2]: rel for rel, record in sorted(records.items())}
+        self.save()
+
+    def find(self, digest):
+        """Relative path of a file with this content, if it is still there unchanged"""
+        rel = self.by_digest.get(digest)
+        if rel is None:
+            return None
+        size, mtime_ns, current = self.records[rel]
+        try:
+            st = os.stat(os.path.join(self.root, rel))
+        except OSError:
+            return None
+        return rel if current == digest and st.st_size == size and st.st_mtime_ns == mtime_ns else None
+
+    def add(self, rel, digest):
+        st = os.stat(os.path.join(self.root, rel))
+        self.records[rel] = [st.st_size, st.st_mtime_ns, digest]
+        if self.find(digest) is None:
+            self.by_digest[digest] = rel
+        self.save()
+
+def hash_path(path):
+    """SHA-256 hex digest of a file, read in bounded chunks"""
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+CachedArtifact = collections.namedtuple('CachedArtifact', 'body stat digest')
+
+class ArtifactCache:
+    """In-memory LRU cache of file bodies for hot artifacts (.wasm, .js, .data, modules).
+
+    An entry is reused as long as the file's size, mtime and inode are unchanged,
+    so a hit costs one stat() instead of open/fstat/sendfile. Bodies are immutable
+    bytes served through memoryview slices. Files larger than `max_file_size` are
+    never cached, so one large package can't flush everything else.
+    """
+
+    def __init__(self, max_bytes, max_file_size=None, metrics=None):
+        self.max_bytes = max_bytes
+        self.max_file_size = max_file_size if max_file_size is not None else max_bytes // 4
+        self.metrics = metrics
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict()
+        self.size = 0
+
+    def count(self, name, value=1):
+        if self.metrics:
+            self.metrics.inc(name, value=value)
+
+    def get(self, path):
+        """The cached artifact for `path`, reading it in on a miss; None if it can't be cached"""
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry and (entry.stat.st_mtime_ns, entry.stat.st_size, entry.stat.st_ino) == \
+                         (st.st_mtime_ns, st.st_size, st.st_ino):
+                self.entries.move_to_end(path)
+                hit = True
+            else:
+                hit = False
+        if hit:
+            self.count('ft2_cache_hits_total')
+            return entry
+        if st.st_size > self.max_file_size:
+            return None
+
+        try:
+            with open(path, 'rb') as f:
+                body = f.read()
+                st = os.fstat(f.fileno())
+        except OSError:
+            return None
+        if len(body) != st.st_size:
+            # Being rewritten right now; serve from disk until it settles
+            return None
+        entry = CachedArtifact(body, st, hashlib.sha256(body).hexdigest()[:20])
+        self.count('ft2_cache_misses_total')
+
+        evicted = 0
+        with self.lock:
+            old = self.entries.pop(path, None)
+            if old:
+                self.size -= len(old.body)
+            self.entries[path] = entry
+            self.size += len(body)
+            while self.size > self.max_bytes and len(self.entries) > 1:
+                _, dropped = self.entries.popitem(last=False)
+                self.size -= len(dropped.body)
+                evicted += 1
+        if evicted:
+            self.count('ft2_cache_evictions_total', evicted)
+        return entry
+
+class CachedBody:
+    """A cached file body handed to copyfile() in place of an open file"""
+
+    def __init__(self, body):
+        self.view = memoryview(body)
+
+    def close(self):
+        self.view.release()
+
+# Written by build-emscripten.py --watch after every rebuild, relative to the build directory
+LIVE_RELOAD_STAMP = "live-reload.json"
+
+class LiveReloadNotifier:
+    """Pushes the live-reload stamp written by `build-emscripten.py --watch` to browsers.
+
+    One background thread stats the stamp file; every Server-Sent Events connection
+    waits on a condition and is woken with the new contents when it changes. The
+    build replaces the file atomically, so a changed stat means a finished rebuild.
+    """
+
+    def __init__(self, stamp_file, interval=0.25):
+        self.stamp_file = stamp_file
+        self.interval = interval
+        self.condition = threading.Condition()
+        self.stopped = False
+        self.clients = 0
+        self.version = 0
+        self.data = self.read()
+        threading.Thread(target=self.loop, name="live-reload", daemon=True).start()
+
+    def signature(self):
+        try:
+            st = os.stat(self.stamp_file)
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size, st.st_ino
+
+    def read(self):
+        try:
+            with open(self.stamp_file) as f:
+                return json.dumps(json.load(f), separators=(',', ':'))
+        except (OSError, ValueError):
+            # No --watch build yet: build 0 lets the page detect the first one
+            return '{"build":0}'
+
+    def loop(self):
+        last = self.signature()
+        while not self.stopped:
+            time.sleep(self.interval)
+            current = self.signature()
+            if current == last:
+                continue
+            last = current
+            data = self.read()
+            with self.condition:
+                self.data = data
+                self.version += 1
+                self.condition.notify_all()
+
+    def wait(self, version, timeout):
+        """Wait until the stamp moves past `version`; returns the (version, data) now current"""
+        with self.condition:
+            self.condition.wait_for(lambda: self.version != version or self.stopped, timeout)
+            return self.version, self.data
+
+    def stop(self):
+        """Wake every connection so it can close"""
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+
+class FT2HTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
+    """Base handler for the dev servers: HTTP/1.1 persistent connections and graceful drain"""
+
+    protocol_version = "HTTP/1.1"
+    # Headers and the sendfile() body go out as separate writes; with Nagle on, the body
+    # waits for the client's delayed ACK (~40ms per keep-alive request)
+    disable_nagle_algorithm = True
+    busy = False
+
+    def setup(self):
+        # Idle keep-alive connections time out so they give their worker back
+        self.timeout = getattr(self.server, 'keep_alive_timeout', None)
+        super().setup()
+        if hasattr(self.server, 'register_connection'):
+            self.server.register_connection(self)
+
+    def finish(self):
+        if hasattr(self.server, 'unregister_connection'):
+            self.server.unregister_connection(self)
+        super().finish()
+
+    def parse_request(self):
+        self.busy = True
+        self.request_start = time.perf_counter()
+        return super().parse_request()
+
+    def handle_one_request(self):
+        self.request_start = None
+        self.response_status = None
+        self.response_length = 0
+        try:
+            super().handle_one_request()
+        finally:
+            self.busy = False
+            if self.request_start is not None and self.response_status is not None:
+                self.record_metrics()
+        if getattr(self.server, 'draining', False):
+            self.close_connection = True
+
+    def send_response(self, code, message=None):
+        self.response_status = code
+        super().send_response(code, message)
+
+    def send_header(self, keyword, value):
+        if keyword.lower() == 'content-length':
+            self.response_length = int(value)
+        super().send_header(keyword, value)
+
+    # Paths that would make too many series are folded into one label
+    metrics_path_folds = [
+        (re.compile(r'\.[0-9a-f]{10,64}(\.\w+)$'), r'.<hash>\1'),
+        (re.compile(r'/web_user/.*$'), '/web_user/*'),
+        (re.compile(r'/packages/.*$'), '/packages/*'),
+        (re.compile(r'^/api/upload/.*$'), '/api/upload/*'),
+    ]
+
+    def metrics_path(self):
+        if self.response_status == 404 or not self.path.startswith('/'):
+            return '<not found>'
+        path = urllib.parse.urlsplit(self.path).path
+        for pattern, replacement in self.metrics_path_folds:
+            path = pattern.sub(replacement, path)
+        return path
+
+    def record_metrics(self):
+        metrics = getattr(self.server, 'metrics', None)
+        if metrics is None:
+            return
+        body_sent = self.command != 'HEAD' and self.response_status not in (204, 304)
+        metrics.record_request(self.metrics_path(), self.command or '-', self.response_status,
+                               self.response_length if body_sent else 0,
+                               time.perf_counter() - self.request_start)
+
+    def close_idle(self):
+        """Unblock a connection waiting for its next request so it closes"""
+        try:
+            self.connection.shutdown(socket.SHUT_RD)
+        except OSError:
+            pass
+
+    # Precompressed variants written by build-emscripten.py, in order of preference
+    precompressed_encodings = [("br", ".br"), ("gzip", ".gz")]
+    vary_encoding = False
+
+    def accepted_encodings(self):
+        """Parse Accept-Encoding into the set of codings with a non-zero q-value"""
+        accepted = set()
+        for item in self.headers.get('Accept-Encoding', '').split(','):
+            coding, _, params = item.strip().partition(';')
+            quality = 1.0
+            params = params.strip()
+            if params.startswith('q='):
+                try:
+                    quality = float(params[2:])
+                except ValueError:
+                    quality = 0.0
+            if coding and quality > 0:
+                accepted.add(coding.strip().lower())
+        return accepted
+
+    def select_precompressed(self, path):
+        """Pick the best up-to-date precompressed variant of `path` the client accepts"""
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+        accepted = self.accepted_encodings()
+        for encoding, suffix in self.precompressed_encodings:
+            variant = path + suffix
+            try:
+                fresh = os.stat(variant).st_mtime_ns >= mtime
+            except OSError:
+                continue
+            # Responses differ by Accept-Encoding whenever a variant exists
+            self.vary_encoding = True
+            if fresh and (encoding in accepted or '*' in accepted):
+                return encoding, variant
+        return None
+
+    # Names like ft2-clone.3f9a0c12de.wasm or chunk.<hash>.bin change whenever their content does
+    hashed_name_re = re.compile(r'\.[0-9a-f]{10,64}\.\w+$')
+    # path -> ((mtime, size), digest); a changed file replaces its entry, and the
+    # least recently used paths are dropped (hashed builds keep adding new names)
+    etag_cache = collections.OrderedDict()
+    etag_cache_max_entries = 4096
+    etag_lock = threading.Lock()
+    cache_control = None
+    etag = None
+
+    def cache_control_for(self, path):
+        """Hashed build outputs never change; everything else is revalidated by ETag"""
+        if self.hashed_name_re.search(os.path.basename(path)):
+            return 'public, max-age=31536000, immutable'
+        return 'no-cache'
+
+    def versioned_url_matches(self, digest):
+        """Check a `?v=<sha256 prefix>` query (lazy web_user files) against the file's digest"""
+        query = urllib.parse.urlsplit(self.path).query
+        version = urllib.parse.parse_qs(query).get('v', [''])[0]
+        return len(version) >= 10 and digest.startswith(version)
+
+    def compute_etag(self, path, encoding=None, digest=None):
+        """Strong ETag from the file content, cached per path until its mtime or size changes"""
+        if digest is not None:
+            return f'"{digest}-{encoding}"' if encoding else f'"{digest}"'
+        st = os.stat(path)
+        stamp = (st.st_mtime_ns, st.st_size)
+        with self.etag_lock:
+            entry = self.etag_cache.get(path)
+            if entry and entry[0] == stamp:
+                self.etag_cache.move_to_end(path)
+                digest = entry[1]
+        if digest is None:
+            sha = hashlib.sha256()
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    sha.update(chunk)
+            digest = sha.hexdigest()[:20]
+            with self.etag_lock:
+                self.etag_cache[path] = (stamp, digest)
+                self.etag_cache.move_to_end(path)
+                while len(self.etag_cache) > self.etag_cache_max_entries:
+                    self.etag_cache.popitem(last=False)
+        return f'"{digest}-{encoding}"' if encoding else f'"{digest}"'
+
+    def etag_matches(self, etag):
+        """Check If-None-Match (weak comparison, as RFC 9110 requires for GET/HEAD)"""
+        header = self.headers.get('If-None-Match')
+        if not header:
+            return False
+        if header.strip() == '*':
+            return True
+        for tag in header.split(','):
+            tag = tag.strip()
+            if tag.startswith('W/'):
+                tag = tag[2:]
+            if tag == etag:
+                return True
+        return False
+
+    # More ranges than this in one request are answered with the whole file
+    max_ranges = 16
+    ranges = None
+    range_parts = None
+
+    # The module library catalog endpoint, relative to the served build directory;
+    # create_server() points the catalog at the modules in the upload directory
+    catalog_endpoint = '/api/modules'
+    catalog_modules_dir = os.path.join('web', 'web_user', 'modules')
+    catalog_file = os.path.join('web', 'module-catalog.json')
+    catalog_refresh_interval = 2.0
+    catalog_lock = threading.Lock()
+    catalog_checked = 0.0
+
+    def refresh_catalog(self):
+        """Re-index changed modules, at most once per refresh interval"""
+        cls = FT2HTTPRequestHandler
+        with cls.catalog_lock:
+            now = time.monotonic()
+            if now - cls.catalog_checked < self.catalog_refresh_interval and os.path.exists(self.catalog_file):
+                return True
+            modules_dir = getattr(self.server, 'catalog_modules_dir', self.catalog_modules_dir)
+            if not os.path.isdir(modules_dir):
+                return False
+            # Inline on this request thread: a process pool would hold the lock
+            # (and every other catalog request) while it starts up
+            update_catalog(modules_dir, self.catalog_file, jobs=1)
+            cls.catalog_checked = now
+            return True
+
+    # Upload endpoint: PUT/POST /api/upload/<path>, enabled with --allow-upload
+    upload_endpoint = '/api/upload/'
+    upload_chunk_size = 65536
+    # Where each kind of file goes in the upload directory, by extension
+    # (supportedModExtensions / supportedSmpExtensions in the C sources, plus instruments)
+    upload_kinds = {
+        'modules': {'xm', 'ft', 'nst', 'stk', 'mod', 's3m', 'stm', 'fst', 'digi', 'bem', 'it'},
+        'samples': {'iff', 'raw', 'wav', 'snd', 'smp', 'sam', 'aif', 'pat', 'aiff', 'flac', 'brr'},
+        'instruments': {'xi'},
+    }
+    content_indexes = {}
+    content_indexes_lock = threading.Lock()
+
+    def upload_target(self):
+        """Map the request path to (upload root, relative destination), or send an error"""
+        root = getattr(self.server, 'upload_dir', None)
+        if not root:
+            self.send_error(403, "Uploads are disabled (start the server with --allow-upload)")
+            return None
+        name = urllib.parse.unquote(urllib.parse.urlsplit(self.path).path[len(self.upload_endpoint):])
+        parts = name.split('/')
+        if not name or any(part in ('', '.', '..') or part.startswith('.') or '\\' in part for part in parts):
+            self.send_error(400, "Invalid file name")
+            return None
+        extension = os.path.splitext(parts[-1])[1][1:].lower()
+        for kind, extensions in self.upload_kinds.items():
+            if extension in extensions:
+                return root, f"{kind}/{name}"
+        self.send_error(415, f"Unsupported file type: .{extension}")
+        return None
+
+    def content_index(self, root):
+        with self.content_indexes_lock:
+            index = self.content_indexes.get(root)
+            if index is None:
+                os.makedirs(root, exist_ok=True)
+                index = self.content_indexes[root] = ContentIndex(root, root.rstrip(os.sep) + "-upload-index.json")
+        return index
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def link_existing(self, root, existing, rel):
+        """Give `rel` the content of `existing` without storing it twice"""
+        if existing == rel:
+            return
+        source = os.path.join(root, existing)
+        target = os.path.join(root, rel)
+        if os.path.exists(target) and os.path.samefile(source, target):
+            return
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        tmp = f"{target}.{os.getpid()}.{threading.get_ident()}.link"
+        try:
+            os.link(source, tmp)
+        except OSError:
+            # No hard links here (e.g. across filesystems): fall back to a copy
+            shutil.copyfile(source, tmp)
+        os.replace(tmp, target)
+
+    def deduplicate(self, root, rel, digest):
+        """Reuse already-stored content; returns the response payload, or None if it is new"""
+        index = self.content_index(root)
+        with index.lock:
+            if index.records is None:
+                index.refresh()
+            existing = index.find(digest)
+            if existing is None:
+                return None
+            self.link_existing(root, existing, rel)
+            if existing != rel:
+                index.add(rel, digest)
+        size = os.path.getsize(os.path.join(root, rel))
+        return {"path": rel, "sha256": digest, "size": size, "deduplicated": True}
+
+    def handle_expect_100(self):
+        # A client announcing the hash of content we already have never has to send the body
+        digest = self.headers.get('X-Content-SHA256', '').strip().lower()
+        if self.command in ('PUT', 'POST') and digest and self.path.startswith(self.upload_endpoint):
+            target = self.upload_target()
+            if target is None:
+                self.close_connection = True
+                return False
+            result = self.deduplicate(*target, digest)
+            if result:
+                self.close_connection = True
+                self.send_json(200, result)
+                self.after_upload(target[0], result)
+                return False
+        return super().handle_expect_100()
+
+    def read_body(self):
+        """Yield the request body in bounded chunks (Content-Length or chunked encoding)"""
+        if 'chunked' in self.headers.get('Transfer-Encoding', '').lower():
+            while True:
+                line = self.rfile.readline(1024)
+                if not line.endswith(b'\n'):
+                    raise ValueError("malformed chunk header")
+                size = int(line.split(b';', 1)[0].strip(), 16)
+                if size == 0:
+                    # Skip trailers up to the blank line
+                    while self.rfile.readline(1024) not in (b'\r\n', b'\n', b''):
+                        pass
+                    return
+                while size > 0:
+                    data = self.rfile.read(min(size, self.upload_chunk_size))
+                    if not data:
+                        raise ValueError("connection closed mid-chunk")
+                    size -= len(data)
+                    yield data
+                self.rfile.readline(1024)
+        else:
+            remaining = int(self.headers.get('Content-Length', 0))
+            while remaining > 0:
+                data = self.rfile.read(min(remaining, self.upload_chunk_size))
+                if not data:
+                    raise ValueError("connection closed before the end of the body")
+                remaining -= len(data)
+                yield data
+
+    def handle_upload(self):
+        """Stream an uploaded file to disk, deduplicating by SHA-256"""
+        target = self.upload_target()
+        if target is None:
+            self.close_connection = True
+            return
+        root, rel = target
+        expected = self.headers.get('X-Content-SHA256', '').strip().lower()
+        max_size = getattr(self.server, 'max_upload_size', None)
+        chunked = 'chunked' in self.headers.get('Transfer-Encoding', '').lower()
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+        except ValueError:
+            length = -1
+        if length < 0:
+            self.close_connection = True
+            self.send_error(400, "Invalid Content-Length")
+            return
+        if max_size and length > max_size:
+            self.close_connection = True
+            self.send_error(413, f"Uploads are limited to {max_size} bytes")
+            return
+
+        if expected:
+            result = self.deduplicate(root, rel, expected)
+            if result:
+                # Don't read a body we don't need; the connection can't be reused then
+                if length or chunked:
+                    self.close_connection = True
+                self.send_json(200, result)
+                self.after_upload(root, result)
+                return
+
+        # Without a length the body can't be told apart from an empty file
+        if 'Content-Length' not in self.headers and not chunked:
+            self.close_connection = True
+            self.send_error(411, "Content-Length or chunked Transfer-Encoding required")
+            return
+        if expected and length == 0 and not chunked:
+            self.send_error(412, "Content not on the server; send the file")
+            return
+
+        target_path = os.path.join(root, rel)
+        os.makedirs(os.path.dirname(target_path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(target_path), prefix='.', suffix='.upload')
+        sha = hashlib.sha256()
+        received = 0
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for data in self.read_body():
+                    received += len(data)
+                    if max_size and received > max_size:
+                        raise OverflowError
+                    sha.update(data)
+                    f.write(data)
+        except OverflowError:
+            os.unlink(tmp)
+            self.close_connection = True
+            self.send_error(413, f"Uploads are limited to {max_size} bytes")
+            return
+        except (ValueError, OSError) as e:
+            os.unlink(tmp)
+            self.close_connection = True
+            self.send_error(400, f"Upload failed: {e}")
+            return
+
+        digest = sha.hexdigest()
+        if expected and expected != digest:
+            os.unlink(tmp)
+            self.send_error(400, "Body does not match X-Content-SHA256")
+            return
+
+        result = self.deduplicate(root, rel, digest)
+        if result:
+            os.unlink(tmp)
+            self.send_json(200, result)
+        else:
+            # mkstemp creates the file private; uploads are served like everything else
+            os.chmod(tmp, 0o644)
+            os.replace(tmp, target_path)
+            index = self.content_index(root)
+            with index.lock:
+                index.add(rel, digest)
+            result = {"path": rel, "sha256": digest, "size": received, "deduplicated": False}
+            self.send_json(201, result)
+        self.after_upload(root, result)
+
+    # Files a --lazy-user-files build can fetch, relative to the served build directory
+    user_manifest_file = os.path.join('web', 'web_user-manifest.json')
+    user_manifest_lock = threading.Lock()
+
+    def add_to_user_manifest(self, root, result):
+        """List an upload in the lazy web_user manifest, so the app sees it on its next start"""
+        manifest_file = os.path.abspath(self.user_manifest_file)
+        with self.user_manifest_lock:
+            try:
+                with open(manifest_file, encoding='utf-8') as f:
+                    manifest = json.load(f)
+            except (OSError, ValueError):
+                # Not a lazy build
+                return
+            base_dir = os.path.join(os.path.dirname(manifest_file), manifest.get('base', ''))
+            if os.path.normcase(os.path.abspath(base_dir)) != os.path.normcase(os.path.abspath(root)):
+                # Uploads go somewhere the manifest's URLs don't reach
+                return
+            files = [entry for entry in manifest['files'] if entry['path'] != result['path']]
+            files.append({"path": result['path'], "size": result['size'], "sha256": result['sha256']})
+            manifest['files'] = sorted(files, key=lambda entry: entry['path'])
+            tmp = f"{manifest_file}.{os.getpid()}.tmp"
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(manifest, f, separators=(',', ':'))
+            os.replace(tmp, manifest_file)
+
+    def after_upload(self, root, result):
+        """Make an upload visible to lazy builds and, for modules, in the catalog right away"""
+        self.add_to_user_manifest(root, result)
+        if result["path"].startswith('modules/'):
+            FT2HTTPRequestHandler.catalog_checked = 0.0
+            self.refresh_catalog()
+
+    def do_PUT(self):
+        if not self.path.startswith(self.upload_endpoint):
+            self.send_error(405, "Method not allowed")
+            return
+        self.handle_upload()
+
+    do_POST = do_PUT
+
+    metrics_endpoint = '/metrics'
+
+    def send_metrics(self):
+        """Send the Prometheus text exposition; returns the body as a file for copyfile()"""
+        body = self.server.metrics.render(self.server.metrics_gauges()).encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Cache-Control", "no-store")
+        self.end_headers()
+        return io.BytesIO(body)
+
+    # Server-Sent Events stream for web/live-reload.js; each open tab holds one connection
+    live_reload_endpoint = '/api/live-reload'
+    live_reload_heartbeat = 10.0
+
+    def stream_live_reload(self):
+        """Send the current build stamp, then every new one, until the client goes away"""
+        notifier = self.server.live_reload
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-store")
+        # No Content-Length: the stream ends when the connection does
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        if self.command == 'HEAD':
+            return None
+
+        with notifier.condition:
+            notifier.clients += 1
+            version, data = notifier.version, notifier.data
+        try:
+            # Reconnect quickly after a server restart
+            self.wfile.write(b"retry: 1000\n\n")
+            while True:
+                self.wfile.write(b"event: build\ndata: " + data.encode('utf-8') + b"\n\n")
+                while True:
+                    current, data = notifier.wait(version, self.live_reload_heartbeat)
+                    if notifier.stopped or getattr(self.server, 'draining', False):
+                        return None
+                    if current != version:
+                        version = current
+                        break
+                    # Comment line: keeps proxies and the browser from timing the stream out
+                    self.wfile.write(b": keep-alive\n\n")
+        except OSError:
+            # The tab was closed or reloaded
+            return None
+        finally:
+            with notifier.condition:
+                notifier.clients -= 1
+
+    def send_head(self):
+        self.vary_encoding = False
+        self.cache_control = None
+        self.etag = None
+        self.ranges = None
+        self.range_parts = None
+        if self.path.split('?', 1)[0] == self.metrics_endpoint and hasattr(self.server, 'metrics'):
+            return self.send_metrics()
+        if self.path.split('?', 1)[0] == self.live_reload_endpoint and getattr(self.server, 'live_reload', None):
+            return self.stream_live_reload()
+        if self.path.split('?', 1)[0] == self.catalog_endpoint:
+            if not self.refresh_catalog():
+                self.send_error(404, "Module library not found")
+                return None
+            return self.send_file_head(os.path.abspath(self.catalog_file))
+        path = self.translate_path(self.path)
+        # Directories (listing/index.html/redirect) and trailing-slash 404s stay with the base class
+        if not os.path.isfile(path) or self.path.split('?', 1)[0].endswith('/'):
+            return super().send_head()
+        return self.send_file_head(path)
+
+    def send_file_head(self, path):
+        """Send the headers for a regular file and return it open, or None if no body follows"""
+        self.cache_control = self.cache_control_for(path)
+        encoding, served = self.select_precompressed(path) or (None, path)
+        cache = getattr(self.server, 'artifact_cache', None)
+        cached = cache.get(served) if cache else None
+        try:
+            f = CachedBody(cached.body) if cached else open(served, 'rb')
+        except OSError:
+            self.send_error(404, "File not found")
+            return None
+
+        try:
+            fs = cached.stat if cached else os.fstat(f.fileno())
+            self.etag = self.compute_etag(served, encoding, cached.digest if cached else None)
+            metrics = getattr(self.server, 'metrics', None)
+            if metrics:
+                if self.vary_encoding:
+                    metrics.inc('ft2_http_compressible_responses_total')
+                if encoding:
+                    metrics.inc('ft2_http_compressed_responses_total', (('encoding', encoding),))
+                if 'If-None-Match' in self.headers or 'If-Modified-Since' in self.headers:
+                    metrics.inc('ft2_http_conditional_requests_total')
+            # A URL naming the content hash can be cached like a hashed file name
+            if not encoding and self.versioned_url_matches(self.etag.strip('"')):
+                self.cache_control = 'public, max-age=31536000, immutable'
+            if self.not_modified(fs):
+                if metrics:
+                    metrics.inc('ft2_http_not_modified_total')
+                self.send_response(304)
+                self.end_headers()
+                f.close()
+                return None
+
+            # The type stays the original's, so application/wasm still allows streaming compilation
+            content_type = self.guess_type(path)
+            size = fs.st_size
+            ranges = self.requested_ranges(size, fs.st_mtime)
+            if ranges == []:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{size}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                f.close()
+                return None
+
+            if ranges:
+                self.send_response(206)
+                if len(ranges) == 1:
+                    start, end = ranges[0]
+                    self.send_header("Content-Type", content_type)
+                    self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+                    length = end - start + 1
+                else:
+                    boundary = os.urandom(12).hex()
+                    self.range_parts = []
+                    for start, end in ranges:
+                        delimiter = "\r\n--" if self.range_parts else "--"
+                        self.range_parts.append((f"{delimiter}{boundary}\r\n"
+                                                 f"Content-Type: {content_type}\r\n"
+                                                 f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n").encode('latin-1'))
+                    self.range_parts.append(f"\r\n--{boundary}--\r\n".encode('latin-1'))
+                    self.send_header("Content-Type", f"multipart/byteranges; boundary={boundary}")
+                    length = sum(map(len, self.range_parts)) + sum(end - start + 1 for start, end in ranges)
+                self.ranges = ranges
+            else:
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                length = size
+
+            if encoding:
+                self.send_header("Content-Encoding", encoding)
+            self.send_header("Content-Length", str(length))
+            self.send_header("Accept-Ranges", "bytes")
+            self.send_header("Last-Modified", self.date_time_string(fs.st_mtime))
+            self.end_headers()
+            return f
+        except:
+            f.close()
+            raise
+
+    def not_modified(self, fs):
+        """Evaluate If-None-Match, or If-Modified-Since when no ETag condition was sent"""
+        if 'If-None-Match' in self.headers:
+            return self.etag_matches(self.etag)
+        since = self.headers.get('If-Modified-Since')
+        if since:
+            try:
+                since_time = email.utils.parsedate_to_datetime(since)
+            except (TypeError, ValueError, IndexError, OverflowError):
+                return False
+            if since_time.tzinfo is None:
+                since_time = since_time.replace(tzinfo=datetime.timezone.utc)
+            modified = datetime.datetime.fromtimestamp(int(fs.st_mtime), datetime.timezone.utc)
+            return modified <= since_time
+        return False
+
+    def requested_ranges(self, size, mtime):
+        """Parse Range into inclusive (start, end) pairs.
+
+        Returns None to send the whole file (no/ignored Range or a stale If-Range),
+        or [] when no requested range can be satisfied.
+        """
+        header = self.headers.get('Range')
+        if not header or self.command != 'GET':
+            return None
+        if_range = self.headers.get('If-Range')
+        if if_range and if_range != self.etag and if_range != self.date_time_string(mtime):
+            return None
+
+        unit, _, specs = header.partition('=')
+        if unit.strip().lower() != 'bytes':
+            return None
+        ranges = []
+        for spec in specs.split(','):
+            first, dash, last = spec.strip().partition('-')
+            if not dash or not (first or last) or not (first or '0').isdigit() or not (last or '0').isdigit():
+                return None
+            if not first:
+                # Suffix range: the last N bytes
+                length = int(last)
+                if length > 0 and size > 0:
+                    ranges.append((max(0, size - length), size - 1))
+                continue
+            start = int(first)
+            end = int(last) if last else size - 1
+            if last and end < start:
+                return None
+            if start < size:
+                ranges.append((start, min(end, size - 1)))
+        if len(ranges) > self.max_ranges:
+            return None
+        return ranges
+
+    def copyfile(self, source, outputfile):
+        """Send the body of the current response: whole file, one range or multipart ranges"""
+        ranges, parts = self.ranges, self.range_parts
+        self.ranges = self.range_parts = None
+        if not ranges:
+            self.send_file_range(source, outputfile, 0, None)
+        elif not parts:
+            start, end = ranges[0]
+            self.send_file_range(source, outputfile, start, end - start + 1)
+        else:
+            for header, (start, end) in zip(parts, ranges):
+                outputfile.write(header)
+                self.send_file_range(source, outputfile, start, end - start + 1)
+            outputfile.write(parts[-1])
+
+    def send_file_range(self, source, outputfile, offset, count):
+        """Send part of a file with sendfile(2) when possible, else through a userspace buffer"""
+        if isinstance(source, CachedBody):
+            end = None if count is None else offset + count
+            outputfile.write(source.view[offset:end])
+            return
+        if outputfile is self.wfile and hasattr(self.connection, 'sendfile'):
+            outputfile.flush()
+            # socket.sendfile uses os.sendfile and falls back to send() by itself
+            self.connection.sendfile(source, offset, count)
+            return
+        source.seek(offset)
+        remaining = count
+        while remaining is None or remaining > 0:
+            chunk = source.read(65536 if remaining is None else min(65536, remaining))
+            if not chunk:
+                break
+            outputfile.write(chunk)
+            if remaining is not None:
+                remaining -= len(chunk)
+
+    def end_headers(self):
+        if self.vary_encoding:
+            self.send_header('Vary', 'Accept-Encoding')
+            self.vary_encoding = False
+        if self.etag:
+            self.send_header('ETag', self.etag)
+            self.etag = None
+        if self.cache_control:
+            self.send_header('Cache-Control', self.cache_control)
+            self.cache_control = None
+        super().end_headers()
+
+def add_server_arguments(parser):
+    """Add the options shared by serve.py and serve-web.py"""
+    parser.add_argument('--max-connections', type=int, default=128,
+                        help="maximum concurrent connections; more get 503 (default: 128)")
+    parser.add_argument('--keep-alive-timeout', type=float, default=15.0,
+                        help="seconds an idle keep-alive connection is kept open (default: 15)")
+    parser.add_argument('--grace', type=float, default=5.0,
+                        help="seconds to let in-flight requests finish on shutdown (default: 5)")
+    parser.add_argument('--metrics-json', default=None, metavar='FILE',
+                        help="also dump the /metrics numbers as JSON to FILE periodically")
+    parser.add_argument('--metrics-interval', type=float, default=60.0,
+                        help="seconds between JSON metric dumps (default: 60)")
+    parser.add_argument('--memory-cache', type=parse_size, default=0, metavar='SIZE',
+                        help="keep up to SIZE bytes of file bodies in memory, e.g. 256M (default: off)")
+    parser.add_argument('--memory-cache-max-file', type=parse_size, default=None, metavar='SIZE',
+                        help="largest file kept in the memory cache (default: a quarter of --memory-cache)")
+    parser.add_argument('--no-live-reload', action='store_true',
+                        help=f"disable the {FT2HTTPRequestHandler.live_reload_endpoint} event stream that reloads "
+                             "browsers after build-emscripten.py --watch rebuilds")
+    parser.add_argument('--allow-upload', action='store_true',
+                        help="accept PUT/POST /api/upload/<name> into the upload directory")
+    parser.add_argument('--upload-dir', default=os.path.join('web', 'web_user'),
+                        help="where uploads are stored, relative to the served directory (default: web/web_user)")
+    parser.add_argument('--max-upload-size', type=parse_size, default='1G',
+                        help="largest accepted upload, e.g. 500M (default: 1G)")
+
+def create_server(port, handler_class, args):
+    """Create the concurrent keep-alive server"""
+    httpd = ThreadPoolHTTPServer(("", port), handler_class,
+                                 max_connections=args.max_connections,
+                                 keep_alive_timeout=args.keep_alive_timeout)
+    httpd.catalog_modules_dir = os.path.join(os.path.abspath(args.upload_dir), 'modules')
+    if args.allow_upload:
+        httpd.upload_dir = os.path.abspath(args.upload_dir)
+        httpd.max_upload_size = args.max_upload_size
+    if not args.no_live_reload:
+        httpd.live_reload = LiveReloadNotifier(os.path.abspath(os.path.join('web', LIVE_RELOAD_STAMP)))
+    if args.memory_cache:
+        httpd.artifact_cache = ArtifactCache(args.memory_cache, args.memory_cache_max_file, httpd.metrics)
+    if args.metrics_json:
+        httpd.dump_metrics_periodically(os.path.abspath(args.metrics_json), args.metrics_interval)
+    return httpd
+
+def serve_until_stopped(httpd, grace):
+    """Serve until Ctrl+C or SIGTERM, then shut down gracefully"""
+    def on_sigterm(signum, frame):
+        raise KeyboardInterrupt
+    if threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGTERM, on_sigterm)
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        print("\nStopping server, finishing in-flight requests...")
+        httpd.drain(grace)
+        httpd.write_metrics()
+        print("Server stopped")
 
 # Set up proper MIME types for WebAssembly
-class WebAssemblyHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
+class WebAssemblyHTTPRequestHandler(FT2HTTPRequestHandler):
     def guess_type(self, path):
+        # SimpleHTTPRequestHandler.guess_type returns a bare MIME type string
         mimetype = super().guess_type(path)
-        if isinstance(mimetype, tuple):
-            mimetype, encoding = mimetype
-        else:
-            encoding = None
         
         # Add WebAssembly MIME type
         if path.endswith('.wasm'):
-            return 'application/wasm', encoding
+            return 'application/wasm'
         elif path.endswith('.data'):
-            return 'application/octet-stream', encoding
+            return 'application/octet-stream'
         
-        return mimetype, encoding
+        return mimetype
     
     def end_headers(self):
         # Add CORS headers for local development
@@ -34,16 +1258,17 @@ class WebAssemblyHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
         super().end_headers()
 
 def main():
-    # Default port
-    port = 8000
+    parser = argparse.ArgumentParser(description="Serve the FT2 Clone WebAssembly build")
+    parser.add_argument('port', nargs='?', default='8000', help="port to listen on (default: 8000)")
+    add_server_arguments(parser)
+    args = parser.parse_args()
     
     # Parse command line arguments
-    if len(sys.argv) > 1:
-        try:
-            port = int(sys.argv[1])
-        except ValueError:
-            print(f"Invalid port number: {sys.argv[1]}")
-            sys.exit(1)
+    try:
+        port = int(args.port)
+    except ValueError:
+        print(f"Invalid port number: {args.port}")
+        sys.exit(1)
     
     # Find build directory
     script_dir = Path(__file__).parent
@@ -69,15 +1294,18 @@ def main():
     
     # Start server
     try:
-        with socketserver.TCPServer(("", port), WebAssemblyHTTPRequestHandler) as httpd:
+        with create_server(port, WebAssemblyHTTPRequestHandler, args) as httpd:
             print(f"Serving FT2 Clone at http://localhost:{port}/")
             print(f"Open your browser to: http://localhost:{port}/web/ft2-clone.html")
+            print(f"HTTP/1.1 keep-alive, up to {args.max_connections} concurrent connections")
+            if args.allow_upload:
+                print(f"Accepting uploads at /api/upload/<name> into {httpd.upload_dir}")
+            if httpd.artifact_cache:
+                print(f"Caching up to {args.memory_cache} bytes of file bodies in memory")
             print("Press Ctrl+C to stop the server")
-            httpd.serve_forever()
-    except KeyboardInterrupt:
-        print("\nServer stopped")
+            serve_until_stopped(httpd, args.grace)
     except OSError as e:
-        if e.errno == 48:  # Address already in use
+        if e.errno in (48, errno.EADDRINUSE):  # Address already in use
             print(f"Error: Port {port} is already in use")
             print(f"Try a different port: python3 {sys.argv[0]} {port + 1}")
         else:
@@ -0,0 +1,14 @@
+#!/usr/bin/env python3
+"""
+FastTracker II Clone - Size arguments
+Parses the human-readable sizes (500M, 2G, ...) that build-emscripten.py and the
+servers accept on the command line and in wasm-size-budget.json.
+"""
+
+def parse_size(text):
+    """Parse a size such as 500M or 2G into bytes"""
+    units = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30}
+    text = str(text).strip().upper().rstrip('B')
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
@@ -0,0 +1,104 @@
+/*
+** VFS contents from chunked data packages, for builds made with --chunked-packages.
+**
+** packages/packages.json lists one manifest per package (UI bitmaps, demo
+** modules, sample packs). Manifests and chunks are named after their content
+** and served as immutable, so after an update the browser cache only misses
+** on the chunks that actually changed. Required packages are written to the
+** VFS before main() runs; optional ones (sample packs) load in the background.
+*/
+(function () {
+  var PACKAGES_URL = "packages/";
+
+  function fetchOk(url, options) {
+    return fetch(url, options).then(function (response) {
+      if (!response.ok) throw new Error(url + ": HTTP " + response.status);
+      return response;
+    });
+  }
+
+  function installPackage(manifest, chunks) {
+    manifest.files.forEach(function (file) {
+      var data = new Uint8Array(file.size);
+      var chunk = file.chunk;
+      var offset = file.offset;
+      var filled = 0;
+      while (filled < file.size) {
+        var part = chunks[chunk].subarray(offset, offset + file.size - filled);
+        data.set(part, filled);
+        filled += part.length;
+        chunk++;
+        offset = 0;
+      }
+
+      var path = manifest.mount.replace(/\/$/, "") + "/" + file.path;
+      var slash = path.lastIndexOf("/");
+      var dir = path.substring(0, slash) || "/";
+      if (dir !== "/") FS.createPath("/", dir.substring(1), true, true);
+      try {
+        FS.unlink(path);
+      } catch (e) {
+        // not there yet
+      }
+      FS.createDataFile(dir, path.substring(slash + 1), data, true, true, true);
+    });
+  }
+
+  function loadPackage(entry) {
+    return fetchOk(PACKAGES_URL + entry.manifest)
+      .then(function (response) {
+        return response.json();
+      })
+      .then(function (manifest) {
+        return Promise.all(
+          manifest.chunks.map(function (chunk) {
+            return fetchOk(PACKAGES_URL + chunk.file)
+              .then(function (response) {
+                return response.arrayBuffer();
+              })
+              .then(function (buffer) {
+                return new Uint8Array(buffer);
+              });
+          })
+        ).then(function (chunks) {
+          installPackage(manifest, chunks);
+          console.log("Loaded package " + entry.name + " (" + manifest.files.length + " files)");
+        });
+      });
+  }
+
+  Module["preRun"] = Module["preRun"] || [];
+  if (typeof Module["preRun"] === "function") Module["preRun"] = [Module["preRun"]];
+  Module["preRun"].push(function () {
+    addRunDependency("chunked-packages");
+    fetchOk(PACKAGES_URL + "packages.json", { cache: "no-cache" })
+      .then(function (response) {
+        return response.json();
+      })
+      .then(function (index) {
+        index.packages
+          .filter(function (entry) {
+            return entry.optional;
+          })
+          .forEach(function (entry) {
+            // Sample packs don't hold up startup
+            loadPackage(entry).catch(function (err) {
+              console.error("Could not load package " + entry.name + ":", err);
+            });
+          });
+        return Promise.all(
+          index.packages
+            .filter(function (entry) {
+              return !entry.optional;
+            })
+            .map(loadPackage)
+        );
+      })
+      .catch(function (err) {
+        console.error("Could not load data packages:", err);
+      })
+      .then(function () {
+        removeRunDependency("chunked-packages");
+      });
+  });
+})();
@@ -0,0 +1,106 @@
+/*
+** Lazily populated /home/web_user for builds made with --lazy-user-files.
+**
+** Instead of preloading web_user into ft2-clone.data, the build writes
+** web_user-manifest.json (paths, sizes and hashes). Before main() runs, every
+** file in the manifest is created in the VFS with its real size but no
+** contents, so directory listings in the disk op work immediately. A file is
+** only downloaded the first time it is read or written.
+*/
+(function () {
+  var USER_DIR = "/home/web_user";
+  var MANIFEST_URL = "web_user-manifest.json";
+
+  // Synchronous binary download: FS reads can't wait, and responseType is
+  // not allowed for synchronous requests on the main thread
+  function fetchBytes(url) {
+    var xhr = new XMLHttpRequest();
+    xhr.open("GET", url, false);
+    xhr.overrideMimeType("text/plain; charset=x-user-defined");
+    xhr.send(null);
+    if (!((xhr.status >= 200 && xhr.status < 300) || xhr.status === 304)) {
+      throw new FS.ErrnoError(29); // EIO
+    }
+    var text = xhr.responseText;
+    var bytes = new Uint8Array(text.length);
+    for (var i = 0; i < text.length; i++) {
+      bytes[i] = text.charCodeAt(i) & 0xff;
+    }
+    return bytes;
+  }
+
+  function createLazyFile(path, url, size) {
+    var slash = path.lastIndexOf("/");
+    var node = FS.createFile(path.substring(0, slash), path.substring(slash + 1), {}, true, true);
+    var pending = true;
+
+    function load() {
+      if (!pending) return;
+      var bytes = fetchBytes(url);
+      pending = false;
+      node.contents = bytes;
+      node.usedBytes = bytes.length;
+      console.log("Fetched " + path + " (" + bytes.length + " bytes)");
+    }
+
+    // Report the manifest size until the contents arrive
+    node.contents = null;
+    node.usedBytes = size;
+
+    var stream_ops = {};
+    Object.keys(node.stream_ops).forEach(function (key) {
+      var fn = node.stream_ops[key];
+      stream_ops[key] = key === "llseek" ? fn : function () {
+        load();
+        return fn.apply(null, arguments);
+      };
+    });
+    node.stream_ops = stream_ops;
+
+    // Truncating (e.g. opening with O_TRUNC) must start from the real contents
+    var node_ops = Object.assign({}, node.node_ops);
+    var setattr = node_ops.setattr;
+    node_ops.setattr = function (n, attr) {
+      if (attr.size !== undefined && pending) {
+        if (attr.size === 0) {
+          pending = false;
+          n.contents = null;
+          n.usedBytes = 0;
+        } else {
+          load();
+        }
+      }
+      return setattr(n, attr);
+    };
+    node.node_ops = node_ops;
+  }
+
+  Module["preRun"] = Module["preRun"] || [];
+  if (typeof Module["preRun"] === "function") Module["preRun"] = [Module["preRun"]];
+  Module["preRun"].push(function () {
+    addRunDependency("lazy-user-files");
+    fetch(MANIFEST_URL, { cache: "no-cache" })
+      .then(function (response) {
+        if (!response.ok) throw new Error("HTTP " + response.status);
+        return response.json();
+      })
+      .then(function (manifest) {
+        FS.createPath("/", USER_DIR.substring(1), true, true);
+        manifest.files.forEach(function (file) {
+          var slash = file.path.lastIndexOf("/");
+          if (slash > 0) {
+            FS.createPath(USER_DIR, file.path.substring(0, slash), true, true);
+          }
+          var url = manifest.base + file.path.split("/").map(encodeURIComponent).join("/");
+          createLazyFile(USER_DIR + "/" + file.path, url + "?v=" + file.sha256.substring(0, 10), file.size);
+        });
+        console.log("Registered " + manifest.files.length + " lazily loaded files in " + USER_DIR);
+      })
+      .catch(function (err) {
+        console.error("Could not load " + MANIFEST_URL + ":", err);
+      })
+      .then(function () {
+        removeRunDependency("lazy-user-files");
+      });
+  });
+})();
@@ -0,0 +1,39 @@
+/*
+** Live reload for builds made with build-emscripten.py --watch.
+**
+** After every rebuild the build script rewrites live-reload.json in the web
+** directory. The servers watch that file and push its contents to this page
+** over Server-Sent Events (/api/live-reload). The first message tells us which
+** build is running; any later build number reloads the page, so a rebuild
+** that finished while the server was restarting is picked up on reconnect.
+*/
+(function () {
+  var EVENTS_URL = "/api/live-reload";
+
+  if (typeof EventSource === "undefined" || typeof location === "undefined") return;
+
+  var currentBuild = null;
+  var source = new EventSource(EVENTS_URL);
+
+  source.addEventListener("build", function (event) {
+    var stamp;
+    try {
+      stamp = JSON.parse(event.data);
+    } catch (e) {
+      return;
+    }
+    if (currentBuild === null) {
+      currentBuild = stamp.build;
+    } else if (stamp.build !== currentBuild) {
+      console.log("live-reload: build " + stamp.build + " is ready (" +
+                  (stamp.changed || []).length + " files changed), reloading");
+      source.close();
+      location.reload();
+    }
+  });
+
+  // EventSource reconnects by itself (the server asks for a 1s retry)
+  source.onerror = function () {
+    console.log("live-reload: connection lost, retrying");
+  };
+})();